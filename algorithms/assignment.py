@@ -0,0 +1,142 @@
+# ev_charging_project/algorithms/assignment.py
+# 带容量约束的 用户 -> 充电桩 指派求解 (供 rule_based / coordinated_mas 等批量模式使用)
+
+import logging
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+# scipy.sparse 导入需要约 0.3 秒, 只在第一次真正求解时才加载 (短生命周期的工作进程大多用不到)
+_UNLOADED = object()
+_sparse_solver = _UNLOADED
+
+
+def _get_sparse_solver():
+    """
+    按需导入 scipy 的稀疏二分图最小权完美匹配求解器, 返回 (csr_matrix, min_weight_full_bipartite_matching);
+    scipy 是可选依赖, 缺失时返回 None (退化为贪心求解)
+    """
+    global _sparse_solver
+    if _sparse_solver is _UNLOADED:
+        try:
+            from scipy.sparse import csr_matrix
+            from scipy.sparse.csgraph import min_weight_full_bipartite_matching
+            _sparse_solver = (csr_matrix, min_weight_full_bipartite_matching)
+        except ImportError:
+            _sparse_solver = None
+    return _sparse_solver
+
+# 行不被指派 (匹配到自己的虚拟槽位) 的额外代价。必须远大于任何真实分数, 使求解器优先最大化有效指派数量。
+FORBIDDEN_COST = 1e6
+
+
+def solve_capacitated_assignment(row_idx, col_idx, slot_scores, capacities, n_rows, row_priority=None):
+    """
+    求解带容量约束的最大分数指派问题。
+
+    每个列 (充电桩) c 有 capacities[c] 个空闲槽位; 边 e 连接行 row_idx[e] 与列 col_idx[e],
+    slot_scores[e, s] 表示该行占用该列第 s 个空闲槽位时的得分 (NaN 表示不允许)。
+    槽位相关的得分用于表达 "排在越后面越差" 的排队效应。
+
+    求解时先最大化有效指派数量, 其次最大化 总得分 + 行优先级, 因此在容量不足时
+    row_priority 较高的行 (如明确需要充电的用户) 会优先获得指派。
+
+    Args:
+        row_idx (np.ndarray): (E,) 边的行索引
+        col_idx (np.ndarray): (E,) 边的列索引, 同一 (行, 列) 只能出现一次
+        slot_scores (np.ndarray): (E, S) 每条边在各槽位上的得分
+        capacities (np.ndarray): (C,) 每列的空闲槽位数
+        n_rows (int): 行数
+        row_priority (np.ndarray): 可选, (n_rows,) 行优先级加分
+
+    Returns:
+        np.ndarray: (n_rows,) 每行分配到的列索引, 未分配为 -1
+    """
+    assignment = np.full(n_rows, -1, dtype=np.int64)
+    row_idx = np.asarray(row_idx, dtype=np.int64)
+    col_idx = np.asarray(col_idx, dtype=np.int64)
+    slot_scores = np.asarray(slot_scores, dtype=np.float64).reshape(len(row_idx), -1)
+    capacities = np.asarray(capacities, dtype=np.int64)
+    if n_rows == 0 or len(row_idx) == 0:
+        return assignment
+
+    if row_priority is None:
+        row_priority = np.zeros(n_rows, dtype=np.float64)
+    else:
+        row_priority = np.asarray(row_priority, dtype=np.float64)
+
+    # 每列实际需要展开的槽位数: 不超过容量、得分列数以及连到该列的边数
+    n_cols = capacities.shape[0]
+    edges_per_col = np.bincount(col_idx, minlength=n_cols)
+    col_slots = np.minimum(np.minimum(np.maximum(capacities, 0), slot_scores.shape[1]), edges_per_col)
+    valid_edge = col_slots[col_idx] > 0
+    if not valid_edge.any():
+        return assignment
+
+    solver = _get_sparse_solver()
+    if solver is None:
+        logger.warning("scipy not available, using greedy capacitated assignment.")
+        return _greedy_assignment(row_idx, col_idx, slot_scores, col_slots, n_rows, row_priority)
+    csr_matrix, min_weight_full_bipartite_matching = solver
+
+    col_offsets = np.concatenate(([0], np.cumsum(col_slots)[:-1]))
+    total_slots = int(col_slots.sum())
+
+    # 只保留参与求解的行
+    active_rows = np.unique(row_idx[valid_edge])
+    row_pos = np.full(n_rows, -1, dtype=np.int64)
+    row_pos[active_rows] = np.arange(len(active_rows))
+
+    e_idx = np.nonzero(valid_edge)[0]
+    slots_for_edge = col_slots[col_idx[e_idx]]
+    rep_e = np.repeat(e_idx, slots_for_edge)
+    # 每条边展开出的槽位序号 0..slots-1
+    rep_s = np.arange(len(rep_e)) - np.repeat(np.cumsum(slots_for_edge) - slots_for_edge, slots_for_edge)
+    scores = slot_scores[rep_e, rep_s]
+    allowed = ~np.isnan(scores)
+    rep_e, rep_s, scores = rep_e[allowed], rep_s[allowed], scores[allowed]
+    weights = scores + row_priority[row_idx[rep_e]]
+    if len(weights) == 0:
+        return assignment
+
+    # 稀疏二分图: 行 = 参与求解的用户, 列 = 展开后的充电桩槽位 + 每行一个私有的虚拟 "不指派" 槽位。
+    # 虚拟槽位保证总存在完美匹配; 边权为正 (csr 中的 0 会被视为无边):
+    # 真实边 shift - w, 虚拟边 shift + FORBIDDEN_COST, 因此目标与 "先最大化指派数, 再最大化总得分" 一致。
+    # 只有真实的 (用户, 槽位) 边进入矩阵, 内存和求解时间随边数而不是 用户数 × 槽位数 增长。
+    n_active = len(active_rows)
+    shift = float(weights.max()) + 1.0
+    rows = np.concatenate((row_pos[row_idx[rep_e]], np.arange(n_active)))
+    cols = np.concatenate((col_offsets[col_idx[rep_e]] + rep_s, total_slots + np.arange(n_active)))
+    data = np.concatenate((shift - weights, np.full(n_active, shift + FORBIDDEN_COST)))
+    graph = csr_matrix((data, (rows, cols)), shape=(n_active, total_slots + n_active))
+
+    r, c = min_weight_full_bipartite_matching(graph)
+    ok = c < total_slots
+    slot_to_col = np.repeat(np.arange(n_cols), col_slots)
+    assignment[active_rows[r[ok]]] = slot_to_col[c[ok]]
+    return assignment
+
+
+def _greedy_assignment(row_idx, col_idx, slot_scores, col_slots, n_rows, row_priority):
+    """scipy 不可用时的贪心退化: 按行优先级依次选择当前得分最高且仍有空位的列"""
+    assignment = np.full(n_rows, -1, dtype=np.int64)
+    used = np.zeros(len(col_slots), dtype=np.int64)
+    order = np.argsort(-row_priority, kind="stable")
+    edges_by_row = {}
+    for e, r in enumerate(row_idx):
+        edges_by_row.setdefault(int(r), []).append(e)
+    for r in order:
+        best_col, best_score = -1, float('-inf')
+        for e in edges_by_row.get(int(r), []):
+            c = col_idx[e]
+            s = used[c]
+            if s >= col_slots[c]:
+                continue
+            score = slot_scores[e, s]
+            if not np.isnan(score) and score > best_score:
+                best_col, best_score = c, score
+        if best_col >= 0:
+            assignment[r] = best_col
+            used[best_col] += 1
+    return assignment
@@ -5,11 +5,28 @@ from datetime import datetime
 import math
 import logging
 from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
 # 导入重构后的工具函数
-from simulation.utils import calculate_distance
+from simulation.utils import positions_to_array, iter_distance_chunks, DEFAULT_DISTANCE_CHUNK
+from simulation.hot_logging import get_hot_log
+from .assignment import solve_capacitated_assignment
 
 # Initialize logger for this module
 logger = logging.getLogger("MAS") # 可以保留原名或改为 "CoordMAS"
+hot_log = get_hot_log(logger) # 逐用户的协调事件: 计数 + 限速采样
+
+# 并行评估三个智能体的模式 (scheduler.mas_parallel_mode)
+# 用户/利润智能体的评分是 (用户块 x 充电桩) 的 NumPy 矩阵运算, 运算期间释放 GIL, 因此用线程并行;
+# 不提供进程池: 每步需要把整个状态序列化给每个智能体, 开销超过智能体本身的计算量
+MAS_PARALLEL_MODES = ("off", "thread")
+
+
+def _run_agent(agent, state):
+    """在工作线程中运行单个智能体"""
+    if isinstance(agent, CoordinatedUserSatisfactionAgent):
+        return agent.make_decision(state)
+    return agent.make_decisions(state)
 
 
 class MultiAgentSystem:
@@ -19,6 +36,50 @@ class MultiAgentSystem:
         self.profit_agent = CoordinatedOperatorProfitAgent()
         self.grid_agent = CoordinatedGridFriendlinessAgent()
         self.coordinator = CoordinatedCoordinator()
+        self._executor = None
+        self._executor_mode = None
+
+    def _get_executor(self, mode):
+        """按需创建 (并复用) 线程池"""
+        if self._executor is not None and self._executor_mode != mode:
+            self.shutdown()
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(max_workers=3, thread_name_prefix="mas-agent")
+            self._executor_mode = mode
+            logger.info(f"MAS parallel agent evaluation enabled (mode={mode}).")
+        return self._executor
+
+    def shutdown(self):
+        """关闭并行评估使用的线程池"""
+        if self._executor is not None:
+            self._executor.shutdown(wait=True)
+            self._executor = None
+            self._executor_mode = None
+
+    def _run_agents(self, state):
+        """
+        运行三个智能体，返回 (user_decisions, profit_decisions, grid_decisions)。
+
+        三个智能体只读取同一份状态且互不依赖，并行模式下同时提交，按固定顺序收集结果，
+        因此合并结果与串行模式完全一致。线程模式的加速来自用户/利润智能体的批量 NumPy 评分
+        (释放 GIL); 单核机器或用户很少时没有收益, 默认关闭。
+        """
+        agents = (self.user_agent, self.profit_agent, self.grid_agent)
+        mode = self.config.get('scheduler', {}).get('mas_parallel_mode', 'off')
+        if mode not in MAS_PARALLEL_MODES:
+            logger.warning(f"Unknown mas_parallel_mode '{mode}'. Running agents sequentially.")
+            mode = "off"
+
+        if mode != "off":
+            try:
+                executor = self._get_executor(mode)
+                futures = [executor.submit(_run_agent, agent, state) for agent in agents]
+                return tuple(f.result() for f in futures)
+            except Exception as e:
+                logger.error(f"Parallel MAS agent evaluation failed ({mode}): {e}. Falling back to sequential.", exc_info=True)
+                self.shutdown()
+
+        return tuple(_run_agent(agent, state) for agent in agents)
 
     def make_decisions(self, state):
         """
@@ -30,10 +91,11 @@ class MultiAgentSystem:
         Returns:
             decisions: Dict mapping user_ids to charger_ids
         """
+        # 利润智能体需要电网价格配置
+        self.profit_agent.config = self.config
+
         # Get decisions from each agent
-        user_decisions = self.user_agent.make_decision(state)
-        profit_decisions = self.profit_agent.make_decisions(state)
-        grid_decisions = self.grid_agent.make_decisions(state)
+        user_decisions, profit_decisions, grid_decisions = self._run_agents(state)
 
         # Store decisions for analysis and visualization
         self.user_agent.last_decision = user_decisions
@@ -45,6 +107,7 @@ class MultiAgentSystem:
         coordinator_weights = self.config.get('scheduler', {}).get('optimization_weights', {})
         if coordinator_weights:
              self.coordinator.set_weights(coordinator_weights)
+        self.coordinator.resolution_mode = self.config.get('scheduler', {}).get('mas_conflict_resolution', 'voting')
 
         final_decisions = self.coordinator.resolve_conflicts(
             user_decisions, profit_decisions, grid_decisions, state
@@ -77,22 +140,29 @@ class CoordinatedUserSatisfactionAgent:
             logger.warning(f"UserAgent: Invalid timestamp format: {timestamp_str}")
             return recommendations
 
+        # 与用户无关的充电桩属性每步只计算一次
+        charger_table = self._build_charger_table(chargers, state)
+        threshold = self._get_charging_threshold(timestamp.hour)
+
         # Make recommendations for each user who needs charging
+        candidates = []
         for user in users:
             user_id = user.get("user_id")
             soc = user.get("soc", 100)
             # 检查用户是否明确需要充电或SOC低于阈值
             needs_charge = user.get("needs_charge_decision", False)
-            threshold = self._get_charging_threshold(timestamp.hour)
 
             if not user_id: continue
             # 只考虑状态不是充电/等待，且 (明确需要 或 SOC低于阈值) 的用户
             if user.get("status") not in ["charging", "waiting"] and (needs_charge or soc < threshold):
                  # 并且电量不是太满 (例如，避免只差一点点就推荐)
                  if soc < 90: # 增加一个上限，避免为接近满电的用户推荐
-                    best_charger_info = self._find_best_charger_for_user(user, chargers, state)
-                    if best_charger_info:
-                        recommendations[user_id] = best_charger_info["charger_id"]
+                    candidates.append(user)
+
+        # 所有候选用户一起评分, 每个用户取加权成本最低的充电桩
+        for user, best_idx in zip(candidates, self._find_best_chargers_for_users(candidates, charger_table)):
+            if best_idx >= 0:
+                recommendations[user["user_id"]] = charger_table["chargers"][best_idx]["charger_id"]
 
         self.last_decision = recommendations
         return recommendations
@@ -104,57 +174,66 @@ class CoordinatedUserSatisfactionAgent:
         else:
             return 45 # 夜间阈值更高，抓住夜间充电机会
 
-    def _find_best_charger_for_user(self, user, chargers, state):
-        best_charger = None
-        min_weighted_cost = float('inf')
-        user_pos = user.get("current_position", {"lat": 0, "lng": 0})
-        # 使用 .get 获取敏感度，并提供默认值
-        time_sensitivity = user.get("time_sensitivity", 0.5)
-        price_sensitivity = user.get("price_sensitivity", 0.5)
-        grid_status = state.get("grid_status", {}) # 获取电网状态以获取价格
-        current_price = grid_status.get("current_price", 0.85) # Use safe access
-
-        for charger in chargers:
-            # Skip failed chargers
-            if charger.get("status") == "failure": continue
-
-            charger_pos = charger.get("position", {"lat": 0, "lng": 0})
-            # 使用导入的 calculate_distance
-            distance = calculate_distance(user_pos, charger_pos)
-            travel_time = distance * 2 # Simple estimate: 2 min/km
-
+    def _build_charger_table(self, chargers, state):
+        """构建本步的充电桩表: 位置、预计等待时间和价格乘数 (与用户无关)"""
+        active_chargers = [c for c in chargers if c.get("status") != "failure"] # Skip failed chargers
+        wait_times = []
+        for charger in active_chargers:
             queue_length = len(charger.get("queue", []))
             # Estimate wait time based on type and queue
             base_wait_per_user = 10 if charger.get("type") == "fast" else 20
             wait_time = queue_length * base_wait_per_user
             if charger.get("status") == "occupied":
                 wait_time += base_wait_per_user / 2 # Add partial wait for current user
+            wait_times.append(wait_time)
 
-            # Estimate charging cost (simplified)
-            charge_needed = user.get("battery_capacity", 60) * (1 - user.get("soc", 50)/100)
+        grid_status = state.get("grid_status", {}) # 获取电网状态以获取价格
+        return {
+            "chargers": active_chargers,
+            "coords": positions_to_array([c.get("position", {"lat": 0, "lng": 0}) for c in active_chargers]),
+            "wait_time": np.array(wait_times, dtype=np.float64),
             # 使用充电桩特定的价格乘数
-            price_multiplier = charger.get("price_multiplier", 1.0)
-            est_cost = charge_needed * current_price * price_multiplier
+            "price_multiplier": np.array([c.get("price_multiplier", 1.0) for c in active_chargers], dtype=np.float64),
+            "current_price": grid_status.get("current_price", 0.85), # Use safe access
+        }
+
+    def _find_best_chargers_for_users(self, users, charger_table):
+        """
+        返回每个用户加权成本最低的充电桩在 charger_table 中的下标 (没有有限成本的充电桩时为 -1)。
+        按用户分块计算 (用户块 x 充电桩) 的成本矩阵, 峰值内存为 DEFAULT_DISTANCE_CHUNK x 充电桩数。
+        """
+        best = np.full(len(users), -1, dtype=np.int64)
+        if not users or not charger_table["chargers"]:
+            return best
+        user_coords = positions_to_array([user.get("current_position", {"lat": 0, "lng": 0}) for user in users])
+        # 使用 .get 获取敏感度，并提供默认值; 非数值的敏感度按 0.5 处理
+        sensitivities = np.array([[s if isinstance(s, (int, float)) else 0.5
+                                   for s in (user.get("time_sensitivity", 0.5), user.get("price_sensitivity", 0.5))]
+                                  for user in users], dtype=np.float64)
+        # Estimate charging cost (simplified)
+        charge_needed = np.array([user.get("battery_capacity", 60) * (1 - user.get("soc", 50)/100) for user in users], dtype=np.float64)
+
+        # 与 calculate_distance 一致的批量距离
+        for start, distance in iter_distance_chunks(user_coords, charger_table["coords"], method="planar"):
+            rows = slice(start, start + distance.shape[0])
+            travel_time = distance * 2 # Simple estimate: 2 min/km
+            est_cost = (charge_needed[rows, np.newaxis] * charger_table["current_price"]) * charger_table["price_multiplier"]
 
             # Weighted cost: lower is better
-            time_cost = travel_time + wait_time
+            time_cost = travel_time + charger_table["wait_time"]
             # Scale cost relative to typical max cost (e.g., 50 yuan)
             price_cost = est_cost / 50.0
+            weighted_cost = (time_cost * sensitivities[rows, 0:1]) + (price_cost * sensitivities[rows, 1:2])
+            weighted_cost = np.where(np.isnan(weighted_cost), np.inf, weighted_cost)
 
-            # 确保敏感度是有效数字
-            if not isinstance(time_sensitivity, (int, float)): time_sensitivity = 0.5
-            if not isinstance(price_sensitivity, (int, float)): price_sensitivity = 0.5
-
-            weighted_cost = (time_cost * time_sensitivity) + (price_cost * price_sensitivity)
-
-            if weighted_cost < min_weighted_cost:
-                min_weighted_cost = weighted_cost
-                best_charger = charger
-
-        return best_charger
+            best_idx = np.argmin(weighted_cost, axis=1)
+            finite = np.isfinite(weighted_cost[np.arange(len(best_idx)), best_idx])
+            best[rows] = np.where(finite, best_idx, -1)
+        return best
 
 class CoordinatedOperatorProfitAgent:
     def __init__(self):
+        self.config = {} # 由 MultiAgentSystem 填充 (峰谷电价)
         self.last_decision = {}
         self.last_reward = 0
 
@@ -184,7 +263,11 @@ class CoordinatedOperatorProfitAgent:
         valley_hours = grid_status.get("valley_hours", [0, 1, 2, 3, 4, 5])
         base_price = grid_status.get("current_price", 0.85) # Use current grid price
 
+        # 充电桩的利润潜力 (不含用户需求量加分) 每步只计算一次
+        profit_table = self._build_charger_profit_table(chargers, base_price, peak_hours, valley_hours, hour)
+
         # Make profit-oriented recommendations
+        candidates = []
         for user in users:
             user_id = user.get("user_id")
             soc = user.get("soc", 100)
@@ -194,34 +277,32 @@ class CoordinatedOperatorProfitAgent:
             # 考虑所有未充电/等待的用户，利润优先不只看低电量
             # 但可以稍微优先电量低一点的用户 (需要充电量大)
             if soc < 95: # 只要不是满电都考虑
-                best_charger_info = self._find_most_profitable_charger(user, chargers, base_price, peak_hours, valley_hours, hour)
-                if best_charger_info:
-                    recommendations[user_id] = best_charger_info["charger_id"]
+                candidates.append(user)
+
+        for user, best_idx in zip(candidates, self._find_most_profitable_chargers(candidates, profit_table)):
+            recommendations[user["user_id"]] = profit_table["chargers"][best_idx]["charger_id"]
 
         self.last_decision = recommendations
         return recommendations
 
-    def _find_most_profitable_charger(self, user, chargers, base_price, peak_hours, valley_hours, hour):
-        best_charger = None
-        max_profit_score = float('-inf')
-
+    def _build_charger_profit_table(self, chargers, base_price, peak_hours, valley_hours, hour):
+        """计算每个可用充电桩与用户无关的利润潜力"""
+        # 根据时间调整基础价格
+        price_at_charger_time = base_price # 默认使用当前电价
+        if hour in peak_hours:
+             # 如果已经是峰时电价，不再乘，否则用峰时电价
+             price_at_charger_time = max(base_price, self.config.get('grid',{}).get('peak_price', 1.2))
+        elif hour in valley_hours:
+             # 如果已经是谷时电价，不再乘，否则用谷时电价
+             price_at_charger_time = min(base_price, self.config.get('grid',{}).get('valley_price', 0.4))
+
+        active_chargers = []
+        potentials = []
         for charger in chargers:
             if charger.get("status") == "failure": continue
 
-            # 使用充电桩自身的价格乘数
-            charger_price_multiplier = charger.get("price_multiplier", 1.0)
-
-            # 根据时间调整基础价格
-            price_at_charger_time = base_price # 默认使用当前电价
-            if hour in peak_hours:
-                 # 如果已经是峰时电价，不再乘，否则用峰时电价
-                 price_at_charger_time = max(base_price, self.config.get('grid',{}).get('peak_price', 1.2))
-            elif hour in valley_hours:
-                 # 如果已经是谷时电价，不再乘，否则用谷时电价
-                 price_at_charger_time = min(base_price, self.config.get('grid',{}).get('valley_price', 0.4))
-
             # 最终充电价格 = 时段价格 * 充电桩乘数
-            effective_charge_price = price_at_charger_time * charger_price_multiplier
+            effective_charge_price = price_at_charger_time * charger.get("price_multiplier", 1.0)
 
             # 利润潜力评分：价格越高越好，快充更好，队列越短越好
             profit_potential = effective_charge_price # Base score is the price
@@ -234,15 +315,23 @@ class CoordinatedOperatorProfitAgent:
             queue_length = len(charger.get("queue", []))
             profit_potential /= (1 + queue_length * 0.25) # Stronger penalty for queue
 
-            # Bonus for users needing more charge
-            charge_needed_factor = (100 - user.get("soc", 50)) / 50.0 # Normalize needed charge (0-2 approx)
-            profit_potential *= (1 + charge_needed_factor * 0.1) # Small bonus for higher need
+            active_chargers.append(charger)
+            potentials.append(profit_potential)
 
-            if profit_potential > max_profit_score:
-                max_profit_score = profit_potential
-                best_charger = charger
+        return {"chargers": active_chargers, "potential": np.array(potentials, dtype=np.float64)}
 
-        return best_charger
+    def _find_most_profitable_chargers(self, users, profit_table):
+        """返回每个用户利润评分最高的充电桩在 profit_table 中的下标 (按用户分块计算评分矩阵)"""
+        if not users or not profit_table["chargers"]:
+            return np.empty(0, dtype=np.int64)
+        # Bonus for users needing more charge
+        charge_needed_factor = np.array([(100 - user.get("soc", 50)) / 50.0 for user in users], dtype=np.float64) # Normalize needed charge (0-2 approx)
+        best = np.empty(len(users), dtype=np.int64)
+        for start in range(0, len(users), DEFAULT_DISTANCE_CHUNK):
+            rows = slice(start, start + DEFAULT_DISTANCE_CHUNK)
+            profit_scores = profit_table["potential"] * (1 + charge_needed_factor[rows, np.newaxis] * 0.1) # Small bonus for higher need
+            best[rows] = np.argmax(profit_scores, axis=1)
+        return best
 
 
 class CoordinatedGridFriendlinessAgent:
@@ -295,6 +384,18 @@ class CoordinatedGridFriendlinessAgent:
         # 按紧迫度排序，最紧急的优先
         charging_candidates.sort(key=lambda x: -x[2])
 
+        # 电网评分只依赖时间和全局电网状态，每步计算一次
+        # 时间分数：低谷>平峰>高峰
+        time_score = 0
+        if hour in valley_hours: time_score = 1.0
+        elif hour not in peak_hours: time_score = 0.5
+        # 可再生能源分数
+        renewable_score = renewable_ratio / 100.0 # 0-1
+        # 负载分数：负载越低越好
+        load_score = max(0, 1 - (grid_load_percentage / 100.0)) # 0-1
+        # 组合评分 (调整权重，优先时间，其次负载，再可再生)
+        step_grid_score = time_score * 0.5 + load_score * 0.3 + renewable_score * 0.2
+
         # 对每个充电桩进行评分
         charger_scores = {}
         max_queue_len = 4 # 电网优先时允许的稍长队列
@@ -304,20 +405,7 @@ class CoordinatedGridFriendlinessAgent:
                 if charger.get("status") == "occupied": current_queue_len += 1
 
                 if current_queue_len < max_queue_len:
-                    # 时间分数：低谷>平峰>高峰
-                    time_score = 0
-                    if hour in valley_hours: time_score = 1.0
-                    elif hour not in peak_hours: time_score = 0.5
-
-                    # 可再生能源分数
-                    renewable_score = renewable_ratio / 100.0 # 0-1
-
-                    # 负载分数：负载越低越好
-                    load_score = max(0, 1 - (grid_load_percentage / 100.0)) # 0-1
-
-                    # 组合评分 (调整权重，优先时间，其次负载，再可再生)
-                    grid_score = time_score * 0.5 + load_score * 0.3 + renewable_score * 0.2
-                    charger_scores[charger_id] = grid_score
+                    charger_scores[charger_id] = step_grid_score
 
         # 按电网友好度分数排序可用充电桩
         available_chargers = sorted(charger_scores.items(), key=lambda item: -item[1])
@@ -363,6 +451,9 @@ class CoordinatedCoordinator:
         self.weights = {"user": 0.4, "profit": 0.3, "grid": 0.3}
         self.conflict_history = []
         self.last_agent_rewards = {}
+        # 'voting': 按用户 ID 顺序逐个加权投票; 'matching': 一次性求解带容量约束的加权匹配
+        self.resolution_mode = "voting"
+        self.max_queue_len = 4 # 协调器使用的队列长度限制
 
     def set_weights(self, weights):
         """Set agent weights from config"""
@@ -380,6 +471,8 @@ class CoordinatedCoordinator:
 
     def resolve_conflicts(self, user_decisions, profit_decisions, grid_decisions, state):
         """Resolve conflicts between agent decisions using weighted voting and capacity checks."""
+        if self.resolution_mode == "matching":
+            return self.resolve_conflicts_matching(user_decisions, profit_decisions, grid_decisions, state)
         final_decisions = {}
         conflict_count = 0
         all_users = set(user_decisions.keys()) | set(profit_decisions.keys()) | set(grid_decisions.keys())
@@ -392,7 +485,7 @@ class CoordinatedCoordinator:
         chargers_state = {c['charger_id']: c for c in chargers_list if 'charger_id' in c}
         # 初始化分配计数，考虑当前实际排队和占用情况
         assigned_count = defaultdict(int)
-        max_queue_len_config = 4 # 协调器使用的队列长度限制，可以配置
+        max_queue_len_config = self.max_queue_len # 协调器使用的队列长度限制，可以配置
         for cid, charger in chargers_state.items():
             if charger.get('status') == 'occupied':
                 assigned_count[cid] += 1
@@ -425,11 +518,11 @@ class CoordinatedCoordinator:
                 if charger_id in chargers_state:
                     charger_votes[charger_id] += weight
                 else:
-                     logger.warning(f"Coordinator: Recommended charger {charger_id} for user {user_id} not found in current state. Ignoring vote.")
+                     hot_log.event("unknown_charger_vote", logging.WARNING, "Coordinator: Recommended charger %s for user %s not found in current state. Ignoring vote.", charger_id, user_id)
 
 
             if not charger_votes: # 如果所有推荐的充电桩都不存在
-                 logger.warning(f"Coordinator: No valid recommended chargers found for user {user_id}.")
+                 hot_log.event("no_valid_votes", logging.WARNING, "Coordinator: No valid recommended chargers found for user %s.", user_id)
                  continue
 
             # 按票数排序
@@ -445,10 +538,10 @@ class CoordinatedCoordinator:
                         final_decisions[user_id] = best_charger_id
                         assigned_count[best_charger_id] += 1 # 更新本轮分配计数
                         assigned = True
-                        logger.debug(f"Coordinator assigned user {user_id} to charger {best_charger_id} (Votes: {vote_score:.2f}, Queue now: {assigned_count[best_charger_id]})")
+                        hot_log.event("assigned", logging.DEBUG, "Coordinator assigned user %s to charger %s (Votes: %.2f, Queue now: %d)", user_id, best_charger_id, vote_score, assigned_count[best_charger_id])
                         break # 用户已分配
                     else:
-                         logger.debug(f"Coordinator: Charger {best_charger_id} (top vote for user {user_id}) is in failure state. Trying next.")
+                         hot_log.event("failed_charger_vote", logging.DEBUG, "Coordinator: Charger %s (top vote for user %s) is in failure state. Trying next.", best_charger_id, user_id)
                 # else:
                     # logger.debug(f"Coordinator: Charger {best_charger_id} (top vote for user {user_id}) is full (Current count: {assigned_count.get(best_charger_id, 0)}). Trying next.")
 
@@ -458,4 +551,67 @@ class CoordinatedCoordinator:
 
         self.conflict_history.append(conflict_count)
         logger.info(f"Coordinator resolved decisions: {len(final_decisions)} assignments made, {conflict_count} conflicts encountered.")
-        return final_decisions
\ No newline at end of file
+        return final_decisions
+
+    def resolve_conflicts_matching(self, user_decisions, profit_decisions, grid_decisions, state):
+        """
+        基于加权二分匹配的冲突消解。
+
+        三个智能体的推荐被转换为 (用户, 充电桩) 边, 边权为推荐该组合的智能体权重之和;
+        每个充电桩的容量为队列上限减去当前负载。一次性求解使有效分配数量最大、其次总票数最大,
+        结果与用户处理顺序无关。充电桩负载 (占用 + 排队人数) 只在这里按需从队列计算。
+        """
+        final_decisions = {}
+        chargers_list = state.get('chargers', [])
+        if not chargers_list:
+             logger.error("Coordinator: No chargers found in state.")
+             return {}
+
+        charger_loads = {}
+        for charger in chargers_list:
+            if 'charger_id' not in charger: continue
+            charger_loads[charger['charger_id']] = (1 if charger.get('status') == 'occupied' else 0) + len(charger.get('queue', []))
+
+        # 只有非故障且仍有空位的充电桩参与匹配
+        charger_index = {}
+        capacities = []
+        for charger in chargers_list:
+            cid = charger.get('charger_id')
+            if cid is None or charger.get('status') == 'failure': continue
+            free = self.max_queue_len - charger_loads.get(cid, 0)
+            if free > 0:
+                charger_index[cid] = len(capacities)
+                capacities.append(free)
+
+        user_list = sorted(set(user_decisions) | set(profit_decisions) | set(grid_decisions))
+        conflict_count = 0
+        row_idx, col_idx, votes = [], [], []
+        sources = (
+            (user_decisions, self.weights.get("user", 0)),
+            (profit_decisions, self.weights.get("profit", 0)),
+            (grid_decisions, self.weights.get("grid", 0)),
+        )
+        for i, user_id in enumerate(user_list):
+            charger_votes = defaultdict(float)
+            for decisions, weight in sources:
+                if user_id in decisions:
+                    charger_votes[decisions[user_id]] += weight
+            if len(charger_votes) > 1: conflict_count += 1
+            for charger_id, vote in charger_votes.items():
+                if charger_id in charger_index:
+                    row_idx.append(i)
+                    col_idx.append(charger_index[charger_id])
+                    votes.append(vote)
+
+        if row_idx:
+            max_slots = min(self.max_queue_len, max(capacities))
+            slot_scores = np.repeat(np.array(votes, dtype=np.float64)[:, np.newaxis], max_slots, axis=1)
+            assignment = solve_capacitated_assignment(row_idx, col_idx, slot_scores, np.array(capacities), len(user_list))
+            charger_ids = list(charger_index)
+            for i, c in enumerate(assignment):
+                if c >= 0:
+                    final_decisions[user_list[i]] = charger_ids[c]
+
+        self.conflict_history.append(conflict_count)
+        logger.info(f"Coordinator (matching) resolved decisions: {len(final_decisions)} assignments made, {conflict_count} conflicts encountered.")
+        return final_decisions
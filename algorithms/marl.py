@@ -1,5 +1,6 @@
 # ev_charging_project/algorithms/marl.py
 # (内容来自原 marl_components.py, 并移除末尾重复类)
+# 唯一的 MARL 实现: 调度器、离线训练以及 marl_components.py 兼容层都使用本模块。
 
 import numpy as np
 import random
@@ -9,20 +10,42 @@ from collections import defaultdict
 import logging
 from datetime import datetime
 import math
+import re
 # 导入重构后的工具函数
 from simulation.utils import calculate_distance # 确保导入路径正确
+from simulation.hot_logging import get_hot_log
+from .replay_buffer import create_replay_buffer
 
 logger = logging.getLogger("MARL")
+hot_log = get_hot_log(logger) # 逐智能体/逐动作事件: 计数 + 限速采样
+
+# Optimistic initial Q-values (formerly MARLSystem._initialize_q_tables_with_bias in marl_components.py):
+# unseen states start with idle below the assignment actions so that agents try assigning users.
+DEFAULT_Q_BIAS = {"idle": 0.1, "action": 0.5}
+
+def initial_q_row(action_space_size, q_bias=None):
+    """Initial Q-values of an unseen state: zeros, or idle/action values from q_bias."""
+    row = np.zeros(action_space_size)
+    if q_bias is True:
+        q_bias = DEFAULT_Q_BIAS
+    if q_bias:
+        row[0] = q_bias.get("idle", DEFAULT_Q_BIAS["idle"])
+        row[1:] = q_bias.get("action", DEFAULT_Q_BIAS["action"])
+    return row
 
 class MARLAgent:
     """Represents a single agent (e.g., a charging station) using Q-learning."""
-    def __init__(self, agent_id, action_space_size, learning_rate=0.1, discount_factor=0.9, exploration_rate=0.1):
+    def __init__(self, agent_id, action_space_size, learning_rate=0.1, discount_factor=0.9, exploration_rate=0.1, q_bias=None):
         self.agent_id = agent_id
         self.action_space_size = action_space_size
         self.lr = learning_rate
         self.gamma = discount_factor
         self.epsilon = exploration_rate
-        self.q_table = defaultdict(lambda: np.zeros(self.action_space_size))
+        self.initial_q = initial_q_row(action_space_size, q_bias)
+        self.q_table = defaultdict(self._new_row)
+
+    def _new_row(self):
+        return self.initial_q.copy()
 
     def choose_action(self, state, current_action_map):
         """Choose action using epsilon-greedy strategy based on the current valid actions."""
@@ -30,12 +53,12 @@ class MARLAgent:
 
         # Ensure Q-table entry exists and has the correct size
         if len(self.q_table[state_str]) != self.action_space_size:
-            logger.warning(f"Q-table size mismatch for agent {self.agent_id} state {state_str}. Expected {self.action_space_size}, got {len(self.q_table[state_str])}. Resetting.")
-            self.q_table[state_str] = np.zeros(self.action_space_size)
+            hot_log.event("q_row_size_mismatch", logging.WARNING, "Q-table size mismatch for agent %s state %s. Expected %d, got %d. Resetting.", self.agent_id, state_str, self.action_space_size, len(self.q_table[state_str]))
+            self.q_table[state_str] = self._new_row()
 
         valid_action_indices = list(current_action_map.keys())
         if not valid_action_indices:
-            logger.warning(f"Agent {self.agent_id} has no valid actions in state {state_str}.")
+            hot_log.event("no_valid_actions", logging.WARNING, "Agent %s has no valid actions in state %s.", self.agent_id, state_str)
             return current_action_map.get(0, 'idle'), 0 # Default to idle
 
         if random.uniform(0, 1) < self.epsilon:
@@ -55,25 +78,27 @@ class MARLAgent:
         chosen_action = current_action_map.get(action_index, 'idle') # Safely get action
         return chosen_action, action_index
 
-    def update_q_table(self, state, action_index, reward, next_state):
-        """Update Q-value for the state-action pair."""
+    def update_q_table(self, state, action_index, reward, next_state, weight=1.0):
+        """Update Q-value for the state-action pair. Returns the TD error (weight scales the step, e.g. importance sampling)."""
         if not (0 <= action_index < self.action_space_size):
             logger.error(f"Invalid action_index {action_index} for agent {self.agent_id} (size {self.action_space_size}). State: {state}")
-            return
+            return 0.0
 
         state_str = self._state_to_string(state)
         next_state_str = self._state_to_string(next_state)
 
         # Ensure next state entry exists
         if len(self.q_table[next_state_str]) != self.action_space_size:
-             self.q_table[next_state_str] = np.zeros(self.action_space_size)
+             self.q_table[next_state_str] = self._new_row()
 
         old_value = self.q_table[state_str][action_index]
         next_max = np.max(self.q_table[next_state_str])
 
         # Q-learning formula
-        new_value = old_value + self.lr * (reward + self.gamma * next_max - old_value)
+        td_error = reward + self.gamma * next_max - old_value
+        new_value = old_value + self.lr * weight * td_error
         self.q_table[state_str][action_index] = new_value
+        return td_error
 
     def _state_to_string(self, state):
         """Convert state dictionary to a hashable string."""
@@ -87,7 +112,7 @@ class MARLAgent:
             try:
                 with open(file_path, 'rb') as f:
                     loaded_q_dict = pickle.load(f)
-                    self.q_table = defaultdict(lambda: np.zeros(self.action_space_size))
+                    self.q_table = defaultdict(self._new_row)
                     for state_key, q_values in loaded_q_dict.items():
                         if len(q_values) == self.action_space_size:
                             self.q_table[state_key] = np.array(q_values)
@@ -171,10 +196,325 @@ def get_agent_state(charger_id, global_state):
     }
     return state
 
-# Note: The `create_dynamic_action_map` function used by MARL is now defined
-# within the `ChargingScheduler` class in `simulation/scheduler.py` because
-# it might need access to the scheduler's config or state more easily.
-# If you prefer it here, you'll need to pass `config` to it.
+# --- Dense state encoding (used by the shared Q-table in marl_training) ---
+# Each feature of get_agent_state() is a small bounded integer, so the whole
+# agent state can be packed into one index (mixed radix) of a dense Q array.
+STATE_FEATURES = ("status", "queue", "hour_discrete", "grid_load_cat", "renew_cat", "nearby_demand_cat")
+STATE_FEATURE_SIZES = (3, 4, 6, 3, 3, 3)
+NUM_ENCODED_STATES = int(np.prod(STATE_FEATURE_SIZES))
+
+def encode_agent_state(agent_state):
+    """Packs an agent state dict into an integer in [0, NUM_ENCODED_STATES), or -1 if the state is empty."""
+    if not agent_state:
+        return -1
+    index = 0
+    for feature, size in zip(STATE_FEATURES, STATE_FEATURE_SIZES):
+        value = int(agent_state.get(feature, 0))
+        index = index * size + min(max(value, 0), size - 1)
+    return index
+
+def encode_agent_states(global_state):
+    """
+    Vectorized get_agent_state + encode_agent_state for every charger in global_state.
+
+    Returns (charger_ids, codes) where codes[i] is the encoded state of charger_ids[i];
+    the features are computed exactly as in get_agent_state.
+    """
+    chargers = [c for c in global_state.get('chargers', []) if isinstance(c, dict) and 'charger_id' in c]
+    charger_ids = [c['charger_id'] for c in chargers]
+    if not chargers:
+        return charger_ids, np.zeros(0, dtype=np.int32)
+
+    status_map = {'available': 0, 'occupied': 1, 'failure': 2}
+    status = np.array([status_map.get(c.get('status', 'available'), 0) for c in chargers], dtype=np.int64)
+    queue = np.minimum([len(c.get('queue', [])) for c in chargers], 3)
+
+    hour_of_day = 0
+    try:
+        timestamp_str = global_state.get('timestamp')
+        if timestamp_str: hour_of_day = datetime.fromisoformat(timestamp_str).hour
+    except: pass
+    grid_status = global_state.get('grid_status', {})
+    grid_load_percentage = grid_status.get('grid_load_percentage', 50)
+    renewable_ratio = grid_status.get('renewable_ratio', 0)
+    grid_load_cat = 2 if grid_load_percentage > 80 else 1 if grid_load_percentage > 60 else 0
+    renew_cat = 2 if renewable_ratio > 50 else 1 if renewable_ratio > 20 else 0
+
+    # Nearby demand: users with soc < 40 that are not charging/waiting within +-0.05 deg of the charger
+    seeking = [u.get('current_position') or {} for u in global_state.get('users', [])
+               if u.get('soc', 100) < 40 and u.get('status') not in ['charging', 'waiting']]
+    demand = np.zeros(len(chargers), dtype=np.int64)
+    if seeking:
+        user_lat = np.array([p.get('lat', -999) for p in seeking], dtype=np.float64)
+        user_lng = np.array([p.get('lng', -999) for p in seeking], dtype=np.float64)
+        charger_pos = [c.get('position', {'lat': 0, 'lng': 0}) for c in chargers]
+        charger_lat = np.array([p.get('lat', 0) for p in charger_pos], dtype=np.float64)
+        charger_lng = np.array([p.get('lng', 0) for p in charger_pos], dtype=np.float64)
+        near = (np.abs(user_lat[np.newaxis, :] - charger_lat[:, np.newaxis]) < 0.05) & \
+               (np.abs(user_lng[np.newaxis, :] - charger_lng[:, np.newaxis]) < 0.05)
+        demand = near.sum(axis=1)
+
+    features = (status, queue, hour_of_day // 4, grid_load_cat, renew_cat, np.minimum(demand, 2))
+    codes = np.zeros(len(chargers), dtype=np.int64)
+    for value, size in zip(features, STATE_FEATURE_SIZES):
+        codes = codes * size + np.clip(value, 0, size - 1)
+    return charger_ids, codes.astype(np.int32)
+
+class AgentStateCache:
+    """
+    Per-step cache of encoded agent states, keyed by the environment's state_version.
+
+    The environment takes a new version whenever users, chargers, grid status or time change, and
+    get_current_state returns the same lists while the version is unchanged. Within one step the same
+    state is encoded for choose_actions and again in update_q_tables, and the next state of step t is
+    the current state of step t+1, so keeping the last couple of versions lets each global state be
+    encoded only once. States without a state_version (derived states such as anytime batches, or
+    hand-built states) are encoded every time.
+    """
+    def __init__(self, max_versions=3):
+        self.max_versions = max_versions
+        self._entries = {} # state_version -> (codes array, {charger_id: row})
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, global_state):
+        """Returns (codes, index) for global_state, encoding it on a cache miss."""
+        version = global_state.get('state_version')
+        cached = self._entries.get(version) if version is not None else None
+        if cached is not None:
+            self.hits += 1
+            return cached
+        self.misses += 1
+        charger_ids, codes = encode_agent_states(global_state)
+        entry = (codes, {charger_id: i for i, charger_id in enumerate(charger_ids)})
+        if version is not None:
+            if len(self._entries) >= self.max_versions:
+                self._entries.pop(next(iter(self._entries)))
+            self._entries[version] = entry
+        return entry
+
+    def code_for(self, charger_id, global_state):
+        """Encoded state of one charger, or -1 if it is not in the state."""
+        codes, index = self.get(global_state)
+        row = index.get(charger_id)
+        return int(codes[row]) if row is not None else -1
+
+    def clear(self):
+        self._entries.clear()
+
+def decode_agent_state(index):
+    """Inverse of encode_agent_state: rebuilds the agent state dict from its packed index."""
+    state = {}
+    for feature, size in zip(reversed(STATE_FEATURES), reversed(STATE_FEATURE_SIZES)):
+        index, state[feature] = divmod(int(index), size)
+    return state
+
+# --- Dynamic action maps ---
+# Index 0 is 'idle', indices 1..N-1 map to the highest-priority users seeking charge near the charger.
+ACTION_MAP_CHUNK = 512 # chargers per block in the batched users x chargers computation
+
+def _seeking_users(users):
+    """Users actively seeking a charge, with their profile-dependent SOC threshold."""
+    seeking = []
+    for user in users:
+        user_id = user.get('user_id')
+        if not user_id: continue
+        soc = user.get('soc', 100)
+        status = user.get('status', 'unknown')
+        user_profile = user.get('user_profile', 'flexible')
+        needs_charge_flag = user.get('needs_charge_decision', False)
+
+        charge_threshold = 40 # 基础阈值，可配置
+        if user_profile == 'anxious': charge_threshold = 50
+        elif user_profile == 'economic': charge_threshold = 30
+
+        # 满足以下条件之一视为寻求充电:
+        # 1. 用户明确标记需要决策; 2. 用户空闲或随机旅行，且电量低于阈值
+        if needs_charge_flag and status not in ['charging', 'waiting']:
+            pass
+        elif status in ['idle', 'traveling'] and user.get('target_charger') is None and soc < charge_threshold:
+            pass
+        else:
+            continue
+
+        user_pos = user.get('current_position', {})
+        if isinstance(user_pos.get('lat'), (int, float)) and isinstance(user_pos.get('lng'), (int, float)):
+            seeking.append((user_id, soc, charge_threshold, user_pos['lat'], user_pos['lng']))
+    return seeking
+
+def create_dynamic_action_maps(global_state, marl_config=None, charger_ids=None):
+    """
+    Builds the dynamic action maps of all (or the given) non-failed chargers in one batched pass.
+
+    The users are filtered once, then distances and priority scores are computed as a
+    chargers x users array; each charger keeps its top N-1 users by priority (stable order,
+    so ties keep the user order exactly like a per-charger sort).
+
+    Returns:
+        dict: {charger_id: {"map": {action_index: 'idle' or user_id}, "size": action_space_size}}
+    """
+    marl_config = marl_config or {}
+    action_space_size = marl_config.get("action_space_size", 6) # Default to 6
+    max_potential_users = action_space_size - 1 # Number of users to map
+    MAX_DISTANCE_SQ = marl_config.get("marl_candidate_max_dist_sq", 0.15**2) # ~20km radius
+    W_SOC = marl_config.get("marl_priority_w_soc", 0.5)
+    W_DIST = marl_config.get("marl_priority_w_dist", 0.4)
+    W_URGENCY = marl_config.get("marl_priority_w_urgency", 0.1)
+
+    wanted = set(charger_ids) if charger_ids is not None else None
+    chargers = [c for c in global_state.get('chargers', [])
+                if c.get('charger_id') and c.get('status') != 'failure' and (wanted is None or c['charger_id'] in wanted)]
+    action_maps = {c['charger_id']: {"map": {0: 'idle'}, "size": action_space_size} for c in chargers}
+
+    seeking = _seeking_users(global_state.get('users', []))
+    if not seeking or not chargers or max_potential_users <= 0:
+        return action_maps
+
+    user_ids = [u[0] for u in seeking]
+    soc = np.array([u[1] for u in seeking], dtype=np.float64)
+    threshold = np.array([u[2] for u in seeking], dtype=np.float64)
+    user_lat = np.array([u[3] for u in seeking], dtype=np.float64)
+    user_lng = np.array([u[4] for u in seeking], dtype=np.float64)
+    # 计算紧迫度 (0 to 1, higher is more urgent) 与低 SOC 贡献
+    urgency = np.where(threshold > 0, np.maximum(0, threshold - soc) / np.where(threshold > 0, threshold, 1), 0)
+    soc_term = W_SOC * (1.0 - soc / 100.0)
+    urgency_term = W_URGENCY * urgency
+
+    located = [c for c in chargers if isinstance(c.get('position', {}).get('lat'), (int, float)) and isinstance(c.get('position', {}).get('lng'), (int, float))]
+    for start in range(0, len(located), ACTION_MAP_CHUNK):
+        block = located[start:start + ACTION_MAP_CHUNK]
+        charger_lat = np.array([c['position']['lat'] for c in block], dtype=np.float64)
+        charger_lng = np.array([c['position']['lng'] for c in block], dtype=np.float64)
+        dist_sq = (user_lat[np.newaxis, :] - charger_lat[:, np.newaxis])**2 + (user_lng[np.newaxis, :] - charger_lng[:, np.newaxis])**2
+        within = dist_sq < MAX_DISTANCE_SQ
+        if MAX_DISTANCE_SQ > 0:
+            normalized_distance = np.minimum(1.0, np.sqrt(dist_sq) / math.sqrt(MAX_DISTANCE_SQ))
+        else:
+            normalized_distance = np.zeros_like(dist_sq)
+        priority = soc_term[np.newaxis, :] + W_DIST * (1.0 - normalized_distance) + urgency_term[np.newaxis, :]
+
+        for row, charger in enumerate(block):
+            candidates = np.flatnonzero(within[row])
+            if len(candidates) == 0: continue
+            order = candidates[np.argsort(-priority[row, candidates], kind='stable')][:max_potential_users]
+            action_map = action_maps[charger['charger_id']]["map"]
+            for i, user_index in enumerate(order):
+                action_map[i + 1] = user_ids[user_index]
+    return action_maps
+
+def create_dynamic_action_map(charger_id, global_state, marl_config=None):
+    """Action map of a single charger (see create_dynamic_action_maps). Returns (action_map, action_space_size)."""
+    action_space_size = (marl_config or {}).get("action_space_size", 6)
+    maps = create_dynamic_action_maps(global_state, marl_config, charger_ids=[charger_id])
+    if charger_id not in maps:
+        return {0: 'idle'}, action_space_size # Only 'idle' is possible
+    return maps[charger_id]["map"], action_space_size
+
+def convert_actions_to_decisions(agent_actions, global_state, charger_action_maps):
+    """
+    将 MARL 智能体选择的动作 {charger_id: action_index}
+    转换为充电分配决策 {user_id: charger_id}。先到先得，后选中同一用户的充电桩被忽略。
+    """
+    decisions = {}
+    assigned_users = set() # 跟踪已分配用户，防止重复
+    if not isinstance(agent_actions, dict):
+        logger.error(f"convert_actions_to_decisions received invalid agent_actions type: {type(agent_actions)}")
+        return {}
+
+    existing_users = {u.get('user_id') for u in global_state.get('users', [])}
+    for charger_id, action_index in agent_actions.items():
+        # Action 0 总是表示'idle'(不分配)
+        if action_index == 0:
+            continue
+        map_data = charger_action_maps.get(charger_id)
+        action_map = map_data.get("map") if map_data else None
+        if not action_map:
+            hot_log.event("missing_action_map", logging.WARNING, "No action map found for charger %s. Cannot convert action %s. Skipping.", charger_id, action_index)
+            continue
+
+        user_id_to_assign = action_map.get(action_index)
+        if user_id_to_assign and user_id_to_assign != 'idle':
+            if user_id_to_assign not in assigned_users:
+                if user_id_to_assign in existing_users:
+                    decisions[user_id_to_assign] = charger_id
+                    assigned_users.add(user_id_to_assign)
+                    hot_log.event("assigned", logging.DEBUG, "MARL decision: Assign user %s to charger %s (from action index %s)", user_id_to_assign, charger_id, action_index)
+                else:
+                    hot_log.event("unknown_user", logging.WARNING, "MARL action %s mapped to user %s but user not found in current state. Skipping.", action_index, user_id_to_assign)
+            else:
+                # 冲突: 用户已被分配。
+                hot_log.event("conflict", logging.WARNING, "MARL conflict: User %s was already assigned. Charger %s also selected this user (action index %s). Ignoring second assignment.", user_id_to_assign, charger_id, action_index)
+        else:
+            hot_log.event("action_without_user", logging.DEBUG, "Charger %s chose action index %s, but no valid user found in its action map: %s", charger_id, action_index, action_map)
+
+    if not decisions:
+        logger.warning("MARL action conversion resulted in zero assignments.")
+    else:
+        logger.info("Converted MARL actions to %d assignments.", len(decisions))
+    return decisions
+
+_STATE_STRING_INDEX = None
+
+def state_string_index():
+    """{MARLAgent state string: encoded state index} for every encodable state (built once)."""
+    global _STATE_STRING_INDEX
+    if _STATE_STRING_INDEX is None:
+        _STATE_STRING_INDEX = {str(sorted(decode_agent_state(i).items())): i for i in range(NUM_ENCODED_STATES)}
+    return _STATE_STRING_INDEX
+
+class DenseAgentQTable:
+    """
+    Dict-like view of one agent's rows in a dense (states x actions) Q array, used in place of
+    MARLAgent.q_table when loading a dense checkpoint. Lookups by state string return row views,
+    so updates write straight into the (possibly memory-mapped) array; states that cannot be
+    encoded fall back to a small in-memory dict.
+    """
+    def __init__(self, values):
+        self.values = values
+        self.action_space_size = values.shape[1]
+        self._index = state_string_index()
+        self._extra = defaultdict(lambda: np.zeros(self.action_space_size))
+
+    def __getitem__(self, state_str):
+        row = self._index.get(state_str)
+        return self.values[row] if row is not None else self._extra[state_str]
+
+    def __setitem__(self, state_str, q_values):
+        row = self._index.get(state_str)
+        if row is not None: self.values[row] = q_values
+        else: self._extra[state_str] = np.asarray(q_values)
+
+    def __contains__(self, state_str):
+        return state_str in self._index or state_str in self._extra
+
+    def keys(self):
+        """States with learned (non-zero) values, like the keys of a sparse Q dict."""
+        visited = np.flatnonzero(np.any(self.values != 0, axis=1))
+        names = {i: s for s, i in self._index.items()}
+        return [names[i] for i in visited] + list(self._extra.keys())
+
+    def __iter__(self):
+        return iter(self.keys())
+
+    def __len__(self):
+        return len(self.keys())
+
+def dense_q_values(q_table, action_space_size, initial_q=None):
+    """
+    Converts a MARLAgent Q-table (sparse dict or DenseAgentQTable) to a (states x actions) float32 array.
+    States missing from a sparse table get initial_q (zeros by default).
+    """
+    if isinstance(q_table, DenseAgentQTable):
+        return np.asarray(q_table.values, dtype=np.float32)
+    values = np.zeros((NUM_ENCODED_STATES, action_space_size), dtype=np.float32)
+    if initial_q is not None:
+        values[:] = initial_q
+    index = state_string_index()
+    for state_str, q_values in q_table.items():
+        row = index.get(state_str)
+        if row is not None and len(q_values) == action_space_size:
+            values[row] = q_values
+    return values
 
 def calculate_agent_reward(charger_id, action_taken, global_state, previous_state):
     """Calculates the reward for a charger agent."""
@@ -229,26 +569,149 @@ def calculate_agent_reward(charger_id, action_taken, global_state, previous_stat
     return float(reward)
 
 
+_LEGACY_AGENT_ID = re.compile(r"^CHARGER_(\d+)$")
+
+def canonical_agent_id(agent_id):
+    """Agents are keyed by the environment's charger ids; maps the legacy 'CHARGER_0001' ids of older Q-table files to 'charger_1'."""
+    match = _LEGACY_AGENT_ID.match(agent_id) if isinstance(agent_id, str) else None
+    return f"charger_{int(match.group(1))}" if match else agent_id
+
+
 # --- MARLSystem Class ---
 class MARLSystem:
-    def __init__(self, num_chargers, action_space_size, learning_rate, discount_factor, exploration_rate, q_table_path):
+    def __init__(self, num_chargers, action_space_size, learning_rate, discount_factor, exploration_rate, q_table_path, replay_config=None, checkpoint_every_steps=0, inference_mode="learning", q_bias=None):
         self.num_chargers = num_chargers
         self.action_space_size = action_space_size
         self.lr = learning_rate
         self.gamma = discount_factor
         self.epsilon = exploration_rate
         self.q_table_path = q_table_path
-        # Use MARLAgent instances
-        self.agents = {f"CHARGER_{i+1:04d}": MARLAgent(f"CHARGER_{i+1:04d}", action_space_size, learning_rate, discount_factor, exploration_rate)
-                       for i in range(num_chargers)}
-        logger.info(f"MARLSystem initialized with {len(self.agents)} agents.")
+        # Use MARLAgent instances (q_bias: optional optimistic initial values, see DEFAULT_Q_BIAS).
+        # Agents are keyed by the charger ids of the environment state and created the first time a charger
+        # is seen (num_chargers is only the expected count); loaded Q-tables are attached as agents are created.
+        self.q_bias = q_bias
+        self.agents = {}
+        self.agent_ids = []
+        self.agent_index = {}
+        self._table_source = None # Q-tables read by load_q_tables, see _attach_table
+        # Optional experience replay: transitions are stored as encoded integers and replayed in mini-batches
+        self.replay_config = replay_config or {}
+        self.replay = create_replay_buffer(self.replay_config)
+        self.state_cache = AgentStateCache()
+        self._replay_q = None # (agents x states x actions) array backing all agents' tables once replay starts
+        # Periodic saving (dense .npy checkpoints only): every N learning steps, skipped when nothing changed
+        self.checkpoint_every_steps = checkpoint_every_steps
+        self._learn_steps = 0
+        self._updates_since_save = 0
+        # "frozen": deployment mode, greedy actions from a precomputed int8 policy table and no learning
+        self.inference_mode = inference_mode
+        self.frozen_policy = None
+        self._dense_source = None # (q_values, agent_ids) of a loaded dense checkpoint
+        logger.info(f"MARLSystem initialized for {num_chargers} chargers (agents are created from the environment state).")
         self.load_q_tables() # Load Q-tables for all agents
+        if self.inference_mode == "frozen":
+            self.freeze()
+
+    def _ensure_agents(self, state):
+        """Creates agents for chargers in the state that have none yet."""
+        new_ids = []
+        for charger in state.get('chargers', []):
+            charger_id = charger.get('charger_id')
+            if not charger_id or charger_id in self.agents: continue
+            agent = MARLAgent(charger_id, self.action_space_size, self.lr, self.gamma, self.epsilon, q_bias=self.q_bias)
+            self._attach_table(charger_id, agent)
+            self.agents[charger_id] = agent
+            self.agent_index[charger_id] = len(self.agent_ids)
+            self.agent_ids.append(charger_id)
+            new_ids.append(charger_id)
+        if not new_ids:
+            return
+        if self._replay_q is not None:
+            # Extend the replay-backed array; replay buffer rows keep their agent indices
+            new_q = np.stack([dense_q_values(self.agents[agent_id].q_table, self.action_space_size, self.agents[agent_id].initial_q) for agent_id in new_ids])
+            self._replay_q = np.concatenate([self._replay_q, new_q.astype(np.float64)])
+            for i, agent_id in enumerate(self.agent_ids):
+                self.agents[agent_id].q_table = DenseAgentQTable(self._replay_q[i])
+        if self.inference_mode == "frozen" and self._dense_source is None:
+            self.frozen_policy = None # rebuilt from the agents' tables on next use
+        logger.info(f"Created {len(new_ids)} MARL agents ({len(self.agents)} in total).")
+
+    def _attach_table(self, agent_id, agent):
+        """Gives the agent its table from the loaded Q-table source (its own table, or the shared one). Returns True if found."""
+        if self._table_source is None:
+            return False
+        kind, source = self._table_source
+        if kind == "dense":
+            q_values, agent_rows, shared_row = source
+            row = agent_rows.get(agent_id, shared_row)
+            if row is None:
+                return False
+            agent.q_table = DenseAgentQTable(q_values[row])
+            return True
+        if kind == "files":
+            if agent_id not in source:
+                return False
+            agent.load_q_table(source[agent_id]) # Use agent's own load method
+            return True
+        loaded_agent_q = source.get(agent_id)
+        if loaded_agent_q is None:
+            return False
+        # Convert loaded dict back to defaultdict
+        agent.q_table = defaultdict(agent._new_row)
+        for state_key, q_values in loaded_agent_q.items():
+            if len(q_values) == agent.action_space_size:
+                agent.q_table[state_key] = np.array(q_values)
+            else:
+                logger.warning(f"Size mismatch loading Q-table for agent {agent_id}, state {state_key}. Skipping.")
+        return True
+
+    def freeze(self):
+        """Builds the frozen greedy policy from the current Q-tables (deferred until agents exist when there is no dense checkpoint)."""
+        from .marl_policy import FrozenGreedyPolicy
+        if self._dense_source is not None:
+            q_values, agent_ids = self._dense_source
+        elif self.agents:
+            agent_ids = self.agent_ids
+            q_values = np.stack([dense_q_values(self.agents[agent_id].q_table, self.action_space_size, self.agents[agent_id].initial_q) for agent_id in agent_ids])
+        else:
+            self.frozen_policy = None
+            return
+        self.frozen_policy = FrozenGreedyPolicy(q_values, agent_ids)
+
+    def choose_actions_frozen(self, state, charger_action_maps):
+        """
+        Greedy actions for all agents with one vectorized lookup in the frozen policy table.
+        charger_action_maps limits each agent to the valid indices of its dynamic action map.
+        """
+        self._ensure_agents(state)
+        if self.frozen_policy is None:
+            self.freeze()
+        all_actions = {}
+        codes, code_index = self.state_cache.get(state)
+        charger_ids, rows, state_codes, num_valid = [], [], [], []
+        for charger in state.get('chargers', []):
+            charger_id = charger.get('charger_id')
+            if not charger_id: continue
+            all_actions[charger_id] = 0
+            if charger.get('status') in ['occupied', 'failure']: continue
+            row = self.frozen_policy.row_for(charger_id) if self.frozen_policy is not None else None
+            map_data = charger_action_maps.get(charger_id)
+            if row is None or not map_data or charger_id not in code_index: continue
+            charger_ids.append(charger_id)
+            rows.append(row)
+            state_codes.append(codes[code_index[charger_id]])
+            num_valid.append(len(map_data["map"]))
+        if charger_ids:
+            actions = self.frozen_policy.act(np.array(rows), np.array(state_codes), np.array(num_valid))
+            all_actions.update(zip(charger_ids, actions.tolist()))
+        return all_actions
 
-    def choose_actions(self, state):
-        """Get actions from all agents."""
+    def choose_actions(self, state, charger_action_maps=None):
+        """Get actions from all agents (charger_action_maps: {charger_id: {"map": ...}} from create_dynamic_action_maps; idle only when missing)."""
         all_actions = {}
         chargers = state.get('chargers', [])
-        logger.info(f"MARL choose_actions called for {len(chargers)} chargers")
+        logger.info("MARL choose_actions called for %d chargers", len(chargers))
+        self._ensure_agents(state)
 
         active_agents = 0
         idle_agents = 0
@@ -267,7 +730,7 @@ class MARLSystem:
              charger_id = charger.get('charger_id')
              agent = self.agents.get(charger_id)
              if not agent:
-                  logger.warning(f"No MARL agent found for charger {charger_id}. Skipping.")
+                  hot_log.event("missing_agent", logging.WARNING, "No MARL agent found for charger %s. Skipping.", charger_id)
                   continue
 
              if charger.get('status') in ['occupied', 'failure']:
@@ -276,7 +739,8 @@ class MARLSystem:
                  idle_agents += 1
                  continue
 
-             agent_state = get_agent_state(charger_id, state) # Get state specific to this agent
+             state_index = self.state_cache.code_for(charger_id, state) # Get state specific to this agent
+             agent_state = decode_agent_state(state_index) if state_index >= 0 else {}
 
              # --- How to get valid actions? ---
              # OPTION 1: Assume MARLAgent.choose_action handles it (needs state only)
@@ -291,8 +755,9 @@ class MARLSystem:
                  # It's better if ChargingScheduler calls this map creation.
                  # See updated logic in simulation/scheduler.py where map creation happens *before* choose_actions.
                  # Here, we'll just pass an empty map for structure.
-                 _temp_map = {0:'idle'} # Placeholder - Actual map generated in scheduler
-                 _chosen_action_name, action_index = agent.choose_action(agent_state, _temp_map)
+                 map_data = (charger_action_maps or {}).get(charger_id)
+                 action_map = map_data["map"] if map_data else {0: 'idle'}
+                 _chosen_action_name, action_index = agent.choose_action(agent_state, action_map)
                  all_actions[charger_id] = action_index
                  active_agents += 1
              except Exception as e:
@@ -301,7 +766,7 @@ class MARLSystem:
                  idle_agents += 1
 
 
-        logger.info(f"MARL actions chosen: {active_agents} active agents, {idle_agents} idle/failed.")
+        logger.info("MARL actions chosen: %d active agents, %d idle/failed.", active_agents, idle_agents)
         # Returns a dict of {charger_id: action_index}
         return all_actions
 
@@ -309,9 +774,12 @@ class MARLSystem:
     def update_q_tables(self, state, actions, rewards, next_state):
         """Update Q-tables for all agents based on experience."""
         # This 'rewards' might be the global reward dict. We need agent-specific rewards.
+        if self.inference_mode == "frozen":
+            return # Frozen policy: no learning at deployment
         if not state or not actions or not next_state:
             logger.warning("MARL update_q_tables received empty data. Skipping.")
             return
+        self._ensure_agents(state)
 
         logger.debug(f"Updating MARL Q-tables for {len(actions)} actions.")
         update_count = 0
@@ -355,54 +823,131 @@ class MARLSystem:
                 agent = self.agents.get(charger_id)
                 if not agent: continue
 
-                agent_state = get_agent_state(charger_id, state) # State when action was chosen
-                next_agent_state = get_agent_state(charger_id, next_state) # Resulting state
+                # Encoded states come from the per-step cache (state was already encoded in choose_actions,
+                # next_state will be reused as the next step's current state)
+                state_index = self.state_cache.code_for(charger_id, state) # State when action was chosen
+                next_index = self.state_cache.code_for(charger_id, next_state) # Resulting state
+                agent_state = decode_agent_state(state_index) if state_index >= 0 else {}
+                next_agent_state = decode_agent_state(next_index) if next_index >= 0 else {}
                 reward = agent_rewards.get(charger_id, 0) # Get specific reward
 
+                if self.replay is not None:
+                    if state_index >= 0 and next_index >= 0:
+                        self.replay.add(self.agent_index[charger_id], state_index, action_index, reward, next_index)
+                    continue
+
                 agent.update_q_table(agent_state, action_index, reward, next_agent_state)
                 update_count += 1
                 # Optional: Log significant updates
                 # ...
 
+        if self.replay is not None:
+            update_count = self.replay_updates()
+
         if update_count > 0: logger.debug(f"Updated Q-values for {update_count} agents.")
+        self._updates_since_save += update_count
+        self._learn_steps += 1
+        if self.checkpoint_every_steps and self._learn_steps % self.checkpoint_every_steps == 0 and self._updates_since_save > 0:
+            from .q_checkpoint import is_dense_checkpoint_path
+            if is_dense_checkpoint_path(self.q_table_path):
+                self.save_q_tables()
+
+    def _dense_replay_tables(self):
+        """
+        (agents x states x actions) float64 array holding every agent's Q-table, in agent_ids order.
+        Built on first use; each agent's q_table becomes a DenseAgentQTable view of its slice,
+        so choose_action and the batched replay updates read and write the same values.
+        """
+        if self._replay_q is None:
+            self._replay_q = np.stack([dense_q_values(self.agents[agent_id].q_table, self.action_space_size, self.agents[agent_id].initial_q)
+                                       for agent_id in self.agent_ids]).astype(np.float64)
+            for i, agent_id in enumerate(self.agent_ids):
+                self.agents[agent_id].q_table = DenseAgentQTable(self._replay_q[i])
+            self._dense_source = None # the tables no longer alias a loaded checkpoint
+        return self._replay_q
+
+    def replay_updates(self):
+        """
+        Sample mini-batches from the replay buffer and apply each batch as one vectorized Q-learning update
+        (targets from the pre-batch values, repeated (agent, state, action) increments accumulated with np.add.at).
+        Returns the number of updates.
+        """
+        if self.replay is None or len(self.replay) < self.replay_config.get("warmup", 1000):
+            return 0
+        batch_size = self.replay_config.get("batch_size", 256)
+        q = self._dense_replay_tables()
+        update_count = 0
+        for _ in range(self.replay_config.get("updates_per_step", 1)):
+            indices, agents, states, actions, rewards, next_states, weights = self.replay.sample(batch_size)
+            valid = (actions >= 0) & (actions < self.action_space_size)
+            if not valid.all():
+                hot_log.event("replay_invalid_action", logging.ERROR, "Skipping %d replayed transitions with invalid action indices.", int((~valid).sum()))
+            td_errors = np.zeros(len(indices)) # invalid rows keep a zero TD error (lowest priority)
+            a, s, act, ns = agents[valid], states[valid], actions[valid], next_states[valid]
+            td = rewards[valid] + self.gamma * q[a, ns].max(axis=1) - q[a, s, act]
+            np.add.at(q, (a, s, act), self.lr * weights[valid] * td)
+            td_errors[valid] = td
+            self.replay.update_priorities(indices, td_errors)
+            update_count += int(valid.sum())
+        return update_count
 
 
     def load_q_tables(self):
-        """Load Q-tables for all agents."""
-        logger.info(f"Loading Q-tables for {len(self.agents)} agents from path: {self.q_table_path}")
-        num_loaded = 0
+        """Load Q-tables: attached to existing agents now, and to agents created later as their chargers appear."""
+        logger.info(f"Loading Q-tables from path: {self.q_table_path}")
+        self._table_source = None
+        self._dense_source = None
+        from .q_checkpoint import is_dense_checkpoint_path
+        # Dense checkpoint (.npy + .json header): memory-mapped, no per-state rebuilding
+        if is_dense_checkpoint_path(self.q_table_path):
+            if os.path.exists(self.q_table_path):
+                self._load_dense_q_tables()
+            else:
+                logger.warning(f"Q-table path '{self.q_table_path}' not found. Agents starting with empty Q-tables.")
         # If path points to a single file containing all tables:
-        if self.q_table_path and os.path.exists(self.q_table_path) and os.path.isfile(self.q_table_path):
+        elif self.q_table_path and os.path.exists(self.q_table_path) and os.path.isfile(self.q_table_path):
              try:
                  with open(self.q_table_path, 'rb') as f:
                      all_q_tables = pickle.load(f)
                      if isinstance(all_q_tables, dict):
-                          for agent_id, agent in self.agents.items():
-                              if agent_id in all_q_tables:
-                                   # Convert loaded dict back to defaultdict
-                                   loaded_agent_q = all_q_tables[agent_id]
-                                   agent.q_table = defaultdict(lambda: np.zeros(agent.action_space_size))
-                                   for state_key, q_values in loaded_agent_q.items():
-                                        if len(q_values) == agent.action_space_size:
-                                             agent.q_table[state_key] = np.array(q_values)
-                                        else:
-                                            logger.warning(f"Size mismatch loading Q-table for agent {agent_id}, state {state_key}. Skipping.")
-                                   num_loaded += 1
-                          logger.info(f"Loaded Q-tables for {num_loaded} agents from single file {self.q_table_path}")
+                          self._table_source = ("pickle", {canonical_agent_id(agent_id): q for agent_id, q in all_q_tables.items()})
+                          logger.info(f"Loaded Q-tables for {len(all_q_tables)} agents from single file {self.q_table_path}")
                      else:
                           logger.error(f"Invalid format in Q-table file {self.q_table_path}. Expected dict.")
              except Exception as e:
                  logger.error(f"Error loading Q-tables from {self.q_table_path}: {e}", exc_info=True)
         # If path points to a directory (load individual files)
         elif self.q_table_path and os.path.isdir(self.q_table_path):
-             for agent_id, agent in self.agents.items():
-                  agent_file = os.path.join(self.q_table_path, f"{agent_id}_q_table.pkl")
-                  agent.load_q_table(agent_file) # Use agent's own load method
-                  if os.path.exists(agent_file): num_loaded +=1
-             logger.info(f"Attempted to load Q-tables for {len(self.agents)} agents from directory {self.q_table_path}. Found {num_loaded} files.")
+             suffix = "_q_table.pkl"
+             agent_files = {canonical_agent_id(name[:-len(suffix)]): os.path.join(self.q_table_path, name)
+                            for name in os.listdir(self.q_table_path) if name.endswith(suffix)}
+             self._table_source = ("files", agent_files)
+             logger.info(f"Found Q-table files for {len(agent_files)} agents in directory {self.q_table_path}.")
         else:
              logger.warning(f"Q-table path '{self.q_table_path}' not found or invalid. Agents starting with empty Q-tables.")
 
+        num_loaded = sum(self._attach_table(agent_id, agent) for agent_id, agent in self.agents.items())
+        if self.agents:
+            self._replay_q = None # agents now hold the loaded tables; the replay array is rebuilt from them
+            logger.info(f"Attached loaded Q-tables to {num_loaded} of {len(self.agents)} existing agents.")
+
+
+    def _load_dense_q_tables(self, mmap_mode="c"):
+        """Attach agents to a dense checkpoint. Copy-on-write mapping: learning works, the file is only changed by saves."""
+        from .q_checkpoint import load_q_checkpoint, SHARED_AGENT_ID
+        try:
+            q_values, header = load_q_checkpoint(self.q_table_path, mmap_mode=mmap_mode)
+        except Exception as e:
+            logger.error(f"Error loading dense Q-table checkpoint {self.q_table_path}: {e}", exc_info=True)
+            return
+        if header["action_space_size"] != self.action_space_size:
+            logger.error(f"Dense checkpoint action space {header['action_space_size']} does not match {self.action_space_size}. Ignoring it.")
+            return
+        agent_ids = [canonical_agent_id(agent_id) for agent_id in header["agent_ids"]]
+        self._dense_source = (q_values, agent_ids)
+        agent_rows = {agent_id: i for i, agent_id in enumerate(agent_ids)}
+        self._table_source = ("dense", (q_values, agent_rows, agent_rows.get(SHARED_AGENT_ID)))
+        logger.info(f"Mapped dense Q-tables for {len(agent_ids)} agents from {self.q_table_path}")
 
     def save_q_tables(self):
         """Save Q-tables for all agents."""
@@ -410,9 +955,20 @@ class MARLSystem:
         if not self.q_table_path:
             logger.error("Cannot save Q-tables: q_table_path is not set.")
             return
+        if not self.agents:
+            logger.warning("No MARL agents created yet (no state seen). Not overwriting the Q-table file.")
+            return
 
+        from .q_checkpoint import is_dense_checkpoint_path, save_q_checkpoint
+        if is_dense_checkpoint_path(self.q_table_path):
+            try:
+                q_values = np.stack([dense_q_values(self.agents[agent_id].q_table, self.action_space_size, self.agents[agent_id].initial_q) for agent_id in self.agent_ids])
+                save_q_checkpoint(self.q_table_path, q_values, self.agent_ids)
+                self._updates_since_save = 0
+            except Exception as e:
+                logger.error(f"Error saving dense Q-table checkpoint to {self.q_table_path}: {e}", exc_info=True)
         # Option 1: Save all tables to a single file
-        if not os.path.splitext(self.q_table_path)[1]: # Check if it looks like a directory path
+        elif not os.path.splitext(self.q_table_path)[1]: # Check if it looks like a directory path
              # Assume directory saving
              os.makedirs(self.q_table_path, exist_ok=True)
              num_saved = 0
@@ -424,6 +980,8 @@ class MARLSystem:
         else:
              # Assume single file saving
              all_q_tables_to_save = {}
+             if self._table_source is not None and self._table_source[0] == "pickle":
+                  all_q_tables_to_save.update(self._table_source[1]) # Keep loaded tables of chargers not seen in this run
              for agent_id, agent in self.agents.items():
                   # Convert defaultdict to regular dict for saving
                   all_q_tables_to_save[agent_id] = dict(agent.q_table)
@@ -0,0 +1,61 @@
+# ev_charging_project/algorithms/marl_policy.py
+# 冻结的贪心策略: 部署时只需要 Q 表的贪心动作, 预先把每个 (智能体, 状态, 有效动作数) 的 argmax
+# 算成 int8 策略表, 每一步所有智能体的动作由一次向量化索引得到。
+
+import logging
+
+import numpy as np
+
+from .q_checkpoint import load_q_checkpoint, SHARED_AGENT_ID
+
+logger = logging.getLogger("MARL")
+
+
+class FrozenGreedyPolicy:
+    """
+    由 Q 值构建的只读贪心策略表。
+
+    动态动作映射的有效动作总是 0..n-1 的前缀 (0 为 idle), 因此对每个前缀长度 n 预先计算
+    argmax(Q[agent, state, :n]), 推理时按有效动作数取对应一列即可, 无需再做掩码和比较。
+    并列最大值取索引最小的动作 (确定性), 不再随机打破平局。
+    """
+
+    def __init__(self, q_values, agent_ids):
+        q_values = np.asarray(q_values, dtype=np.float32)
+        if q_values.ndim != 3 or q_values.shape[0] != len(agent_ids):
+            raise ValueError(f"Expected Q-values of shape (agents, states, actions) for {len(agent_ids)} agents, got {q_values.shape}")
+        self.action_space_size = q_values.shape[2]
+        if self.action_space_size > np.iinfo(np.int8).max:
+            raise ValueError(f"Action space {self.action_space_size} is too large for an int8 policy table")
+
+        self.policy = np.empty(q_values.shape, dtype=np.int8)
+        for n in range(1, self.action_space_size + 1):
+            self.policy[:, :, n - 1] = np.argmax(q_values[:, :, :n], axis=2)
+        self.agent_rows = {agent_id: i for i, agent_id in enumerate(agent_ids)}
+        self.shared_row = self.agent_rows.get(SHARED_AGENT_ID)
+        logger.info(f"Frozen greedy policy built: {len(agent_ids)} agent tables, {self.policy.nbytes / 1e6:.2f} MB.")
+
+    @classmethod
+    def from_checkpoint(cls, path):
+        """直接从稠密检查点 (只读映射) 构建"""
+        q_values, header = load_q_checkpoint(path, mmap_mode="r")
+        return cls(q_values, header["agent_ids"])
+
+    def row_for(self, agent_id):
+        """智能体在策略表中的行; 没有专属表时使用共享表, 都没有返回 None"""
+        return self.agent_rows.get(agent_id, self.shared_row)
+
+    def act(self, agent_rows, state_codes, num_valid_actions):
+        """
+        一次性给出一批智能体的贪心动作。
+
+        Args:
+            agent_rows (np.ndarray): 每个智能体在策略表中的行
+            state_codes (np.ndarray): 每个智能体的编码状态
+            num_valid_actions (np.ndarray): 每个智能体动作映射中的有效动作数 (含 idle)
+
+        Returns:
+            np.ndarray: 动作索引
+        """
+        columns = np.clip(num_valid_actions, 1, self.action_space_size) - 1
+        return self.policy[agent_rows, state_codes, columns]
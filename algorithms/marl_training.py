@@ -0,0 +1,351 @@
+# ev_charging_project/algorithms/marl_training.py
+# MARL 离线训练入口: 多个独立的 ChargingEnvironment 并行产生经验, 共同更新一张共享的稠密 Q 表。
+#
+# 用法:
+#   python -m algorithms.marl_training --episodes 200 --envs 4 --parallel process
+#
+# 训练参数来自 config["scheduler"]["marl_config"]["training"], 命令行参数优先。
+
+import argparse
+import copy
+import json
+import logging
+import os
+import time
+from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from algorithms.marl import (NUM_ENCODED_STATES, AgentStateCache, calculate_agent_reward, initial_q_row,
+                             create_dynamic_action_maps, convert_actions_to_decisions)
+from algorithms.replay_buffer import create_replay_buffer
+from algorithms.q_checkpoint import save_q_checkpoint, load_q_checkpoint, SHARED_AGENT_ID
+
+logger = logging.getLogger("MARL.training") # 训练进度; 不随下面被静音的 "MARL" 一起静音
+
+DEFAULT_TRAINING_CONFIG = {
+    "episodes": 100,
+    "num_envs": 4,
+    "episode_steps": 96,          # 每个 episode 的步数 (15 分钟步长下为 1 天)
+    "parallel": "inline",         # "inline": 在主进程中同步推进多个环境; "process": 每个 episode 在工作进程中运行
+    "epsilon_start": 1.0,
+    "epsilon_min": 0.05,
+    "epsilon_decay": 0.97,        # 每个 episode 乘一次
+    "batch_size": 4096,           # 批量 Q 更新的最大转移数
+    "checkpoint_every": 10,       # 每隔多少个 episode 保存一次
+    "checkpoint_path": "models/marl_dense_q_table.npy", # 稠密检查点, 可直接作为 marl_config.q_table_path 使用
+    "seed": 0,
+    # 经验回放: 启用后新转移先写入缓冲区, 再按 replay_ratio 采样 mini-batch 更新
+    "replay": {
+        "enabled": False,
+        "capacity": 200000,
+        "prioritized": False,
+        "alpha": 0.6,
+        "beta": 0.4,
+        "batch_size": 256,
+        "replay_ratio": 1.0,      # 每条新转移对应的采样更新条数
+        "warmup": 1000,           # 缓冲区达到该大小后才开始更新
+    },
+}
+
+
+def get_training_config(config):
+    """合并默认训练参数和 config 中的 marl_config.training"""
+    training_config = copy.deepcopy(DEFAULT_TRAINING_CONFIG)
+    user_training_config = config.get("scheduler", {}).get("marl_config", {}).get("training", {})
+    training_config["replay"].update(user_training_config.get("replay", {}))
+    training_config.update({k: v for k, v in user_training_config.items() if k != "replay"})
+    return training_config
+
+
+class SharedQTable:
+    """所有充电桩智能体共享的稠密 Q 表, 行为编码后的智能体状态, 列为动作索引"""
+
+    def __init__(self, action_space_size, learning_rate=0.01, discount_factor=0.95, q_values=None, q_bias=None):
+        self.action_space_size = action_space_size
+        self.lr = learning_rate
+        self.gamma = discount_factor
+        if q_values is None:
+            # q_bias: 与 MARLAgent 相同的乐观初始值 (见 marl.DEFAULT_Q_BIAS)
+            q_values = np.tile(initial_q_row(action_space_size, q_bias).astype(np.float32), (NUM_ENCODED_STATES, 1))
+        self.q = q_values
+        self.update_count = 0
+
+    def choose_action(self, state_index, num_valid_actions, epsilon, rng):
+        """epsilon-greedy 选择动作; 有效动作为 0..num_valid_actions-1 (与动态动作映射的索引一致)"""
+        if num_valid_actions <= 1:
+            return 0
+        if rng.random() < epsilon:
+            return int(rng.integers(num_valid_actions))
+        q_values = self.q[state_index, :num_valid_actions]
+        best = np.flatnonzero(q_values == q_values.max())
+        return int(best[0]) if len(best) == 1 else int(rng.choice(best))
+
+    def update_batch(self, states, actions, rewards, next_states, weights=None):
+        """
+        对一批转移做 Q-learning 更新; 同一批内重复的 (状态, 动作) 的增量会累加。
+        weights 为可选的重要性采样权重。返回每条转移的 TD 误差。
+        """
+        if len(states) == 0:
+            return np.zeros(0, dtype=np.float32)
+        targets = rewards + self.gamma * self.q[next_states].max(axis=1)
+        td_errors = targets - self.q[states, actions]
+        step = self.lr * td_errors if weights is None else self.lr * weights * td_errors
+        np.add.at(self.q, (states, actions), step.astype(self.q.dtype))
+        self.update_count += len(states)
+        return td_errors
+
+
+class TransitionBatch:
+    """按列存储的一批转移 (智能体, 编码状态, 动作, 奖励, 下一状态)"""
+
+    def __init__(self):
+        self.agents, self.states, self.actions, self.rewards, self.next_states = [], [], [], [], []
+
+    def add(self, agent_index, state_index, action_index, reward, next_state_index):
+        self.agents.append(agent_index)
+        self.states.append(state_index)
+        self.actions.append(action_index)
+        self.rewards.append(reward)
+        self.next_states.append(next_state_index)
+
+    def __len__(self):
+        return len(self.states)
+
+    def as_arrays(self):
+        return (np.asarray(self.agents, dtype=np.int64),
+                np.asarray(self.states, dtype=np.int64), np.asarray(self.actions, dtype=np.int64),
+                np.asarray(self.rewards, dtype=np.float32), np.asarray(self.next_states, dtype=np.int64))
+
+
+def _make_episode_config(config, seed):
+    """每个训练环境使用独立的种子, 并关闭训练中用不到的无序基准计算"""
+    episode_config = copy.deepcopy(config)
+    env_config = episode_config.setdefault("environment", {})
+    env_config["random_seed"] = seed
+    env_config["enable_uncoordinated_baseline"] = False
+    env_config["uncoordinated_baseline_mode"] = "estimate"
+    return episode_config
+
+
+class TrainingEnv:
+    """一个训练用环境: 负责动作映射、动作选择以及把一步的结果整理成转移"""
+
+    def __init__(self, config, seed):
+        from simulation.environment import ChargingEnvironment
+
+        episode_config = _make_episode_config(config, seed)
+        self.env = ChargingEnvironment(episode_config)
+        self.marl_config = episode_config.get("scheduler", {}).get("marl_config", {})
+        self.rng = np.random.default_rng(seed)
+        self.state_cache = AgentStateCache()
+        self.state = self.env.get_current_state()
+        self.episode_reward = 0.0
+
+    def step(self, q_table, epsilon, transitions):
+        """用当前 Q 表推进一步, 把产生的转移写入 transitions, 返回 done"""
+        state = self.state
+        action_maps = create_dynamic_action_maps(state, self.marl_config) # 所有充电桩一次批量计算
+        agent_actions = {}
+        agent_states = {}
+        agent_indices = {}
+        # 当前状态的编码通常已在上一步作为 next_state 计算过
+        codes, code_index = self.state_cache.get(state)
+        for agent_index, charger in enumerate(state.get("chargers", [])):
+            charger_id = charger.get("charger_id")
+            if not charger_id or charger.get("status") in ("occupied", "failure"):
+                continue
+            state_index = int(codes[code_index[charger_id]])
+            action_map = action_maps[charger_id]["map"]
+            agent_states[charger_id] = state_index
+            agent_indices[charger_id] = agent_index
+            agent_actions[charger_id] = q_table.choose_action(state_index, len(action_map), epsilon, self.rng)
+
+        decisions = convert_actions_to_decisions(agent_actions, state, action_maps)
+        rewards, next_state, done = self.env.step(decisions)
+        self.episode_reward += rewards.get("total_reward", 0.0)
+
+        assigned = defaultdict(lambda: "idle")
+        for user_id, charger_id in decisions.items():
+            assigned[charger_id] = user_id
+        for charger_id, state_index in agent_states.items():
+            next_index = self.state_cache.code_for(charger_id, next_state)
+            if next_index < 0:
+                continue
+            reward = calculate_agent_reward(charger_id, assigned[charger_id], next_state, state)
+            transitions.add(agent_indices[charger_id], state_index, agent_actions[charger_id], reward, next_index)
+
+        self.state = next_state
+        return done
+
+
+def _quiet_simulation_logging():
+    """训练时仿真、调度器和 MARL/MAS 智能体每步都会输出大量日志 (如动作转换、事件汇总), 只保留错误"""
+    for name in ("simulation", "algorithms", "MARL", "MAS"):
+        logging.getLogger(name).setLevel(logging.ERROR)
+    logger.setLevel(logging.INFO)
+
+
+def _run_episode_worker(args):
+    """工作进程: 用冻结的 Q 表副本跑完整个 episode, 返回转移数组和累计奖励"""
+    config, q_values, action_space_size, epsilon, seed, episode_steps = args
+    _quiet_simulation_logging()
+    q_table = SharedQTable(action_space_size, q_values=q_values)
+    training_env = TrainingEnv(config, seed)
+    transitions = TransitionBatch()
+    for _ in range(episode_steps):
+        if training_env.step(q_table, epsilon, transitions):
+            break
+    return transitions.as_arrays(), training_env.episode_reward
+
+
+class MARLTrainer:
+    """多环境、多 episode 的 MARL 训练驱动"""
+
+    def __init__(self, config, **overrides):
+        self.config = config
+        self.training_config = get_training_config(config)
+        self.training_config.update({k: v for k, v in overrides.items() if v is not None})
+        marl_config = config.get("scheduler", {}).get("marl_config", {})
+        self.q_table = SharedQTable(
+            marl_config.get("action_space_size", 6),
+            learning_rate=marl_config.get("learning_rate", 0.01),
+            discount_factor=marl_config.get("discount_factor", 0.95),
+            q_bias=marl_config.get("q_bias"),
+        )
+        self.replay = create_replay_buffer(self.training_config["replay"], seed=self.training_config["seed"])
+        self.episode = 0
+        self.history = []
+
+    def epsilon_for(self, episode):
+        tc = self.training_config
+        return max(tc["epsilon_min"], tc["epsilon_start"] * (tc["epsilon_decay"] ** episode))
+
+    def _apply_transitions(self, arrays):
+        """按 batch_size 分块做批量 Q 更新; 启用经验回放时改为写入缓冲区并采样更新"""
+        if self.replay is not None:
+            self._replay_updates(arrays)
+            return
+        batch_size = max(1, int(self.training_config["batch_size"]))
+        _, states, actions, rewards, next_states = arrays
+        for start in range(0, len(states), batch_size):
+            end = start + batch_size
+            self.q_table.update_batch(states[start:end], actions[start:end], rewards[start:end], next_states[start:end])
+
+    def _replay_updates(self, arrays):
+        """把新转移写入回放缓冲区, 再采样 ceil(新转移数 * replay_ratio / batch_size) 个 mini-batch 更新"""
+        replay_config = self.training_config["replay"]
+        self.replay.add_batch(*arrays)
+        if len(self.replay) < replay_config["warmup"]:
+            return
+        batch_size = max(1, int(replay_config["batch_size"]))
+        num_updates = int(np.ceil(len(arrays[1]) * replay_config["replay_ratio"] / batch_size))
+        for _ in range(num_updates):
+            indices, _, states, actions, rewards, next_states, weights = self.replay.sample(batch_size)
+            td_errors = self.q_table.update_batch(states, actions, rewards, next_states, weights=weights)
+            self.replay.update_priorities(indices, td_errors)
+
+    def _run_round_inline(self, episodes, seeds, epsilons):
+        """在主进程中同步推进多个环境, 每一步把所有环境的转移合成一批更新"""
+        envs = [TrainingEnv(self.config, seed) for seed in seeds]
+        active = list(range(len(envs)))
+        for _ in range(self.training_config["episode_steps"]):
+            if not active:
+                break
+            transitions = TransitionBatch()
+            still_active = []
+            for i in active:
+                if not envs[i].step(self.q_table, epsilons[i], transitions):
+                    still_active.append(i)
+            active = still_active
+            self._apply_transitions(transitions.as_arrays())
+        return [env.episode_reward for env in envs]
+
+    def _run_round_process(self, executor, episodes, seeds, epsilons):
+        """每个 episode 在工作进程中用本轮开始时的 Q 表副本运行, 结束后统一更新"""
+        action_space_size = self.q_table.action_space_size
+        jobs = [(self.config, self.q_table.q, action_space_size, epsilons[i], seeds[i], self.training_config["episode_steps"])
+                for i in range(len(episodes))]
+        results = list(executor.map(_run_episode_worker, jobs))
+        for arrays, _ in results:
+            self._apply_transitions(arrays)
+        return [episode_reward for _, episode_reward in results]
+
+    def train(self):
+        tc = self.training_config
+        total_episodes = int(tc["episodes"])
+        num_envs = max(1, int(tc["num_envs"]))
+        use_processes = tc["parallel"] == "process"
+        executor = ProcessPoolExecutor(max_workers=num_envs) if use_processes else None
+        logger.info(f"MARL training: {total_episodes} episodes, {num_envs} envs ({tc['parallel']}), {tc['episode_steps']} steps/episode.")
+        next_checkpoint = self.episode + tc["checkpoint_every"]
+        try:
+            while self.episode < total_episodes:
+                episodes = list(range(self.episode, min(self.episode + num_envs, total_episodes)))
+                seeds = [tc["seed"] + e for e in episodes]
+                epsilons = [self.epsilon_for(e) for e in episodes]
+                round_start = time.time()
+                if use_processes:
+                    episode_rewards = self._run_round_process(executor, episodes, seeds, epsilons)
+                else:
+                    episode_rewards = self._run_round_inline(episodes, seeds, epsilons)
+                self.episode = episodes[-1] + 1
+                for e, eps, reward in zip(episodes, epsilons, episode_rewards):
+                    self.history.append({"episode": e, "epsilon": eps, "reward": reward})
+                logger.info(f"Episodes {episodes[0]}-{episodes[-1]} done in {time.time() - round_start:.1f}s. "
+                            f"Mean reward {np.mean(episode_rewards):.3f}, epsilon {epsilons[-1]:.3f}, updates {self.q_table.update_count}.")
+                if tc["checkpoint_every"] and self.episode >= next_checkpoint:
+                    self.save_checkpoint()
+                    next_checkpoint = self.episode + tc["checkpoint_every"]
+        finally:
+            if executor:
+                executor.shutdown()
+        self.save_checkpoint()
+        return self.history
+
+    def save_checkpoint(self, path=None):
+        """保存 Q 表和训练进度 (共享表保存为单个智能体 SHARED_AGENT_ID)"""
+        path = path or self.training_config["checkpoint_path"]
+        save_q_checkpoint(path, self.q_table.q[np.newaxis], [SHARED_AGENT_ID],
+                          extra={"episode": self.episode, "update_count": self.q_table.update_count})
+        logger.info(f"MARL checkpoint saved to {path} (episode {self.episode}).")
+
+    def load_checkpoint(self, path=None):
+        """从检查点恢复 Q 表和训练进度"""
+        path = path or self.training_config["checkpoint_path"]
+        q_values, header = load_q_checkpoint(path, mmap_mode=None)
+        if q_values.shape[1:] != self.q_table.q.shape:
+            raise ValueError(f"Checkpoint Q-table shape {q_values.shape[1:]} does not match {self.q_table.q.shape}")
+        self.q_table.q = np.array(q_values[0], dtype=np.float32)
+        progress = header.get("extra", {})
+        self.episode = int(progress.get("episode", 0))
+        self.q_table.update_count = int(progress.get("update_count", 0))
+        logger.info(f"MARL checkpoint loaded from {path} (episode {self.episode}).")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Train the MARL charger agents offline')
+    parser.add_argument('--config', type=str, default='config.json', help='Config file path')
+    parser.add_argument('--episodes', type=int, default=None, help='Total training episodes')
+    parser.add_argument('--envs', type=int, default=None, help='Number of environments run in parallel')
+    parser.add_argument('--steps', type=int, default=None, help='Steps per episode')
+    parser.add_argument('--parallel', type=str, default=None, choices=['inline', 'process'], help='How environments are run')
+    parser.add_argument('--checkpoint', type=str, default=None, help='Checkpoint file path')
+    parser.add_argument('--resume', action='store_true', help='Resume from the checkpoint')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    _quiet_simulation_logging()
+
+    with open(args.config, 'r', encoding='utf-8') as f:
+        config = json.load(f)
+    trainer = MARLTrainer(config, episodes=args.episodes, num_envs=args.envs, episode_steps=args.steps,
+                          parallel=args.parallel, checkpoint_path=args.checkpoint)
+    if args.resume and os.path.exists(trainer.training_config["checkpoint_path"]):
+        trainer.load_checkpoint()
+    trainer.train()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,104 @@
+# ev_charging_project/algorithms/q_checkpoint.py
+# 稠密 Q 表检查点格式:
+#   <name>.npy   所有智能体的 Q 值, 形状 (智能体数, 编码状态数, 动作数), float32, 可用 np.load(mmap_mode=...) 直接映射
+#   <name>.json  头信息: 格式版本、动作空间大小、状态编码方案、智能体 ID 列表以及训练进度等附加字段
+# 两个文件都先写入临时文件再 os.replace, 保存中途崩溃不会损坏已有检查点。
+
+import json
+import logging
+import os
+
+import numpy as np
+
+from .marl import STATE_FEATURES, STATE_FEATURE_SIZES, NUM_ENCODED_STATES
+
+logger = logging.getLogger("MARL")
+
+CHECKPOINT_FORMAT = "ev-marl-dense-q"
+CHECKPOINT_VERSION = 1
+SHARED_AGENT_ID = "__shared__" # 所有智能体共用一张表时使用的智能体 ID
+
+
+def is_dense_checkpoint_path(path):
+    """以 .npy 结尾的路径使用稠密检查点格式"""
+    return bool(path) and path.endswith(".npy")
+
+
+def header_path_for(path):
+    return os.path.splitext(path)[0] + ".json"
+
+
+def _atomic_write(path, write_fn, binary=True):
+    """写入同目录下的临时文件, fsync 后原子替换目标文件"""
+    tmp_path = f"{path}.tmp-{os.getpid()}"
+    try:
+        with open(tmp_path, "wb" if binary else "w", **({} if binary else {"encoding": "utf-8"})) as f:
+            write_fn(f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+
+def save_q_checkpoint(path, q_values, agent_ids, extra=None):
+    """
+    原子地保存稠密 Q 表检查点。
+
+    Args:
+        path (str): .npy 文件路径, 头信息写到同名 .json
+        q_values (np.ndarray): (len(agent_ids), NUM_ENCODED_STATES, action_space_size)
+        agent_ids (list): 智能体 ID, 与 q_values 第一维对应; 共享表使用 [SHARED_AGENT_ID]
+        extra (dict): 可选的附加头信息 (如训练 episode)
+    """
+    q_values = np.ascontiguousarray(q_values, dtype=np.float32)
+    if q_values.ndim != 3 or q_values.shape[0] != len(agent_ids) or q_values.shape[1] != NUM_ENCODED_STATES:
+        raise ValueError(f"Q-values shape {q_values.shape} does not match {len(agent_ids)} agents x {NUM_ENCODED_STATES} states")
+
+    directory = os.path.dirname(path)
+    if directory: os.makedirs(directory, exist_ok=True)
+
+    header = {
+        "format": CHECKPOINT_FORMAT,
+        "version": CHECKPOINT_VERSION,
+        "action_space_size": int(q_values.shape[2]),
+        "state_features": list(STATE_FEATURES),
+        "state_feature_sizes": list(STATE_FEATURE_SIZES),
+        "agent_ids": list(agent_ids),
+        "shape": list(q_values.shape),
+        "dtype": str(q_values.dtype),
+        "data_file": os.path.basename(path),
+    }
+    if extra: header["extra"] = extra
+
+    # 先写数组再写头信息; 加载时会校验两者的形状是否一致
+    _atomic_write(path, lambda f: np.save(f, q_values, allow_pickle=False))
+    _atomic_write(header_path_for(path), lambda f: json.dump(header, f, indent=2, ensure_ascii=False), binary=False)
+    logger.info(f"Saved dense Q-table checkpoint {path} ({q_values.shape[0]} agents, {q_values.nbytes / 1e6:.1f} MB).")
+
+
+def load_q_checkpoint(path, mmap_mode="r"):
+    """
+    加载稠密 Q 表检查点并校验头信息。
+
+    Args:
+        path (str): .npy 文件路径
+        mmap_mode (str): 传给 np.load; "r" 只读映射, "c" 写时复制 (可继续学习但不改动文件), None 读入内存
+
+    Returns:
+        tuple: (q_values, header)
+    """
+    with open(header_path_for(path), "r", encoding="utf-8") as f:
+        header = json.load(f)
+    if header.get("format") != CHECKPOINT_FORMAT:
+        raise ValueError(f"{path} is not a dense Q-table checkpoint")
+    if header.get("version", 0) > CHECKPOINT_VERSION:
+        raise ValueError(f"Checkpoint version {header.get('version')} is newer than supported version {CHECKPOINT_VERSION}")
+    if header.get("state_features") != list(STATE_FEATURES) or header.get("state_feature_sizes") != list(STATE_FEATURE_SIZES):
+        raise ValueError("Checkpoint state encoding does not match the current MARL state features")
+
+    q_values = np.load(path, mmap_mode=mmap_mode, allow_pickle=False)
+    if list(q_values.shape) != header.get("shape"):
+        raise ValueError(f"Checkpoint array shape {q_values.shape} does not match header {header.get('shape')} (interrupted save?)")
+    return q_values, header
@@ -0,0 +1,124 @@
+# ev_charging_project/algorithms/replay_buffer.py
+# MARL 经验回放缓冲区: 转移 (智能体, 编码状态, 动作, 奖励, 下一状态) 存放在预分配的 NumPy 环形数组中,
+# 每条转移只占十几个字节, 而不是整份状态字典。
+
+import numpy as np
+
+
+class ReplayBuffer:
+    """均匀采样的环形经验回放缓冲区"""
+
+    def __init__(self, capacity, seed=None):
+        if capacity <= 0:
+            raise ValueError(f"Replay buffer capacity must be positive, got {capacity}")
+        self.capacity = int(capacity)
+        self.agents = np.zeros(self.capacity, dtype=np.int32)
+        self.states = np.zeros(self.capacity, dtype=np.int32)
+        self.actions = np.zeros(self.capacity, dtype=np.int16)
+        self.rewards = np.zeros(self.capacity, dtype=np.float32)
+        self.next_states = np.zeros(self.capacity, dtype=np.int32)
+        self.position = 0 # 下一条写入的位置
+        self.size = 0
+        self.rng = np.random.default_rng(seed)
+
+    def __len__(self):
+        return self.size
+
+    def add(self, agent, state, action, reward, next_state):
+        """写入一条转移"""
+        self.add_batch([agent], [state], [action], [reward], [next_state])
+
+    def add_batch(self, agents, states, actions, rewards, next_states):
+        """批量写入转移, 超出容量时覆盖最旧的数据; 返回写入位置的索引数组"""
+        n = len(states)
+        if n == 0:
+            return np.zeros(0, dtype=np.int64)
+        if n > self.capacity: # 只保留最新的 capacity 条
+            agents, states, actions, rewards, next_states = (np.asarray(x)[-self.capacity:] for x in (agents, states, actions, rewards, next_states))
+            n = self.capacity
+        indices = (self.position + np.arange(n)) % self.capacity
+        self.agents[indices] = agents
+        self.states[indices] = states
+        self.actions[indices] = actions
+        self.rewards[indices] = rewards
+        self.next_states[indices] = next_states
+        self.position = int((self.position + n) % self.capacity)
+        self.size = min(self.size + n, self.capacity)
+        return indices
+
+    def _gather(self, indices):
+        return (self.agents[indices], self.states[indices], self.actions[indices].astype(np.int64),
+                self.rewards[indices], self.next_states[indices])
+
+    def sample(self, batch_size):
+        """
+        均匀采样一个 mini-batch。
+
+        Returns:
+            tuple: (indices, agents, states, actions, rewards, next_states, weights), weights 全为 1
+        """
+        if self.size == 0:
+            raise ValueError("Cannot sample from an empty replay buffer")
+        indices = self.rng.integers(0, self.size, size=batch_size)
+        return (indices,) + self._gather(indices) + (np.ones(batch_size, dtype=np.float32),)
+
+    def update_priorities(self, indices, td_errors):
+        """均匀缓冲区不使用优先级, 保持与 PrioritizedReplayBuffer 相同的接口"""
+        pass
+
+
+class PrioritizedReplayBuffer(ReplayBuffer):
+    """
+    按 TD 误差比例采样的经验回放 (proportional prioritization)。
+
+    采样概率 P(i) = p_i^alpha / sum_k p_k^alpha, 重要性采样权重 w_i = (N * P(i))^-beta / max(w)。
+    新写入的转移使用当前最大优先级, 保证至少被采到一次。
+    """
+
+    def __init__(self, capacity, alpha=0.6, beta=0.4, epsilon=1e-3, seed=None):
+        super().__init__(capacity, seed=seed)
+        self.alpha = alpha
+        self.beta = beta
+        self.epsilon = epsilon
+        self.priorities = np.zeros(self.capacity, dtype=np.float64)
+        self.max_priority = 1.0
+
+    def add_batch(self, agents, states, actions, rewards, next_states):
+        indices = super().add_batch(agents, states, actions, rewards, next_states)
+        self.priorities[indices] = self.max_priority
+        return indices
+
+    def sample(self, batch_size):
+        if self.size == 0:
+            raise ValueError("Cannot sample from an empty replay buffer")
+        scaled = self.priorities[:self.size] ** self.alpha
+        cumulative = np.cumsum(scaled)
+        total = cumulative[-1]
+        indices = np.searchsorted(cumulative, self.rng.random(batch_size) * total, side="right")
+        indices = np.minimum(indices, self.size - 1)
+        probabilities = scaled[indices] / total
+        weights = (self.size * probabilities) ** (-self.beta)
+        weights = (weights / weights.max()).astype(np.float32)
+        return (indices,) + self._gather(indices) + (weights,)
+
+    def update_priorities(self, indices, td_errors):
+        """用最新的 TD 误差更新被采样转移的优先级"""
+        priorities = np.abs(np.asarray(td_errors, dtype=np.float64)) + self.epsilon
+        self.priorities[indices] = priorities
+        self.max_priority = max(self.max_priority, float(priorities.max()))
+
+
+def create_replay_buffer(replay_config, seed=None):
+    """
+    根据配置创建回放缓冲区, 未启用时返回 None。
+
+    replay_config 示例: {"enabled": true, "capacity": 200000, "prioritized": false, "alpha": 0.6, "beta": 0.4}
+    """
+    if not replay_config or not replay_config.get("enabled", False):
+        return None
+    capacity = replay_config.get("capacity", 200000)
+    if replay_config.get("prioritized", False):
+        return PrioritizedReplayBuffer(capacity, alpha=replay_config.get("alpha", 0.6),
+                                       beta=replay_config.get("beta", 0.4),
+                                       epsilon=replay_config.get("priority_epsilon", 1e-3), seed=seed)
+    return ReplayBuffer(capacity, seed=seed)
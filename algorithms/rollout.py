@@ -0,0 +1,403 @@
+# ev_charging_project/algorithms/rollout.py
+# 前瞻滚动 (rollout) 调度: 每一步生成少量候选分配方案 (不同权重/模式的规则调度、无序调度、只调度紧急用户),
+# 在一个降保真度的代理模型上向前推演若干步, 选出综合得分最高的方案提交。
+#
+# 代理模型只从调度器收到的 state 构建 (调度器拿不到环境对象本身), 每步构建一次, 所有方案共用:
+#   - 出行: 直线距离 / 用户车速, 没有路径噪声和途中耗电;
+#   - 充电: 以 min(充电桩功率, 车辆功率) * 效率 恒功率充到目标 SOC, 不模拟 SOC 功率衰减;
+#   - 排队: 每个充电桩先进先出, 已有的在充/排队/在途用户折算为充电桩的积压时间;
+#   - 所有会话的排队、充电时段、逐步负载和收益都以 numpy 向量一次算出。
+# 每步有时间预算: 预算用完后不再评估新方案, 默认方案 (当前配置的规则调度) 总是先评估并作为兜底。
+# 可选的工作进程池并行生成和评估候选方案: 每步的 (state, 代理模型, 随机数状态) 只序列化一次, 放进共享内存,
+# 每个工作进程每步只反序列化一次; 上一步超时的方案仍在运行时本步不再向进程池提交, 改为在本进程中串行评估。
+
+import logging
+import pickle
+import random
+import time
+from concurrent.futures import ProcessPoolExecutor, wait
+from datetime import datetime
+from multiprocessing import shared_memory
+
+import numpy as np
+
+try:
+    from simulation.utils import KM_PER_DEGREE
+except ImportError:
+    logging.error("Could not import KM_PER_DEGREE from simulation.utils in rollout.py")
+    KM_PER_DEGREE = 111
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_PLAN = "rule_based"
+ROLLOUT_DEFAULTS = {
+    "horizon_steps": 8, # 向前推演的步数
+    "time_budget_ms": 200, # 每步用于生成和评估候选方案的时间预算
+    "strategy_variants": True, # 是否为 config["strategies"] 中的每组权重生成一个规则调度方案
+    "include_batch_plan": True, # 批量指派模式的规则调度方案
+    "include_uncoordinated_plan": True,
+    "include_urgent_only_plan": True, # 默认方案中只保留紧急用户, 其余用户推迟到以后的步
+    "urgent_soc": 20, # SOC 低于该值 (或明确需要充电) 的用户视为紧急
+    "charging_efficiency": 0.92,
+    "workers": 0, # >0 时在工作进程池中并行生成和评估方案
+}
+
+
+def _plan_config(config, weights=None, assignment_mode=None):
+    """复制配置中调度相关的部分, 替换优化权重或规则调度的指派模式"""
+    plan_config = dict(config)
+    if weights is not None:
+        plan_config["scheduler"] = dict(config.get("scheduler", {}), optimization_weights=dict(weights))
+    if assignment_mode is not None:
+        plan_config["environment"] = dict(config.get("environment", {}), rule_based_assignment_mode=assignment_mode)
+    return plan_config
+
+
+def _generate_plan(kind, plan_config, state, random_state):
+    """生成一个候选方案; 从同一个随机数状态出发并在结束后恢复, 生成方案不会扰动仿真的随机数流"""
+    saved = random.getstate()
+    random.setstate(random_state)
+    try:
+        if kind == "uncoordinated":
+            from . import uncoordinated
+            return uncoordinated.schedule(state)
+        from . import rule_based
+        return rule_based.schedule(state, plan_config)
+    finally:
+        random.setstate(saved)
+
+
+# 工作进程内缓存的本步上下文: (step_id, state, model, random_state)
+_worker_context = None
+
+
+def _step_context(context_ref):
+    """按 (共享内存名, 长度, step_id) 取本步上下文; 每个工作进程每步只反序列化一次"""
+    global _worker_context
+    shm_name, size, step_id = context_ref
+    if _worker_context is None or _worker_context[0] != step_id:
+        shm = shared_memory.SharedMemory(name=shm_name)
+        try:
+            state, model, random_state = pickle.loads(shm.buf[:size])
+        finally:
+            shm.close()
+        _worker_context = (step_id, state, model, random_state)
+    return _worker_context[1:]
+
+
+def _plan_worker(context_ref, name, kind, plan_config):
+    """工作进程入口: 生成并评估一个方案"""
+    state, model, random_state = _step_context(context_ref)
+    plan = _generate_plan(kind, plan_config, state, random_state)
+    return name, plan, evaluate_plan(model, plan)
+
+
+def build_rollout_model(state, config, horizon_steps, urgent_soc=20, charging_efficiency=0.92):
+    """
+    从 state 构建代理模型 (充电桩数组、用户数组、电网逐步曲线)。
+
+    Returns:
+        dict: 代理模型; 没有可用充电桩时返回 None
+    """
+    env_config = config.get("environment", {})
+    time_step_minutes = env_config.get("time_step_minutes", 15)
+    dt = time_step_minutes / 60.0
+    grid_status = state.get("grid_status", {})
+    users = {u["user_id"]: u for u in state.get("users", []) if isinstance(u, dict) and "user_id" in u}
+
+    chargers = [c for c in state.get("chargers", [])
+                if isinstance(c, dict) and "charger_id" in c and c.get("status") != "failure"
+                and isinstance(c.get("position"), dict)]
+    if not chargers:
+        return None
+    charger_index = {c["charger_id"]: i for i, c in enumerate(chargers)}
+    charger_coords = np.array([[c["position"].get("lat", np.nan), c["position"].get("lng", np.nan)] for c in chargers], dtype=np.float64)
+    charger_power = np.array([c.get("max_power", 60) for c in chargers], dtype=np.float64)
+    price_multiplier = np.array([c.get("price_multiplier", 1.0) for c in chargers], dtype=np.float64)
+
+    def session_hours(user, power):
+        soc = user.get("soc", 0)
+        target_soc = user.get("target_soc", min(95, soc + 60)) if user.get("status") == "charging" else min(95, soc + 60)
+        energy = max(0.0, target_soc - soc) / 100.0 * user.get("battery_capacity", 60)
+        return energy / (max(1e-6, min(power, user.get("max_charging_power", 60))) * charging_efficiency)
+
+    # 已有负载折算为积压时间: 在充用户剩余时间 + 排队用户 + 已出发前往该充电桩的用户
+    backlog = np.zeros(len(chargers))
+    existing_load = np.zeros(horizon_steps)
+    step_edges = np.arange(horizon_steps + 1) * dt
+    for i, charger in enumerate(chargers):
+        current_user = users.get(charger.get("current_user"))
+        if charger.get("status") == "occupied" and current_user:
+            remaining = session_hours(current_user, charger_power[i])
+            backlog[i] += remaining
+            overlap = np.clip(np.minimum(step_edges[1:], remaining) - step_edges[:-1], 0.0, None)
+            existing_load += overlap / dt * min(charger_power[i], current_user.get("max_charging_power", 60))
+        for queued_id in charger.get("queue", []):
+            if queued_id in users:
+                backlog[i] += session_hours(users[queued_id], charger_power[i])
+    for user in users.values():
+        if user.get("status") == "traveling" and user.get("target_charger") in charger_index:
+            i = charger_index[user["target_charger"]]
+            backlog[i] += session_hours(user, charger_power[i])
+
+    # 电网逐步曲线 (按每步中点所在的小时取值)
+    timestamp = state.get("timestamp")
+    try:
+        current_dt = datetime.fromisoformat(timestamp.split('+')[0].split('Z')[0].split('.')[0])
+    except (AttributeError, ValueError):
+        current_dt = datetime.now()
+    hours = ((current_dt.hour + current_dt.minute / 60.0 + (np.arange(horizon_steps) + 0.5) * dt) // 1 % 24).astype(int)
+    peak_hours = grid_status.get("peak_hours", [7, 8, 9, 10, 18, 19, 20, 21])
+    valley_hours = grid_status.get("valley_hours", [0, 1, 2, 3, 4, 5])
+    is_peak = np.isin(hours, peak_hours)
+    prices = np.where(is_peak, grid_status.get("peak_price", 1.2),
+                      np.where(np.isin(hours, valley_hours), grid_status.get("valley_price", 0.4), grid_status.get("normal_price", 0.85)))
+    base_load_profile = np.asarray(grid_status.get("base_load_profile", [16000] * 24), dtype=np.float64)
+    system_capacity = grid_status.get("system_capacity", 60000) or 60000
+
+    # 候选集: 所有方案的得分都按同一组待调度用户归一化
+    default_threshold = env_config.get("default_charge_soc_threshold", 40.0)
+    eligible = [u for u in users.values()
+                if u.get("status") not in ("charging", "waiting", "traveling")
+                and (u.get("needs_charge_decision") or u.get("soc", 100) <= default_threshold)]
+    urgent_ids = {u["user_id"] for u in eligible if u.get("needs_charge_decision") or u.get("soc", 100) < urgent_soc}
+    mean_need = np.mean([(min(95, u.get("soc", 0) + 60) - u.get("soc", 0)) / 100.0 * u.get("battery_capacity", 60)
+                         for u in eligible]) if eligible else 30.0
+
+    return {
+        "users": users,
+        "charger_index": charger_index,
+        "charger_coords": charger_coords,
+        "charger_power": charger_power,
+        "price_multiplier": price_multiplier,
+        "backlog": backlog,
+        "dt": dt,
+        "step_edges": step_edges,
+        "prices": prices,
+        "is_peak": is_peak,
+        "background_load": base_load_profile[hours] + existing_load,
+        "system_capacity": float(system_capacity),
+        "urgent_ids": urgent_ids,
+        "candidate_count": max(1, len(eligible)),
+        "energy_scale": max(1, len(eligible)) * max(1.0, float(mean_need)),
+        "max_price": float(prices.max()) * float(price_multiplier.max()),
+        "charging_efficiency": charging_efficiency,
+        "weights": config.get("scheduler", {}).get("optimization_weights",
+                                                     {"user_satisfaction": 0.33, "operator_profit": 0.33, "grid_friendliness": 0.34}),
+    }
+
+
+def evaluate_plan(model, plan):
+    """
+    在代理模型上推演一个方案 {user_id: charger_id}。
+
+    Returns:
+        dict: user_satisfaction / operator_profit / grid_friendliness 分项及加权总分 total
+    """
+    pairs = [(model["users"][uid], model["charger_index"][cid]) for uid, cid in plan.items()
+             if uid in model["users"] and cid in model["charger_index"]]
+    unserved_urgent = len(model["urgent_ids"].difference(plan))
+    n = len(pairs)
+    if n:
+        users = [u for u, _ in pairs]
+        c_idx = np.fromiter((i for _, i in pairs), dtype=np.int64, count=n)
+        user_coords = np.array([[u.get("current_position", {}).get("lat", np.nan), u.get("current_position", {}).get("lng", np.nan)]
+                                for u in users], dtype=np.float64)
+        soc = np.array([u.get("soc", 0) for u in users], dtype=np.float64)
+        capacity = np.array([u.get("battery_capacity", 60) for u in users], dtype=np.float64)
+        vehicle_power = np.array([u.get("max_charging_power", 60) for u in users], dtype=np.float64)
+        speed = np.array([u.get("travel_speed", 45) for u in users], dtype=np.float64)
+
+        delta = user_coords - model["charger_coords"][c_idx]
+        distance = np.nan_to_num(np.hypot(delta[:, 0], delta[:, 1]) * KM_PER_DEGREE, nan=50.0)
+        arrival = distance / np.where(speed > 0, speed, 45.0)
+        power = np.minimum(model["charger_power"][c_idx], vehicle_power)
+        energy = (np.minimum(95.0, soc + 60.0) - soc) / 100.0 * capacity
+        duration = energy / (np.maximum(power, 1e-6) * model["charging_efficiency"])
+
+        # 每个充电桩先进先出: 按 (充电桩, 到达时间) 排序后, 组内
+        #   end_k = C_k + max(backlog, max_{j<=k}(arrival_j - C_{j-1})), C_k 为组内累计充电时长
+        order = np.lexsort((arrival, c_idx))
+        c_sorted, arr_sorted, dur_sorted = c_idx[order], arrival[order], duration[order]
+        group_start = np.r_[True, c_sorted[1:] != c_sorted[:-1]]
+        group_id = np.cumsum(group_start) - 1
+        cum = np.cumsum(dur_sorted)
+        cum_before_group = (cum - dur_sorted)[group_start][group_id]
+        cum_incl = cum - cum_before_group
+        slack = arr_sorted - (cum_incl - dur_sorted)
+        # 组间互不影响: 给每组加上递增的偏移后做一次全局前缀最大值
+        offset = group_id * (slack.max() - slack.min() + 1.0)
+        slack_max = np.maximum.accumulate(slack + offset) - offset
+        end = cum_incl + np.maximum(model["backlog"][c_sorted], slack_max)
+        start = end - dur_sorted
+        wait_hours = start - arr_sorted
+
+        # 会话与各推演步的重叠时长 -> 逐步负载和收益
+        edges = model["step_edges"]
+        overlap = np.clip(np.minimum(end[:, None], edges[None, 1:]) - np.maximum(start[:, None], edges[None, :-1]), 0.0, None)
+        grid_energy = overlap * power[order][:, None] # kWh (从电网取电)
+        step_energy = grid_energy.sum(axis=0)
+        revenue = float(((grid_energy @ model["prices"]) * model["price_multiplier"][c_sorted]).sum())
+        satisfaction = float((1.0 / (1.0 + arr_sorted + wait_hours)).sum())
+    else:
+        step_energy = np.zeros(len(model["prices"]))
+        revenue = 0.0
+        satisfaction = 0.0
+
+    total_load = model["background_load"] + step_energy / model["dt"]
+    load_fraction = total_load / model["system_capacity"]
+    grid_penalty = float((step_energy * load_fraction * (1.0 + model["is_peak"])).sum()) / model["energy_scale"]
+    grid_penalty += float(np.clip(load_fraction - 1.0, 0.0, None).sum())
+
+    scores = {
+        "user_satisfaction": (satisfaction - unserved_urgent) / model["candidate_count"],
+        "operator_profit": revenue / (model["energy_scale"] * model["max_price"]) if model["max_price"] > 0 else 0.0,
+        "grid_friendliness": -grid_penalty,
+    }
+    weights = model["weights"]
+    scores["total"] = sum(scores[key] * weights.get(key, 0) for key in ("user_satisfaction", "operator_profit", "grid_friendliness"))
+    scores["assignments"] = n
+    return scores
+
+
+class RolloutScheduler:
+    """每步评估若干候选方案并提交代理模型上得分最高的一个"""
+
+    def __init__(self, config):
+        self.config = config
+        rollout_config = dict(ROLLOUT_DEFAULTS, **config.get("algorithms", {}).get("rollout", {}))
+        self.horizon_steps = max(1, int(rollout_config["horizon_steps"]))
+        self.time_budget = rollout_config["time_budget_ms"] / 1000.0
+        self.strategy_variants = rollout_config["strategy_variants"]
+        self.include_batch_plan = rollout_config["include_batch_plan"]
+        self.include_uncoordinated_plan = rollout_config["include_uncoordinated_plan"]
+        self.include_urgent_only_plan = rollout_config["include_urgent_only_plan"]
+        self.urgent_soc = rollout_config["urgent_soc"]
+        self.charging_efficiency = rollout_config["charging_efficiency"]
+        self.workers = int(rollout_config["workers"] or 0)
+        self._executor = None
+        self._step_id = 0
+        self._contexts = [] # 仍可能被工作进程读取的各步上下文共享内存块
+        self._stale_futures = [] # 上一步超时后仍在运行的方案
+        self.last_stats = {}
+        logger.info(f"Rollout scheduler: horizon {self.horizon_steps} steps, budget {rollout_config['time_budget_ms']} ms, "
+                    f"{self.workers or 'no'} worker processes.")
+
+    def candidate_plans(self):
+        """候选方案列表 [(name, kind, plan_config)], 默认方案在第一位"""
+        plans = [(DEFAULT_PLAN, "rule_based", self.config)]
+        if self.strategy_variants:
+            names = self.strategy_variants if isinstance(self.strategy_variants, list) else list(self.config.get("strategies", {}))
+            for name in names:
+                weights = self.config.get("strategies", {}).get(name)
+                if weights:
+                    plans.append((f"rule_based:{name}", "rule_based", _plan_config(self.config, weights=weights)))
+        if self.include_batch_plan and self.config.get("environment", {}).get("rule_based_assignment_mode", "greedy") != "batch":
+            plans.append(("rule_based:batch", "rule_based", _plan_config(self.config, assignment_mode="batch")))
+        if self.include_uncoordinated_plan:
+            plans.append(("uncoordinated", "uncoordinated", self.config))
+        return plans
+
+    def schedule(self, state):
+        """
+        生成并评估候选方案, 返回最佳方案的调度决策 {user_id: charger_id}。
+        """
+        started = time.perf_counter()
+        deadline = started + self.time_budget
+        model = build_rollout_model(state, self.config, self.horizon_steps, self.urgent_soc, self.charging_efficiency)
+        random_state = random.getstate()
+        plans = self.candidate_plans()
+
+        if model is None:
+            return _generate_plan("rule_based", self.config, state, random_state)
+
+        parallel = self.workers > 0 and len(plans) > 1 and not self._pool_busy()
+        if parallel:
+            results = self._evaluate_parallel(plans, state, model, random_state, deadline)
+        else:
+            results = []
+            for name, kind, plan_config in plans:
+                if results and time.perf_counter() >= deadline:
+                    break
+                plan = _generate_plan(kind, plan_config, state, random_state)
+                results.append((name, plan, evaluate_plan(model, plan)))
+
+        # 只调度紧急用户: 由默认方案派生, 几乎不耗时
+        if self.include_urgent_only_plan and time.perf_counter() < deadline:
+            default_plan = results[0][1]
+            urgent_plan = {uid: cid for uid, cid in default_plan.items() if uid in model["urgent_ids"]}
+            if len(urgent_plan) < len(default_plan):
+                results.append(("urgent_only", urgent_plan, evaluate_plan(model, urgent_plan)))
+
+        best_name, best_plan, best_scores = max(results, key=lambda r: r[2]["total"])
+        elapsed_ms = (time.perf_counter() - started) * 1000
+        self.last_stats = {
+            "chosen_plan": best_name,
+            "evaluated_plans": len(results),
+            "candidate_plans": len(plans) + int(self.include_urgent_only_plan),
+            "elapsed_ms": elapsed_ms,
+            "parallel": parallel,
+            "scores": {name: scores["total"] for name, _, scores in results},
+        }
+        logger.debug("Rollout chose plan '%s' (%.4f) from %d evaluated plans in %.1f ms.",
+                     best_name, best_scores["total"], len(results), elapsed_ms)
+        return best_plan
+
+    def _pool_busy(self):
+        """上一步超时的方案是否仍在运行 (运行中的 future 无法取消, 此时再提交只会排在它们后面)"""
+        self._stale_futures = [f for f in self._stale_futures if not f.done()]
+        self._release_contexts()
+        if self._stale_futures:
+            logger.debug("Rollout worker pool still busy with %d stale plans; evaluating inline this step.", len(self._stale_futures))
+            return True
+        return False
+
+    def _release_contexts(self, keep_latest=True):
+        """释放不再被运行中的方案使用的上下文共享内存块"""
+        keep = 1 if keep_latest and self._stale_futures else 0
+        while len(self._contexts) > keep:
+            shm = self._contexts.pop(0)
+            shm.close()
+            shm.unlink()
+
+    def _publish_context(self, state, model, random_state):
+        """把本步上下文序列化一次写入共享内存, 返回工作进程使用的引用"""
+        self._release_contexts(keep_latest=False)
+        blob = pickle.dumps((state, model, random_state), protocol=pickle.HIGHEST_PROTOCOL)
+        shm = shared_memory.SharedMemory(create=True, size=max(1, len(blob)))
+        shm.buf[:len(blob)] = blob
+        self._contexts.append(shm)
+        self._step_id += 1
+        return shm.name, len(blob), self._step_id
+
+    def _evaluate_parallel(self, plans, state, model, random_state, deadline):
+        """默认方案在本进程中计算, 其余方案分发到进程池; 超过预算仍未完成的方案被丢弃"""
+        if self._executor is None:
+            self._executor = ProcessPoolExecutor(max_workers=self.workers)
+        context_ref = self._publish_context(state, model, random_state)
+        futures = [self._executor.submit(_plan_worker, context_ref, name, kind, plan_config)
+                   for name, kind, plan_config in plans[1:]]
+        name, kind, plan_config = plans[0]
+        default_plan = _generate_plan(kind, plan_config, state, random_state)
+        results = [(name, default_plan, evaluate_plan(model, default_plan))]
+
+        done, not_done = wait(futures, timeout=max(0.0, deadline - time.perf_counter()))
+        for future in futures: # 保持候选方案顺序, 得分相同时结果与串行一致
+            if future in done:
+                try:
+                    results.append(future.result())
+                except Exception as e:
+                    logger.error(f"Rollout plan evaluation failed in worker: {e}")
+        # 还没开始的方案可以取消; 已在运行的记下来, 下一步在它们结束前不再提交
+        self._stale_futures = [f for f in not_done if not f.cancel()]
+        if not_done:
+            logger.debug("Rollout dropped %d plans that missed the time budget (%d still running).", len(not_done), len(self._stale_futures))
+        return results
+
+    def close(self):
+        """关闭工作进程池并释放上下文共享内存"""
+        if self._executor is not None:
+            self._executor.shutdown(wait=True, cancel_futures=True)
+            self._executor = None
+        self._stale_futures = []
+        self._release_contexts(keep_latest=False)
@@ -4,11 +4,13 @@ import math
 import random
 from datetime import datetime
 from collections import defaultdict
+import numpy as np
 try:
-    from simulation.utils import calculate_distance # 注意这里的导入路径
+    from simulation.utils import calculate_distance, entity_coords, iter_distance_chunks # 注意这里的导入路径
 except ImportError:
     logging.error("Could not import calculate_distance from simulation.utils in rule_based.py")
     def calculate_distance(p1, p2): return 10.0 # Fallback
+from .assignment import solve_capacitated_assignment
 
 logger = logging.getLogger(__name__)
 
@@ -124,6 +126,17 @@ def schedule(state, config):
         if charger.get("status") == "occupied": charger_loads[cid] += 1
         charger_loads[cid] += len(charger.get("queue", []))
 
+    # 本步内与用户无关的评分部分只计算一次
+    score_table = _build_charger_score_table(
+        (c for c in charger_dict.values() if c.get("status") != "failure"), state
+    )
+
+    # 批量指派模式: 一次性求解带容量约束的指派问题, 代替逐个贪心分配
+    if env_config.get("rule_based_assignment_mode", "greedy") == "batch":
+        decisions = _schedule_batch(candidate_users, charger_dict, charger_loads, max_queue_len, weights, score_table, env_config)
+        logger.info(f"RuleBased (batch) made {len(decisions)} assignments for {len(candidate_users)} candidates.")
+        return decisions
+
     # 为候选用户分配充电桩
     assigned_users = set()
     num_assigned = 0
@@ -151,8 +164,9 @@ def schedule(state, config):
             # 调用评分函数
             current_queue_len = charger_loads.get(charger_id, 0) # 当前实际负载
             user_score = _calculate_user_satisfaction_score(user, charger, distance, current_queue_len)
-            profit_score = _calculate_operator_profit_score(user, charger, state)
-            grid_score = _calculate_grid_friendliness_score(charger, state)
+            charger_scores = score_table[charger_id]
+            profit_score = _operator_profit_from_base(charger_scores["profit_base"], user)
+            grid_score = charger_scores["grid"]
 
             # 动态权重调整
             adjusted_weights = weights.copy()
@@ -190,23 +204,151 @@ def schedule(state, config):
     return decisions
 
 
+# 批量模式下行优先级加分: 保证容量不足时仍优先满足明确需要充电、紧迫度高的用户
+BATCH_PRIORITY_NEEDS_CHARGE = 2.0
+BATCH_PRIORITY_URGENCY = 0.5
+
+
+def _schedule_batch(candidate_users, charger_dict, charger_loads, max_queue_len, weights, score_table, env_config):
+    """
+    批量指派模式。
+
+    对每个候选用户只考虑距离最近的 k 个可用充电桩 (稀疏代价矩阵), 使用与贪心模式相同的
+    三个评分函数和权重计算得分, 其中排队相关的部分按 "占用第 s 个空位" 展开,
+    然后通过带容量约束的指派求解一次性得到全部决策。
+
+    Returns:
+        dict: 调度决策 {user_id: charger_id}
+    """
+    decisions = {}
+    if not candidate_users:
+        return decisions
+
+    charger_ids = [cid for cid, c in charger_dict.items() if c.get("status") != "failure"]
+    loads = np.array([charger_loads.get(cid, 0) for cid in charger_ids], dtype=np.int64)
+    capacities = np.maximum(max_queue_len - loads, 0)
+    feasible_idx = np.nonzero(capacities > 0)[0]
+    if len(feasible_idx) == 0:
+        return decisions
+
+    chargers = [charger_dict[cid] for cid in charger_ids]
+    users = [user for _, user, _, _ in candidate_users]
+    charger_coords = entity_coords(chargers, "position")[feasible_idx]
+    user_coords = entity_coords(users, "current_position")
+    k = min(env_config.get("rule_based_candidate_limit", 15), len(feasible_idx))
+
+    # 1. 稀疏候选边: 每个用户最近的 k 个可用充电桩
+    rows, cols, dists = [], [], []
+    for start, block in iter_distance_chunks(user_coords, charger_coords, method="planar"):
+        if k < block.shape[1]:
+            nearest = np.argpartition(block, k - 1, axis=1)[:, :k]
+        else:
+            nearest = np.broadcast_to(np.arange(block.shape[1]), block.shape)
+        nearest_d = np.take_along_axis(block, nearest, axis=1)
+        finite = np.isfinite(nearest_d)
+        rows.append((np.arange(block.shape[0])[:, np.newaxis] + start + np.zeros_like(nearest))[finite])
+        cols.append(feasible_idx[nearest[finite]])
+        dists.append(nearest_d[finite])
+    row_idx = np.concatenate(rows)
+    col_idx = np.concatenate(cols)
+    dist = np.concatenate(dists)
+    if len(row_idx) == 0:
+        return decisions
+
+    # 2. 与队列无关的评分部分 (每条边一次), 充电桩相关部分来自预计算的评分表
+    n_edges = len(row_idx)
+    parts = np.empty((n_edges, 4), dtype=np.float64)
+    for e in range(n_edges):
+        parts[e] = _user_satisfaction_parts(users[row_idx[e]], chargers[col_idx[e]], dist[e])
+
+    grid = np.array([score_table[cid]["grid"] for cid in charger_ids], dtype=np.float64)[col_idx]
+    profit_base = np.array([score_table[cid]["profit_base"] for cid in charger_ids], dtype=np.float64)[col_idx]
+    soc = np.array([u.get("soc", 50) for u in users], dtype=np.float64)[row_idx]
+    # 与 _operator_profit_from_base 相同的用户需求量加分和映射
+    profit = profit_base * (1 + (100 - soc) / 50.0 * 0.05)
+    profit = np.clip(2 * ((profit - 0.5) / (2.0 - 0.5)) - 1, -1.0, 1.0)
+    urgency = np.array([x[2] for x in candidate_users], dtype=np.float64)
+    needs_charge = np.array([1.0 if x[3] else 0.0 for x in candidate_users])
+
+    # 3. 每条边的动态权重 (与贪心模式相同的调整规则)
+    w_user = np.full(n_edges, weights["user_satisfaction"])
+    w_profit = np.full(n_edges, weights["operator_profit"])
+    w_grid = np.full(n_edges, weights["grid_friendliness"])
+    w_grid = np.where(grid < -0.5, np.minimum(0.8, w_grid * 1.5), w_grid)
+    w_user = np.where((urgency[row_idx] > 0.9) & (soc < 15), np.minimum(0.6, w_user * 1.5), w_user)
+    w_total = w_user + w_profit + w_grid
+    w_total = np.where(w_total > 0, w_total, 1.0)
+    w_user, w_profit, w_grid = w_user / w_total, w_profit / w_total, w_grid / w_total
+
+    # 4. 按空位展开: 占用第 s 个空位时队列长度为 load + s
+    n_slots = int(capacities[feasible_idx].max())
+    queue_len = loads[col_idx][:, np.newaxis] + np.arange(n_slots)[np.newaxis, :]
+    wait = np.select([queue_len == 0, queue_len <= 2, queue_len <= 5, queue_len <= 8], [0.5, 0.3, 0.1, -0.1], -0.3)
+    distance_score, power_score, price_score, emergency = (parts[:, i:i + 1] for i in range(4))
+    satisfaction = (distance_score * 0.4 * emergency + wait * 0.3 * emergency +
+                    power_score * 0.15 + price_score * 0.15)
+    satisfaction = np.where((emergency > 1.2) & (satisfaction < -0.5), np.maximum(-0.5, satisfaction * 0.8), satisfaction)
+    user_score = np.clip(satisfaction, -1.0, 1.0)
+
+    combined = (user_score * w_user[:, np.newaxis] +
+                (profit * w_profit + grid * w_grid)[:, np.newaxis])
+    queue_penalty_factor = env_config.get("rule_based_queue_penalty", 0.05)
+    slot_scores = combined - queue_len * queue_penalty_factor
+    slot_scores[np.arange(n_slots)[np.newaxis, :] >= capacities[col_idx][:, np.newaxis]] = np.nan
+
+    # 5. 求解
+    row_priority = needs_charge * BATCH_PRIORITY_NEEDS_CHARGE + urgency * BATCH_PRIORITY_URGENCY
+    assignment = solve_capacitated_assignment(row_idx, col_idx, slot_scores, capacities, len(users), row_priority)
+    for i, c in enumerate(assignment):
+        if c >= 0:
+            decisions[candidate_users[i][0]] = charger_ids[c]
+    return decisions
+
+
 # --- 评分辅助函数 ---
 def _calculate_user_satisfaction_score(user, charger, distance, current_queue_len):
     """计算用户满意度评分 [-1, 1] (使用原 Environment 的详细逻辑)"""
     # (复制粘贴原 _calculate_user_satisfaction 的完整逻辑)
+    distance_score, power_score, price_score, emergency_factor = _user_satisfaction_parts(user, charger, distance)
+    wait_score = _wait_score(current_queue_len)
+
+    # 综合评分
+    satisfaction = (
+        distance_score * 0.4 * emergency_factor +
+        wait_score * 0.3 * emergency_factor +
+        power_score * 0.15 +
+        price_score * 0.15
+    )
+    # 限制和调整
+    if emergency_factor > 1.2 and satisfaction < -0.5:
+        satisfaction = max(-0.5, satisfaction * 0.8)
+    score = max(-1.0, min(1.0, satisfaction))
+    # logger.debug(f"User Sat Score for {user.get('user_id')} @ {charger.get('charger_id')}: Dist={distance_score:.2f}, Wait={wait_score:.2f}, Power={power_score:.2f}, Price={price_score:.2f} -> Final={score:.2f}")
+    return score
+
+
+def _wait_score(current_queue_len):
+    """等待时间因素 (基于当前队列长度)"""
+    if current_queue_len == 0: return 0.5
+    elif current_queue_len <= 2: return 0.3
+    elif current_queue_len <= 5: return 0.1
+    elif current_queue_len <= 8: return -0.1
+    else: return -0.3
+
+
+def _user_satisfaction_parts(user, charger, distance):
+    """
+    用户满意度中与队列长度无关的部分。
+
+    Returns:
+        tuple: (distance_score, power_score, price_score, emergency_factor)
+    """
     # 1. 距离因素
     if distance < 2: distance_score = 0.5 - distance * 0.1
     elif distance < 5: distance_score = 0.3 - (distance - 2) * 0.1
     elif distance < 10: distance_score = 0 - (distance - 5) * 0.05
     else: distance_score = max(-0.5, -0.25 - (distance - 10) * 0.025)
 
-    # 2. 等待时间因素 (基于当前队列长度)
-    if current_queue_len == 0: wait_score = 0.5
-    elif current_queue_len <= 2: wait_score = 0.3
-    elif current_queue_len <= 5: wait_score = 0.1
-    elif current_queue_len <= 8: wait_score = -0.1
-    else: wait_score = -0.3
-
     # 3. 充电速度匹配因素
     charger_power = charger.get("max_power", 50)
     user_type = user.get("user_type", "private")
@@ -231,40 +373,68 @@ def _calculate_user_satisfaction_score(user, charger, distance, current_queue_le
     if user_soc < 15: emergency_factor = 1.5
     elif user_soc < 25: emergency_factor = 1.2
 
-    # 综合评分
-    satisfaction = (
-        distance_score * 0.4 * emergency_factor +
-        wait_score * 0.3 * emergency_factor +
-        power_score * 0.15 +
-        price_score * 0.15
-    )
-    # 限制和调整
-    if emergency_factor > 1.2 and satisfaction < -0.5:
-        satisfaction = max(-0.5, satisfaction * 0.8)
-    score = max(-1.0, min(1.0, satisfaction))
-    # logger.debug(f"User Sat Score for {user.get('user_id')} @ {charger.get('charger_id')}: Dist={distance_score:.2f}, Wait={wait_score:.2f}, Power={power_score:.2f}, Price={price_score:.2f} -> Final={score:.2f}")
-    return score
+    return distance_score, power_score, price_score, emergency_factor
 
 
 def _calculate_operator_profit_score(user, charger, state):
     """计算运营商利润评分 [-1, 1] (使用原 Environment 的详细逻辑)"""
-    # (复制粘贴原 _calculate_operator_profit 的完整逻辑)
+    context = _build_step_context(state)
+    return _operator_profit_from_base(_operator_profit_base(charger, context), user)
+
+
+def _calculate_grid_friendliness_score(charger, state):
+    """计算电网友好度评分 [-1, 1] (使用原 Environment 的详细逻辑)"""
+    context = _build_step_context(state)
+    return _grid_friendliness_from_context(charger, context)
+
+
+# --- 每步 / 每充电桩 评分预计算 ---
+# 电网友好度只依赖充电桩和全局状态, 运营商利润中只有 "需求量加分" 依赖用户。
+# 每次 schedule 调用构建一次评分表, 每个 用户-充电桩 组合只计算与用户相关的剩余部分。
+
+def _build_step_context(state):
+    """提取一个调度步内所有评分共用的时间/电网/价格上下文"""
     grid_status = state.get("grid_status", {})
-    hour = datetime.fromisoformat(state.get('timestamp', '')).hour if state.get('timestamp') else datetime.now().hour
-    peak_hours = grid_status.get("peak_hours", [])
-    valley_hours = grid_status.get("valley_hours", [])
-    current_price = grid_status.get("current_price", 0.85) # 使用当前电价作为基础
+    renewable_ratio = grid_status.get("renewable_ratio")
+    return {
+        "hour": datetime.fromisoformat(state.get('timestamp', '')).hour if state.get('timestamp') else datetime.now().hour,
+        "grid_load_percentage": grid_status.get("grid_load_percentage", 50),
+        "renewable_ratio": renewable_ratio / 100.0 if renewable_ratio is not None else 0.0,
+        "peak_hours": grid_status.get("peak_hours", []),
+        "valley_hours": grid_status.get("valley_hours", []),
+        "current_price": grid_status.get("current_price", 0.85), # 使用当前电价作为基础
+    }
+
+
+def _build_charger_score_table(chargers, state):
+    """
+    构建本调度步的充电桩评分表。
 
-    user_soc = user.get("soc", 50)
-    charge_needed_factor = (100 - user_soc) / 50.0 # 0-2 scale approx
+    Args:
+        chargers (iterable): 充电桩字典
+        state (dict): 当前环境状态
 
+    Returns:
+        dict: {charger_id: {"grid": 电网友好度评分, "profit_base": 与用户无关的利润基础分}}
+    """
+    context = _build_step_context(state)
+    return {
+        charger["charger_id"]: {
+            "grid": _grid_friendliness_from_context(charger, context),
+            "profit_base": _operator_profit_base(charger, context),
+        }
+        for charger in chargers
+    }
+
+
+def _operator_profit_base(charger, context):
+    """运营商利润中与用户无关的部分: 有效价格、快充加分和队列惩罚"""
     charger_type = charger.get("type", "normal")
     charger_price_multiplier = charger.get("price_multiplier", 1.0)
-    is_occupied = charger.get("status") == "occupied"
     queue_length = len(charger.get("queue", []))
 
     # 评分基于有效价格、快充、队列和需求量
-    effective_price = current_price * charger_price_multiplier
+    effective_price = context["current_price"] * charger_price_multiplier
     score = effective_price # Base score on price
 
     # 快充加分
@@ -274,29 +444,29 @@ def _calculate_operator_profit_score(user, charger, state):
     # 队列惩罚
     penalty_per_queue = 0.15 # 调整惩罚力度
     score -= queue_length * penalty_per_queue
+    return score
+
+
+def _operator_profit_from_base(base_score, user):
+    """在利润基础分上叠加用户需求量加分并映射到 [-1, 1]"""
+    user_soc = user.get("soc", 50)
+    charge_needed_factor = (100 - user_soc) / 50.0 # 0-2 scale approx
 
     # 需求量加分
-    score *= (1 + charge_needed_factor * 0.05) # 较小影响
+    score = base_score * (1 + charge_needed_factor * 0.05) # 较小影响
 
     # 映射到 [-1, 1] - 可以使用简单的线性映射或 Sigmoid
     # 简单线性映射示例: 假设分数范围在 0.5 到 2.0 之间比较常见
     normalized_score = (score - 0.5) / (2.0 - 0.5) # Map to ~[0, 1]
     final_score = 2 * normalized_score - 1 # Map to [-1, 1]
     final_score = max(-1.0, min(1.0, final_score)) # Clamp
-
-    # logger.debug(f"Operator Profit Score for {user.get('user_id')} @ {charger.get('charger_id')}: EffectivePrice={effective_price:.2f}, Type={charger_type}, Queue={queue_length} -> Raw={score:.2f} -> Final={final_score:.2f}")
     return final_score
 
 
-def _calculate_grid_friendliness_score(charger, state):
-    """计算电网友好度评分 [-1, 1] (使用原 Environment 的详细逻辑)"""
-    # (复制粘贴原 _calculate_grid_friendliness 的完整逻辑)
-    grid_status = state.get("grid_status", {})
-    hour = datetime.fromisoformat(state.get('timestamp', '')).hour if state.get('timestamp') else datetime.now().hour
-    grid_load_percentage = grid_status.get("grid_load_percentage", 50)
-    renewable_ratio = grid_status.get("renewable_ratio", 0) / 100.0 if grid_status.get("renewable_ratio") is not None else 0.0
-    peak_hours = grid_status.get("peak_hours", [])
-    valley_hours = grid_status.get("valley_hours", [])
+def _grid_friendliness_from_context(charger, context):
+    """根据预先提取的步上下文计算单个充电桩的电网友好度评分"""
+    grid_load_percentage = context["grid_load_percentage"]
+    hour = context["hour"]
     charger_max_power = charger.get("max_power", 50)
 
     # 1. 负载评分
@@ -307,12 +477,12 @@ def _calculate_grid_friendliness_score(charger, state):
     else: load_score = max(-0.5, -0.225 - (grid_load_percentage - 85) * 0.01)
 
     # 2. 可再生能源
-    renewable_score = 0.8 * renewable_ratio
+    renewable_score = 0.8 * context["renewable_ratio"]
 
     # 3. 时间
     time_score = 0
-    if hour in peak_hours: time_score = -0.3
-    elif hour in valley_hours: time_score = 0.6
+    if hour in context["peak_hours"]: time_score = -0.3
+    elif hour in context["valley_hours"]: time_score = 0.6
     else: time_score = 0.2
 
     # 4. 功率惩罚 (可选)
@@ -327,5 +497,5 @@ def _calculate_grid_friendliness_score(charger, state):
     if grid_friendliness < 0: grid_friendliness *= 0.8
     else: grid_friendliness = min(1.0, grid_friendliness * 1.1)
 
-    # logger.debug(f"Grid Friendliness Score for {charger.get('charger_id')}: Load%={grid_load_percentage:.1f}({load_score:.2f}), Renew%={renewable_ratio*100:.1f}({renewable_score:.2f}), Time={hour}({time_score:.2f}) -> Final={grid_friendliness:.2f}")
-    return grid_friendliness
\ No newline at end of file
+    # logger.debug(f"Grid Friendliness Score for {charger.get('charger_id')}: Load%={grid_load_percentage:.1f}({load_score:.2f}), Renew%={context['renewable_ratio']*100:.1f}({renewable_score:.2f}), Time={hour}({time_score:.2f}) -> Final={grid_friendliness:.2f}")
+    return grid_friendliness
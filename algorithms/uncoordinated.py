@@ -3,20 +3,32 @@ import logging
 import math
 import random
 from collections import defaultdict
+
+import numpy as np
+
 try:
-    from simulation.utils import calculate_distance # 注意导入路径
+    from simulation.utils import calculate_distance, entity_coords, iter_distance_chunks # 注意导入路径
 except ImportError:
     logging.error("Could not import calculate_distance from simulation.utils in uncoordinated.py")
     def calculate_distance(p1, p2): return 10.0 # Fallback
+    entity_coords = iter_distance_chunks = None
 
 logger = logging.getLogger(__name__)
 
-def schedule(state):
+MAX_QUEUE_ALLOWED = 4 # 无序用户能容忍的最大队列
+LOW_SOC_THRESHOLD = 20 # 低于该 SOC 时用户只看距离
+DISTANCE_WEIGHT = 0.7
+QUEUE_PENALTY_KM = 5.0 # 队列惩罚（每人等效5km）
+BATCH_ROUND_SIZE = 1024 # 批量模式下每轮一起评估的用户数
+
+def schedule(state, batched=True):
     """
     无序充电算法实现 (先到先得，或基于简单距离/队列)。
 
     Args:
         state (dict): 当前环境状态
+        batched (bool): 是否使用向量化的批量实现。两种实现在相同随机种子下给出相同决策，
+                        逐个用户的循环实现保留作为参考。
 
     Returns:
         dict: 调度决策 {user_id: charger_id}
@@ -53,12 +65,17 @@ def schedule(state):
         logger.warning("Uncoordinated: No operational chargers found.")
         return decisions
 
+    if batched and iter_distance_chunks is not None:
+        decisions = _schedule_batched(candidate_users, charger_dict)
+        logger.info(f"Uncoordinated made {len(decisions)} assignments for {len(candidate_users)} candidates.")
+        return decisions
+
     # 记录本轮已分配给充电桩的用户数，模拟用户看到的情况
     current_assignments = defaultdict(int)
 
     assigned_users_this_step = set() # 防止重复分配
 
-    max_queue_allowed = 4 # 无序用户能容忍的最大队列
+    max_queue_allowed = MAX_QUEUE_ALLOWED
 
     for user in candidate_users:
         user_id = user.get("user_id")
@@ -81,10 +98,10 @@ def schedule(state):
                 # 无序用户的选择策略：
                 # SOC很低时，更看重距离；否则距离和队列都看重一点
                 eval_score = 0
-                if soc < 20:
+                if soc < LOW_SOC_THRESHOLD:
                     eval_score = dist # 主要看距离
                 else:
-                    eval_score = dist * 0.7 + total_waiting * 5.0 # 距离权重0.7，队列惩罚（每人等效5km）
+                    eval_score = dist * DISTANCE_WEIGHT + total_waiting * QUEUE_PENALTY_KM # 距离权重0.7，队列惩罚（每人等效5km）
 
                 possible_targets.append((cid, eval_score))
 
@@ -103,4 +120,65 @@ def schedule(state):
             # logger.debug(f"Uncoordinated assigned user {user_id} to charger {best_charger_id}")
 
     logger.info(f"Uncoordinated made {len(decisions)} assignments for {len(candidate_users)} candidates.")
-    return decisions
\ No newline at end of file
+    return decisions
+
+def _schedule_batched(candidate_users, charger_dict):
+    """
+    schedule 的向量化实现。
+
+    按已打乱的顺序将用户分成若干轮，每轮一次性计算 用户 x 充电桩 的距离矩阵，
+    用掩码套用与循环版相同的 SOC 评分规则，并基于本轮开始时的排队人数求出每个用户的最优充电桩。
+    之后按顺序逐个确认：本轮内被分配过的充电桩排队人数只会增加（分数变差或变为不可用），
+    因此若用户的最优选择不是这些充电桩，该选择依然最优；否则用当前排队人数重新计算该用户这一行。
+    这样得到的结果与逐个用户循环完全一致。
+    """
+    decisions = {}
+    charger_ids = list(charger_dict.keys())
+    chargers = list(charger_dict.values())
+    charger_coords = entity_coords(chargers, "position")
+    # 真实队列 + 正在充电的用户
+    base_waiting = np.array([len(c.get("queue", [])) + (1 if c.get("status") == "occupied" else 0) for c in chargers], dtype=np.float64)
+    current_assignments = np.zeros(len(chargers), dtype=np.float64)
+
+    # 去重 (与循环版的 assigned_users_this_step 等价)
+    seen = set()
+    users = []
+    for user in candidate_users:
+        user_id = user.get("user_id")
+        if not user_id or user_id in seen: continue
+        seen.add(user_id)
+        users.append(user)
+    if not users:
+        return decisions
+
+    user_coords = entity_coords(users, "current_position")
+    low_soc = np.array([user.get("soc", 100) < LOW_SOC_THRESHOLD for user in users], dtype=bool)
+
+    def _scores(dist, low, total_waiting):
+        # 与循环版相同的评分规则; 不可达或队列已满的充电桩记为 inf
+        scores = np.where(low, dist, dist * DISTANCE_WEIGHT + total_waiting * QUEUE_PENALTY_KM)
+        scores[np.isinf(dist) | (total_waiting >= MAX_QUEUE_ALLOWED)] = np.inf
+        return scores
+
+    for start, dist_block in iter_distance_chunks(user_coords, charger_coords, method="planar", chunk_size=BATCH_ROUND_SIZE):
+        round_waiting = base_waiting + current_assignments
+        block_scores = _scores(dist_block, low_soc[start:start + len(dist_block), np.newaxis], round_waiting[np.newaxis, :])
+        # argmin 取第一个最小值，与循环版稳定排序后取第一个的行为一致
+        best = np.argmin(block_scores, axis=1)
+        best_score = block_scores[np.arange(len(best)), best]
+        touched = np.zeros(len(chargers), dtype=bool) # 本轮中已被分配过的充电桩
+
+        for i in range(len(best)):
+            c = best[i]
+            if np.isinf(best_score[i]):
+                continue # 排队人数只增不减，本轮开始时无可用充电桩则之后也不会有
+            if touched[c]:
+                row = _scores(dist_block[i], low_soc[start + i], base_waiting + current_assignments)
+                c = np.argmin(row)
+                if np.isinf(row[c]):
+                    continue
+            decisions[users[start + i]["user_id"]] = charger_ids[c]
+            current_assignments[c] += 1
+            touched[c] = True
+
+    return decisions
@@ -1,11 +1,10 @@
 # ev_charging_project/app.py
 
-from flask import Flask, render_template, request, jsonify, send_from_directory
+from flask import Flask, render_template, request, jsonify, send_from_directory, Response
 import json
 import os
 import logging
 from datetime import datetime, timedelta
-import numpy as np
 import time
 import threading
 import math
@@ -13,6 +12,7 @@ import random
 import pickle
 import traceback
 import argparse
+import hashlib
 from types import SimpleNamespace # Use SimpleNamespace for the system object
 
 # --- 关键导入 ---
@@ -62,6 +62,43 @@ current_state = { # 默认结构，防止后续访问出错
 }
 previous_states = {}
 simulation_step_delay_ms = 100.0 # 默认速度 (ms/步)
+checkpoint_requested = False # 由 /api/simulation/checkpoint 设置, 仿真线程在当前步结束后保存检查点
+result_index = None # 输出目录中结果文件的内存索引 (首次请求时创建)
+# /api/simulation/status 的序列化缓存: current_state 每步整体替换, 同一个对象只序列化一次
+_status_cache = {"state": None, "running": None, "body": None, "etag": None}
+_status_cache_lock = threading.Lock()
+# 实体查询索引缓存: 同一个 current_state 对象上的用户/充电桩索引只建立一次
+_entity_index_cache = {"state": None, "users": None, "chargers": None}
+_entity_index_lock = threading.Lock()
+
+# --- JSON 序列化辅助 ---
+def _json_default(x):
+    """json.dump 的 default: NumPy 标量转为 Python 数值, 其余转为字符串 (NumPy 仅在需要时导入)"""
+    import numpy as np
+    if isinstance(x, np.integer): return int(x)
+    if isinstance(x, np.floating): return float(x)
+    return str(x)
+
+def _etag_response(body, etag):
+    """返回带 ETag 的 JSON 响应; 客户端 If-None-Match 命中时返回 304"""
+    response = Response(body, mimetype="application/json")
+    response.set_etag(etag)
+    response.headers["Cache-Control"] = "no-cache" # 允许缓存但每次都要用 ETag 重新验证
+    return response.make_conditional(request)
+
+def get_result_index():
+    """返回输出目录的结果索引, 输出目录配置变化时重建"""
+    global result_index
+    vis_config = (system.config if system and getattr(system, 'config', None) else load_config()).get("visualization", {})
+    output_dir = vis_config.get("output_dir", "output")
+    if result_index is None or result_index.directory != output_dir:
+        from simulation.result_cache import ResultIndex
+        if result_index is not None: result_index.stop()
+        result_index = ResultIndex(output_dir, ttl_seconds=vis_config.get("results_cache_ttl_seconds", 5.0),
+                                   max_cached_bytes=int(vis_config.get("results_cache_max_mb", 64) * 1024 * 1024))
+        result_index.start_refresher(vis_config.get("results_refresh_interval_seconds", 10.0))
+        logger.info(f"Result index created for '{output_dir}'.")
+    return result_index
 
 # --- 配置加载 ---
 def load_config():
@@ -74,10 +111,16 @@ def load_config():
             "chargers_per_station": 15, "region_count": 8, "charger_failure_rate": 0,
              "map_bounds": {"lat_min": 30, "lat_max": 30.05, "lng_min": 116, "lng_max": 116.05},
              "enable_uncoordinated_baseline": True,
+             "uncoordinated_baseline_mode": "estimate",
+             "checkpoint_every_steps": 0, "checkpoint_dir": "output/checkpoints",
              "min_charge_threshold_percent": 20.0,
              "force_charge_soc_threshold": 20.0,
              "default_charge_soc_threshold": 40.0,
-             "charger_queue_capacity": 5
+             "charger_queue_capacity": 5,
+             "shard_count": 1, "shard_halo_km": 3.0, "shard_gather_state": False,
+             "shared_state_name": None,
+             "random_seed": None, "population_cache": True,
+             "rule_based_assignment_mode": "greedy"
         },
         "grid": {
             "base_load": [32000, 28000, 24000, 22400, 21600, 24000, 36000, 48000, 60000, 64000, 65600, 67200, 64000, 60000, 56000, 52000, 56000, 60000, 68000, 72000, 64000, 56000, 48000, 40000],
@@ -92,9 +135,15 @@ def load_config():
         "scheduler": {
             "scheduling_algorithm": "rule_based",
             "optimization_weights": {"user_satisfaction": 0.35, "operator_profit": 0.35, "grid_friendliness": 0.35},
-            "marl_config": {"action_space_size": 6, "discount_factor": 0.95, "exploration_rate": 0.1, "learning_rate": 0.01, "q_table_path": "models/marl_q_tables.pkl", "marl_candidate_max_dist_sq": 0.15**2, "marl_priority_w_soc": 0.5, "marl_priority_w_dist": 0.4, "marl_priority_w_urgency": 0.1},
+            "marl_config": {"action_space_size": 6, "discount_factor": 0.95, "exploration_rate": 0.1, "learning_rate": 0.01, "q_table_path": "models/marl_q_tables.pkl", "marl_candidate_max_dist_sq": 0.15**2, "marl_priority_w_soc": 0.5, "marl_priority_w_dist": 0.4, "marl_priority_w_urgency": 0.1,
+                            "inference_mode": "learning", "checkpoint_every_steps": 0, "q_bias": None,
+                            "replay": {"enabled": False, "capacity": 200000, "prioritized": False, "alpha": 0.6, "beta": 0.4, "batch_size": 256, "warmup": 1000, "updates_per_step": 1}},
+             "mas_parallel_mode": "off",
+             "mas_conflict_resolution": "voting",
              "use_trained_model": False,
-             "use_multi_agent": True
+             "use_multi_agent": True,
+             "anytime": {"latency_budget_ms": 0, "initial_batch": 32, "candidate_soc": 60, "max_deferrals": 2, "fallback_soc": 15, "fallback_max_queue": 3},
+             "pipeline": {"enabled": False, "decision_lag_steps": 1}
         },
          "algorithms": {
              "rule_based": {
@@ -107,6 +156,16 @@ def load_config():
                  "soc_threshold": 50,
                  "max_queue": 4,
                  "score_weights": {"distance": 0.7, "queue_penalty_km": 5.0}
+             },
+             "rollout": {
+                 "horizon_steps": 8,
+                 "time_budget_ms": 200,
+                 "strategy_variants": True,
+                 "include_batch_plan": True,
+                 "include_uncoordinated_plan": True,
+                 "include_urgent_only_plan": True,
+                 "urgent_soc": 20,
+                 "workers": 0
              }
         },
         "strategies": {
@@ -115,7 +174,8 @@ def load_config():
             "profit": {"user_satisfaction": 0.2, "operator_profit": 0.6, "grid_friendliness": 0.2},
             "user": {"user_satisfaction": 0.6, "operator_profit": 0.2, "grid_friendliness": 0.2}
         },
-        "visualization": {"output_dir": "output"}
+        "visualization": {"output_dir": "output", "results_cache_ttl_seconds": 5.0, "results_refresh_interval_seconds": 10.0, "results_cache_max_mb": 64},
+        "logging": {"hot_path_samples_per_window": 5, "hot_path_window_seconds": 10}
     }
     config_path = 'config.json'
     loaded_config = {}
@@ -151,6 +211,12 @@ def initialize_system():
     logger.debug("INITIALIZE_SYSTEM: Entered function.")
     previous_states = {}
     logger.info("Attempting to initialize system...")
+    # 释放旧系统持有的资源: 共享内存块 (与新环境同名)、影子/分片进程、算法的进程池
+    if system and getattr(system, 'env', None):
+        for close_method in ('close_shared_state', 'close_shadow', 'close'):
+            if hasattr(system.env, close_method): getattr(system.env, close_method)()
+    if system and getattr(system, 'scheduler', None) and hasattr(system.scheduler, 'close'):
+        system.scheduler.close()
     try:
         config = load_config() # 加载最新配置
 
@@ -170,8 +236,19 @@ def initialize_system():
         system_obj.config = config
 
         # 初始化 Environment 和 Scheduler
-        logger.info("Initializing ChargingEnvironment...")
-        system_obj.env = ChargingEnvironment(config)
+        shard_count = config.get("environment", {}).get("shard_count", 1)
+        if shard_count > 1:
+            # 多区域分片: 每个区域的用户、充电桩和调度在独立进程中推进
+            logger.info(f"Initializing ShardedEnvironment with {shard_count} regional shards...")
+            from simulation.sharding import ShardedEnvironment
+            system_obj.env = ShardedEnvironment(config)
+        else:
+            logger.info("Initializing ChargingEnvironment...")
+            system_obj.env = ChargingEnvironment(config)
+            shared_state_name = config.get("environment", {}).get("shared_state_name")
+            if shared_state_name:
+                # 每步把列式状态发布到共享内存, 供 UI/分析/调度进程零拷贝读取
+                system_obj.env.enable_shared_state(shared_state_name)
         logger.info("ChargingEnvironment initialized.")
 
         logger.info(f"Initializing ChargingScheduler with algorithm: {config['scheduler'].get('scheduling_algorithm', 'rule_based')}")
@@ -220,12 +297,32 @@ def initialize_system_with_config(config_to_use):
          globals()['load_config'] = original_load_config
      return system
 
+# --- 检查点辅助函数 ---
+def get_checkpoint_dir(config):
+    return config.get("environment", {}).get("checkpoint_dir", "output/checkpoints")
+
+def save_run_checkpoint(path, step, total_steps, days, strategy, algorithm, metrics_history):
+    """保存环境检查点及本次运行的进度 (步数、参数、指标历史)，失败只记录错误不影响仿真"""
+    try:
+        extra = {"step": step, "total_steps": total_steps, "days": days, "strategy": strategy, "algorithm": algorithm}
+        system.env.save_checkpoint(path, extra=extra, run_data={"metrics_history": metrics_history})
+        return True
+    except Exception as e:
+        logger.error(f"Error saving simulation checkpoint to {path}: {e}", exc_info=True)
+        return False
+
 # --- 仿真运行函数 ---
-def run_simulation(days, strategy="balanced", algorithm="rule_based"):
-    """Main simulation loop thread function."""
-    global current_state, simulation_running, system, previous_states, simulation_step_delay_ms
-    logger.info(f"RUN_SIMULATION_THREAD: Entered. Days={days}, Strategy={strategy}, Algorithm={algorithm}")
+def run_simulation(days, strategy="balanced", algorithm="rule_based", resume_from=None, checkpoint_every=None):
+    """
+    Main simulation loop thread function.
+
+    resume_from: 检查点文件路径，从其中保存的仿真状态和步数继续运行
+    checkpoint_every: 每隔多少步保存一次检查点 (默认取 environment.checkpoint_every_steps，0 表示不保存)
+    """
+    global current_state, simulation_running, system, previous_states, simulation_step_delay_ms, checkpoint_requested
+    logger.info(f"RUN_SIMULATION_THREAD: Entered. Days={days}, Strategy={strategy}, Algorithm={algorithm}, ResumeFrom={resume_from}")
     previous_states = {}
+    pipeline = None # 流水线模式下在独立进程中运行的调度器
     logger.info(f"Starting simulation thread: days={days}, strategy={strategy}, algorithm={algorithm}")
 
     try:
@@ -264,25 +361,56 @@ def run_simulation(days, strategy="balanced", algorithm="rule_based"):
         logger.info(f"Resetting environment for {total_steps} steps.")
         state = system.env.reset() # Initial state
         logger.info(f"RUN_SIMULATION_THREAD: Initial grid_status from env.reset(): {state.get('grid_status')}")
+        if resume_from:
+            # 从检查点恢复仿真状态和运行进度 (可用于断点续跑，或在预热状态上换算法实验)
+            header, run_data = system.env.restore_checkpoint(resume_from)
+            current_step = header.get("extra", {}).get("step", 0)
+            metrics_history = (run_data or {}).get("metrics_history", [])
+            state = system.env.get_current_state()
+            logger.info(f"Resumed from checkpoint {resume_from} at step {current_step}/{total_steps}.")
         previous_states['global_for_reward'] = state # Store initial state
 
+        if checkpoint_every is None:
+            checkpoint_every = system.config.get("environment", {}).get("checkpoint_every_steps", 0)
+        checkpoint_path = os.path.join(get_checkpoint_dir(system.config), f"checkpoint_{algorithm}_{strategy}.ckpt")
+        checkpoint_requested = False
+
+        # 流水线调度: 调度进程对第 t 步状态决策的同时主进程推进环境, 决策滞后 decision_lag_steps 步应用
+        pipeline_config = system.config["scheduler"].get("pipeline", {})
+        if pipeline_config.get("enabled", False) and not getattr(system.env, "schedules_in_shards", False):
+            from simulation.pipeline import PipelinedScheduler
+            pipeline = PipelinedScheduler(system.config, pipeline_config.get("decision_lag_steps", 1))
+            if system.scheduler.algorithm == "marl":
+                logger.warning("Pipelined scheduling runs MARL in inference mode; Q-table learning is skipped for this run.")
+
         while current_step < total_steps and simulation_running:
             logger.debug(f"RUN_SIMULATION_THREAD: ----- Loop Start: Step {current_step}/{total_steps}. simulation_running is {simulation_running} -----")
             current_time_step_start = time.time()
 
             # --- Decision Making ---
-            state_for_decision = system.env.get_current_state()
-            previous_states['global_for_reward'] = state_for_decision # Store state before decision
-
-            decisions = system.scheduler.make_scheduling_decision(state_for_decision)
+            if getattr(system.env, "schedules_in_shards", False):
+                # 分片仿真: 各分片用自己的调度器决策, 这里不需要收集完整状态
+                decisions = None
+            elif pipeline:
+                state_for_decision = system.env.get_current_state()
+                previous_states['global_for_reward'] = state_for_decision
+                decisions = pipeline.next_decisions(state_for_decision)
+                decision_stats = pipeline.last_decision_stats
+            else:
+                state_for_decision = system.env.get_current_state()
+                previous_states['global_for_reward'] = state_for_decision # Store state before decision
+                decisions = system.scheduler.make_scheduling_decision(state_for_decision)
+                decision_stats = system.scheduler.last_decision_stats
             # ---> If MARL, store the raw actions if needed for learning <---
             # raw_marl_actions = system.scheduler.marl_system.last_raw_actions if system.scheduler.algorithm == "marl" else None
 
             # --- Environment Step ---
             rewards, next_state, done = system.env.step(decisions)
+            if getattr(system.env, "schedules_in_shards", False):
+                decision_stats = system.env.last_decision_stats # 分片在本步 step 中完成的调度
 
             # --- MARL Learning Step ---
-            if system.scheduler.algorithm == "marl":
+            if system.scheduler.algorithm == "marl" and decisions is not None and not pipeline:
                  # TODO: Adjust the format of 'actions' passed to learn if needed
                  # It currently receives 'decisions' ({user_id: charger_id})
                  # It might need the raw {charger_id: action_index} (raw_marl_actions)
@@ -296,7 +424,8 @@ def run_simulation(days, strategy="balanced", algorithm="rule_based"):
                 "grid_load": current_grid_status.get("grid_load_percentage", 0),
                 "ev_load": current_grid_status.get("current_ev_load", 0),
                 "total_load": current_grid_status.get("current_total_load", 0),
-                "renewable_ratio": current_grid_status.get("renewable_ratio", 0)
+                "renewable_ratio": current_grid_status.get("renewable_ratio", 0),
+                "scheduler": decision_stats # 调度耗时、顺延和兜底数量
             })
 
             # --- Update Global State for UI ---
@@ -306,12 +435,21 @@ def run_simulation(days, strategy="balanced", algorithm="rule_based"):
                 "timestamp": next_state.get("timestamp"),
                 "progress": current_progress,
                 "metrics": rewards,
+                "scheduler": decision_stats,
                 "chargers": next_state.get("chargers", []),
                 "users": next_state.get("users", []),
                 "grid_status": next_state.get("grid_status", {})
             }
             logger.debug(f"RUN_SIMULATION_THREAD: Global current_state.grid_status updated to: {current_state.get('grid_status')}")
 
+            # --- Checkpoint ---
+            if checkpoint_every and current_step % checkpoint_every == 0:
+                save_run_checkpoint(checkpoint_path, current_step, total_steps, days, strategy, algorithm, metrics_history)
+            if checkpoint_requested: # 通过 API 请求的手动检查点，单独保存一份带时间戳的文件
+                checkpoint_requested = False
+                manual_path = os.path.join(get_checkpoint_dir(system.config), f"checkpoint_{algorithm}_{strategy}_{datetime.now().strftime('%Y%m%d_%H%M%S')}.ckpt")
+                save_run_checkpoint(manual_path, current_step, total_steps, days, strategy, algorithm, metrics_history)
+
             # --- Simulation Speed Control ---
             step_duration_actual = time.time() - current_time_step_start
             delay_needed = (simulation_step_delay_ms / 1000.0) - step_duration_actual
@@ -350,14 +488,23 @@ def run_simulation(days, strategy="balanced", algorithm="rule_based"):
                 if not metrics_history: data_to_save.pop('metrics_history', None)
 
                 with open(result_path, 'w', encoding='utf-8') as f:
-                    json.dump(data_to_save, f, indent=4, default=lambda x: int(x) if isinstance(x, np.integer) else float(x) if isinstance(x, np.floating) else str(x))
+                    json.dump(data_to_save, f, indent=4, default=_json_default)
                 logger.info(f"Simulation results saved to {result_path}")
+                if result_index is not None: result_index.refresh(force=True) # 新结果立即出现在列表中
             except Exception as e:
                 logger.error(f"Error saving simulation results: {e}", exc_info=True)
 
     except Exception as e:
         logger.error(f"Simulation run failed critically: {e}", exc_info=True)
     finally:
+        if pipeline:
+            pipeline.close() # 结束调度进程
+        if system and getattr(system, 'scheduler', None) and hasattr(system.scheduler, 'close'):
+            system.scheduler.close() # 关闭算法的线程池/进程池
+        if system and getattr(system, 'env', None) and hasattr(system.env, 'close_shadow'):
+            system.env.close_shadow() # 结束影子无序仿真进程
+        if system and getattr(system, 'env', None) and hasattr(system.env, 'close'):
+            system.env.close() # 结束分片进程
         simulation_running = False # Ensure running flag is reset
         logger.info(f"RUN_SIMULATION_THREAD: simulation_running flag is now False. Thread terminated.")
         logger.info("Simulation thread terminated.")
@@ -424,13 +571,19 @@ def start_simulation():
     days = data.get('days', 7)
     strategy = data.get('strategy', 'balanced')
     algorithm = data.get('algorithm', 'rule_based')
-    valid_algorithms = ["rule_based", "coordinated_mas", "marl", "uncoordinated"]
+    valid_algorithms = ["rule_based", "coordinated_mas", "marl", "uncoordinated", "rollout"]
     if algorithm not in valid_algorithms:
         algorithm = "rule_based"
+    resume_from = None
+    if data.get('resume_from'):
+        # 只允许恢复检查点目录中的文件
+        resume_from = os.path.join(get_checkpoint_dir(load_config()), os.path.basename(data['resume_from']))
+        if not os.path.exists(resume_from):
+            return jsonify({"status": "error", "message": f"Checkpoint not found: {os.path.basename(resume_from)}"}), 404
 
-    logger.info(f"API_START_SIM: Attempting to start simulation thread with days={days}, strategy={strategy}, algorithm={algorithm}")
+    logger.info(f"API_START_SIM: Attempting to start simulation thread with days={days}, strategy={strategy}, algorithm={algorithm}, resume_from={resume_from}")
 
-    simulation_thread = threading.Thread(target=run_simulation, args=(days, strategy, algorithm))
+    simulation_thread = threading.Thread(target=run_simulation, args=(days, strategy, algorithm, resume_from))
     simulation_thread.daemon = True
     simulation_thread.start()
     logger.info(f"API_START_SIM: Simulation thread object created and start() called.")
@@ -454,23 +607,119 @@ def stop_simulation():
     simulation_running = False # Signal the thread to stop
     return jsonify({"status": "success", "message": "Simulation stop signal sent"})
 
+@app.route('/api/simulation/checkpoint', methods=['POST'])
+def create_checkpoint():
+    """运行中: 请求仿真线程在当前步结束后保存检查点; 未运行: 立即保存当前环境状态"""
+    global checkpoint_requested
+    if simulation_running:
+        checkpoint_requested = True
+        return jsonify({"status": "success", "message": "Checkpoint will be saved after the current step"})
+    if not system or not getattr(system, 'env', None) or not hasattr(system.env, 'save_checkpoint'):
+        return jsonify({"status": "error", "message": "Simulation environment not initialized"}), 400
+    path = os.path.join(get_checkpoint_dir(system.config), f"checkpoint_manual_{datetime.now().strftime('%Y%m%d_%H%M%S')}.ckpt")
+    try:
+        header = system.env.save_checkpoint(path)
+    except Exception as e:
+        logger.error(f"Error saving checkpoint: {e}", exc_info=True)
+        return jsonify({"status": "error", "message": str(e)}), 500
+    return jsonify({"status": "success", "file": os.path.basename(path), "header": header})
+
+@app.route('/api/simulation/checkpoints', methods=['GET'])
+def list_checkpoints():
+    """列出检查点目录中的检查点及其头信息 (不解压状态)"""
+    from simulation.checkpoint import read_checkpoint_header
+    checkpoint_dir = get_checkpoint_dir(load_config())
+    checkpoints = []
+    if os.path.isdir(checkpoint_dir):
+        for filename in sorted(os.listdir(checkpoint_dir)):
+            if not filename.endswith(".ckpt"): continue
+            try:
+                checkpoints.append({"file": filename, "header": read_checkpoint_header(os.path.join(checkpoint_dir, filename))})
+            except Exception as e:
+                logger.warning(f"Skipping unreadable checkpoint {filename}: {e}")
+    return jsonify({"checkpoints": checkpoints})
+
+@app.route('/api/simulation/shared_state', methods=['GET'])
+def get_shared_state_info():
+    """返回共享内存状态块的名字和当前发布序号, 供其他进程用 SharedStateReader 映射"""
+    publisher = getattr(getattr(system, 'env', None), '_shared_state', None)
+    if publisher is None:
+        return jsonify({"enabled": False})
+    return jsonify({"enabled": True, "name": publisher.name, "version": publisher.version,
+                    "user_capacity": publisher.user_capacity, "charger_capacity": publisher.charger_capacity})
+
 @app.route('/api/simulation/status', methods=['GET'])
 
 def get_simulation_status():
-    # (与上次提供版本一致)
+    # 每个仿真步只序列化一次, 多个仪表盘的轮询共用同一份响应体
     global current_state, simulation_running
-    state_to_send = { # Provide default structure
-         "timestamp": datetime.now().isoformat(), "progress": 0, "metrics": {},
-         "grid_status": {}, "chargers": [], "users": []
-    }
-    state_to_send.update(current_state) # Overwrite with actual data if available
-    # Ensure lists, not dicts for chargers/users
-    if isinstance(state_to_send.get("chargers"), dict): state_to_send["chargers"] = list(state_to_send["chargers"].values())
-    if isinstance(state_to_send.get("users"), dict): state_to_send["users"] = list(state_to_send["users"].values())
-    return jsonify({"running": simulation_running, "state": state_to_send})
+    state, running = current_state, simulation_running
+    with _status_cache_lock:
+        if _status_cache["state"] is not state or _status_cache["running"] != running:
+            state_to_send = { # Provide default structure
+                 "timestamp": datetime.now().isoformat(), "progress": 0, "metrics": {},
+                 "grid_status": {}, "chargers": [], "users": []
+            }
+            state_to_send.update(state) # Overwrite with actual data if available
+            # Ensure lists, not dicts for chargers/users
+            if isinstance(state_to_send.get("chargers"), dict): state_to_send["chargers"] = list(state_to_send["chargers"].values())
+            if isinstance(state_to_send.get("users"), dict): state_to_send["users"] = list(state_to_send["users"].values())
+            body = json.dumps({"running": running, "state": state_to_send}, default=_json_default).encode("utf-8")
+            _status_cache.update(state=state, running=running, body=body, etag="status-" + hashlib.sha1(body).hexdigest())
+        body, etag = _status_cache["body"], _status_cache["etag"]
+    return _etag_response(body, etag)
+
+def get_entity_index(kind):
+    """返回当前状态中 users/chargers 的查询索引 (每个仿真步建立一次)"""
+    from simulation.entity_query import EntityIndex
+    state = current_state
+    with _entity_index_lock:
+        if _entity_index_cache["state"] is not state:
+            _entity_index_cache.update(state=state, users=None, chargers=None)
+        if _entity_index_cache[kind] is None:
+            entities = state.get(kind, [])
+            if isinstance(entities, dict): entities = list(entities.values())
+            _entity_index_cache[kind] = EntityIndex(entities, kind)
+        return _entity_index_cache[kind]
+
+def query_entities(kind):
+    """按查询参数过滤/排序/分页实体; 参数错误返回 400"""
+    try:
+        page = get_entity_index(kind).query_args(request.args)
+    except ValueError as e:
+        return jsonify({"status": "error", "message": str(e)}), 400
+    body = json.dumps({"status": "success", "timestamp": current_state.get("timestamp"), kind: page["items"],
+                       "total": page["total"], "next_cursor": page["next_cursor"]}, default=_json_default).encode("utf-8")
+    return _etag_response(body, f"{kind}-" + hashlib.sha1(body).hexdigest())
+
+@app.route('/api/simulation/users', methods=['GET'])
+def query_users():
+    """
+    分页查询用户。参数: status, ids, fields (逗号分隔), bbox=lat_min,lng_min,lat_max,lng_max,
+    sort=id|soc, order=asc|desc, limit, cursor (上一页返回的 next_cursor)
+    """
+    return query_entities("users")
+
+@app.route('/api/simulation/chargers', methods=['GET'])
+def query_chargers():
+    """分页查询充电桩。参数同 /api/simulation/users, 另支持 region 过滤, sort=id|queue|revenue"""
+    return query_entities("chargers")
+
+@app.route('/api/simulation/results', methods=['GET'])
+def list_simulation_results():
+    """列出输出目录中的仿真结果 (最新的在前), 由内存索引应答"""
+    body, etag = get_result_index().listing()
+    return _etag_response(body, etag)
+
+@app.route('/api/simulation/result/<filename>', methods=['GET'])
+def get_simulation_result(filename):
+    """返回单个仿真结果文件; 只接受索引中的文件名"""
+    cached = get_result_index().result(filename)
+    if cached is None:
+        return jsonify({"status": "error", "message": f"Result '{filename}' not found"}), 404
+    return _etag_response(*cached)
 # --- 其他 /api/... 路由保持不变 ---
-# ... /api/chargers, /api/users, /api/grid, /output/, /api/simulation/results,
-# ... /api/simulation/result/<filename>, /api/user/recommendations,
+# ... /api/chargers, /api/users, /api/grid, /output/, /api/user/recommendations,
 # ... /api/operator/statistics, /api/grid/statistics, /api/simulation/speed,
 # ... /api/system_state, /api/debug/marl_test
 
@@ -525,8 +774,10 @@ if __name__ == '__main__':
     parser.add_argument('--cli', action='store_true', help='Run in CLI mode')
     parser.add_argument('--days', type=int, default=None, help='Simulation days (overrides config)')
     parser.add_argument('--strategy', type=str, default=None, choices=['balanced', 'user', 'grid', 'profit'], help='Optimization strategy')
-    parser.add_argument('--algorithm', type=str, default=None, choices=['rule_based', 'coordinated_mas', 'marl', 'uncoordinated'], help='Scheduling algorithm')
+    parser.add_argument('--algorithm', type=str, default=None, choices=['rule_based', 'coordinated_mas', 'marl', 'uncoordinated', 'rollout'], help='Scheduling algorithm')
     parser.add_argument('--output', type=str, help='Output file path for CLI results')
+    parser.add_argument('--resume', type=str, default=None, help='Resume the CLI simulation from an environment checkpoint file')
+    parser.add_argument('--checkpoint-every', type=int, default=None, help='Save an environment checkpoint every N steps (overrides config)')
     args = parser.parse_args()
 
     logger.info("Initializing system on startup...")
@@ -547,13 +798,13 @@ if __name__ == '__main__':
          if not system or not system.env or not system.scheduler or getattr(system.scheduler, 'algorithm', 'fallback') == 'fallback':
              logger.error("System initialization failed. Cannot run CLI simulation.")
          else:
-             run_simulation(sim_days, sim_strategy, sim_algorithm)
+             run_simulation(sim_days, sim_strategy, sim_algorithm, resume_from=args.resume, checkpoint_every=args.checkpoint_every)
              if args.output: # 保存结果
                  output_dir = os.path.dirname(args.output);
                  if output_dir: os.makedirs(output_dir, exist_ok=True)
                  try:
                      with open(args.output, 'w', encoding='utf-8') as f:
-                         json.dump(current_state, f, indent=4, default=lambda x: int(x) if isinstance(x, np.integer) else float(x) if isinstance(x, np.floating) else str(x))
+                         json.dump(current_state, f, indent=4, default=_json_default)
                      logger.info(f"Simulation results saved to {args.output}")
                  except Exception as e: logger.error(f"Error saving CLI results: {e}", exc_info=True)
              # 打印摘要
@@ -0,0 +1,165 @@
+# ev_charging_project/simulation/anytime.py
+# 带延迟预算的调度 (anytime): 候选用户按紧迫度排序后分批交给调度算法, 每批之后检查时间预算,
+# 预算用完时返回已得到的部分决策。未处理的候选用户顺延到下一步优先处理; 已顺延多次或电量过低
+# 的用户直接用"最近可用充电桩"快速兜底分配, 不再等待。
+#
+# 分批时, 前面批次已分配的用户会被临时计入对应充电桩的队列 (只复制受影响的充电桩字典),
+# 因此各算法按自己原有的负载/队列逻辑就能看到本步已作出的分配, 无需修改算法本身。
+
+import logging
+import time
+
+import numpy as np
+
+from .utils import entity_coords, distance_matrix
+
+logger = logging.getLogger(__name__)
+
+ANYTIME_DEFAULTS = {
+    "latency_budget_ms": 0, # 每步调度的时间预算, 0 表示不限时 (一次处理全部用户)
+    "initial_batch": 32, # 第一批候选用户数, 之后按实测的单用户耗时调整批大小
+    "candidate_soc": 60, # SOC 不高于该值 (或明确需要充电) 的用户视为候选
+    "max_deferrals": 2, # 顺延达到该步数的用户走快速兜底
+    "fallback_soc": 15, # 未处理且 SOC 低于该值的用户本步直接走快速兜底
+    "fallback_max_queue": 3, # 快速兜底时每个充电桩的最大负载 (占用 + 排队)
+}
+
+
+def anytime_settings(config):
+    """合并 config["scheduler"]["anytime"] 与默认值"""
+    return dict(ANYTIME_DEFAULTS, **config.get("scheduler", {}).get("anytime", {}))
+
+
+def order_candidates(users, candidate_soc, deferred_counts):
+    """
+    选出候选用户并按紧迫度排序: 已顺延的用户 (顺延次数多的在前) > 明确需要充电 > SOC 低。
+
+    Returns:
+        list: 排好序的用户字典
+    """
+    candidates = [u for u in users
+                  if isinstance(u, dict) and u.get("user_id") and u.get("status") not in ("charging", "waiting")
+                  and isinstance(u.get("soc"), (int, float))
+                  and (u.get("needs_charge_decision") or u["soc"] <= candidate_soc)]
+    candidates.sort(key=lambda u: (-deferred_counts.get(u["user_id"], 0), not u.get("needs_charge_decision"), u["soc"]))
+    return candidates
+
+
+def state_for_batch(state, batch_users, pending_by_charger, charger_positions):
+    """
+    构造只包含本批用户的状态; 本步已分配的用户临时追加到对应充电桩的队列中。
+
+    Args:
+        pending_by_charger (dict): charger_id -> 本步已分配的 user_id 列表
+        charger_positions (dict): charger_id -> state["chargers"] 中的下标
+    """
+    chargers = state.get("chargers", [])
+    if pending_by_charger:
+        chargers = list(chargers)
+        for charger_id, pending in pending_by_charger.items():
+            i = charger_positions.get(charger_id)
+            if i is None: continue
+            charger = dict(chargers[i])
+            charger["queue"] = list(charger.get("queue", [])) + pending
+            chargers[i] = charger
+    batch_state = dict(state, users=batch_users, chargers=chargers)
+    batch_state.pop("state_version", None) # 不是环境的真实状态, 不参与按状态版本的缓存
+    return batch_state
+
+
+def nearest_available_fallback(users, chargers, decisions, max_queue):
+    """
+    快速兜底: 依次把用户分配给最近的、负载未满的非故障充电桩 (包括本步已作出的分配)。
+
+    Returns:
+        dict: 兜底决策 {user_id: charger_id}
+    """
+    active = [c for c in chargers if isinstance(c, dict) and c.get("charger_id") and c.get("status") != "failure"]
+    if not users or not active:
+        return {}
+    loads = np.array([int(c.get("status") == "occupied") + len(c.get("queue", [])) for c in active])
+    column = {c["charger_id"]: j for j, c in enumerate(active)}
+    for charger_id in decisions.values():
+        if charger_id in column: loads[column[charger_id]] += 1
+
+    distances = distance_matrix(entity_coords(users, "current_position"), entity_coords(active, "position"), method="planar")
+    fallback = {}
+    for i, user in enumerate(users):
+        row = np.where(loads < max_queue, distances[i], np.inf)
+        j = int(np.argmin(row))
+        if not np.isfinite(row[j]):
+            continue
+        fallback[user["user_id"]] = active[j]["charger_id"]
+        loads[j] += 1
+    return fallback
+
+
+def run_anytime(decide, state, settings, deferred_counts):
+    """
+    在时间预算内分批调用 decide(batch_state), 合并各批决策并处理未完成的候选用户。
+
+    Args:
+        decide (callable): 对一个状态作出决策的函数 (即调度器的单次决策)
+        settings (dict): anytime_settings() 的返回值
+        deferred_counts (dict): user_id -> 已顺延步数; 原地更新为下一步的顺延记录
+
+    Returns:
+        tuple: (decisions, stats)
+    """
+    started = time.perf_counter()
+    deadline = started + settings["latency_budget_ms"] / 1000.0
+    candidates = order_candidates(state.get("users", []), settings["candidate_soc"], deferred_counts)
+    charger_positions = {c.get("charger_id"): i for i, c in enumerate(state.get("chargers", [])) if isinstance(c, dict)}
+
+    decisions = {}
+    pending_by_charger = {}
+    processed = 0
+    batch_size = max(1, int(settings["initial_batch"]))
+    while processed < len(candidates):
+        batch_started = time.perf_counter()
+        batch = candidates[processed:processed + batch_size]
+        batch_decisions = decide(state_for_batch(state, batch, pending_by_charger, charger_positions)) or {}
+        processed += len(batch)
+        for user_id, charger_id in batch_decisions.items():
+            if user_id in decisions: continue
+            decisions[user_id] = charger_id
+            pending_by_charger.setdefault(charger_id, []).append(user_id)
+
+        now = time.perf_counter()
+        if now >= deadline:
+            break
+        # 按本批的单用户耗时估计剩余预算还能处理多少用户 (留两成余量)
+        per_user = (now - batch_started) / len(batch)
+        batch_size = max(1, int((deadline - now) * 0.8 / per_user)) if per_user > 0 else len(candidates)
+
+    leftover = candidates[processed:]
+    fallback_users = []
+    next_deferred = {}
+    for user in leftover:
+        user_id = user["user_id"]
+        deferrals = deferred_counts.get(user_id, 0) + 1
+        if deferrals >= settings["max_deferrals"] or user["soc"] < settings["fallback_soc"]:
+            fallback_users.append(user)
+        else:
+            next_deferred[user_id] = deferrals
+    fallback = nearest_available_fallback(fallback_users, state.get("chargers", []), decisions, settings["fallback_max_queue"])
+    decisions.update(fallback)
+    # 兜底也没有分到充电桩的用户继续顺延
+    for user in fallback_users:
+        if user["user_id"] not in fallback:
+            next_deferred[user["user_id"]] = deferred_counts.get(user["user_id"], 0) + 1
+    deferred_counts.clear()
+    deferred_counts.update(next_deferred)
+
+    stats = {
+        "decision_time_ms": (time.perf_counter() - started) * 1000,
+        "candidates": len(candidates),
+        "processed_candidates": processed,
+        "deferred_candidates": len(next_deferred),
+        "fallback_assignments": len(fallback),
+        "budget_exhausted": bool(leftover),
+    }
+    if leftover:
+        logger.info("Scheduling budget of %s ms exhausted after %d/%d candidates: %d deferred, %d assigned by nearest-available fallback.",
+                    settings["latency_budget_ms"], processed, len(candidates), stats["deferred_candidates"], len(fallback))
+    return decisions, stats
@@ -3,8 +3,10 @@ import logging
 from datetime import datetime, timedelta
 import random
 import math # 需要 math
+from .hot_logging import get_hot_log
 
 logger = logging.getLogger(__name__)
+hot_log = get_hot_log(logger) # 逐充电桩事件: 计数 + 限速采样
 
 def simulate_step(chargers, users, current_time, time_step_minutes, grid_status):
     """
@@ -90,7 +92,7 @@ def simulate_step(chargers, users, current_time, time_step_minutes, grid_status)
                     # --- 结束充电逻辑 ---
                     if new_soc >= target_soc - 0.5 or charging_duration_minutes >= max_charging_time - 0.1:
                         reason = "target_reached" if new_soc >= target_soc - 0.5 else "time_limit_exceeded"
-                        logger.info(f"User {current_user_id} finished charging at {charger_id} ({reason}). Final SOC: {new_soc:.1f}%")
+                        hot_log.event("charging_finished", logging.INFO, "User %s finished charging at %s (%s). Final SOC: %.1f%%", current_user_id, charger_id, reason, new_soc)
 
                         session_energy = charger.get("daily_energy", 0) - charger.get("_prev_energy", 0)
                         session_revenue = charger.get("daily_revenue", 0) - charger.get("_prev_revenue", 0)
@@ -123,7 +125,7 @@ def simulate_step(chargers, users, current_time, time_step_minutes, grid_status)
 
                 else: # 充电量过小，也算完成
                      if current_soc >= target_soc - 1.0:
-                         logger.debug(f"User {current_user_id} charging considered complete at {charger_id}. SOC: {current_soc:.1f}%")
+                         hot_log.event("charging_complete_small", logging.DEBUG, "User %s charging considered complete at %s. SOC: %.1f%%", current_user_id, charger_id, current_soc)
                          charging_start_time = charger.get("charging_start_time", current_time - timedelta(minutes=time_step_minutes))
                          charging_duration_minutes = (current_time - charging_start_time).total_seconds() / 60
                          session_energy = charger.get("daily_energy", 0) - charger.get("_prev_energy", 0)
@@ -143,7 +145,7 @@ def simulate_step(chargers, users, current_time, time_step_minutes, grid_status)
                          user["initial_soc"] = None; user["target_soc"] = None
 
             else: # 用户不存在
-                logger.warning(f"Charger {charger_id} occupied by non-existent user {current_user_id}. Setting available.")
+                hot_log.event("occupied_by_missing_user", logging.WARNING, "Charger %s occupied by non-existent user %s. Setting available.", charger_id, current_user_id)
                 charger["status"] = "available"; charger["current_user"] = None
                 charger["charging_start_time"] = None
 
@@ -157,7 +159,7 @@ def simulate_step(chargers, users, current_time, time_step_minutes, grid_status)
                 next_user = users[next_user_id]
                 # 关键检查：确认用户的状态是 'waiting'
                 if next_user.get("status") == "waiting":
-                    logger.info(f"Starting charging for user {next_user_id} from queue at {charger_id}")
+                    hot_log.event("charging_started", logging.INFO, "Starting charging for user %s from queue at %s", next_user_id, charger_id)
 
                     # 更新充电桩状态
                     charger["status"] = "occupied"
@@ -174,14 +176,14 @@ def simulate_step(chargers, users, current_time, time_step_minutes, grid_status)
 
                     # 从队列中移除已开始充电的用户
                     queue.pop(0)
-                    logger.debug(f"User {next_user_id} removed from queue {charger_id}.")
+                    hot_log.event("dequeued", logging.DEBUG, "User %s removed from queue %s.", next_user_id, charger_id)
 
                 else:
                     # 用户状态不是 'waiting'，暂时不处理，让他留在队首，下一轮再检查
-                    logger.warning(f"User {next_user_id} at head of queue for {charger_id} has status '{next_user.get('status')}' (expected 'waiting'). Skipping charging start this step.")
+                    hot_log.event("queue_head_not_waiting", logging.WARNING, "User %s at head of queue for %s has status '%s' (expected 'waiting'). Skipping charging start this step.", next_user_id, charger_id, next_user.get('status'))
             else:
                 # 队列中的用户 ID 在 users 字典中找不到，说明用户可能已离开或数据错误
-                logger.warning(f"User {next_user_id} in queue for {charger_id} not found in users dict. Removing from queue.")
+                hot_log.event("queue_user_missing", logging.WARNING, "User %s in queue for %s not found in users dict. Removing from queue.", next_user_id, charger_id)
                 queue.pop(0) # 从队列移除无效用户
 
             # 注意：因为我们直接修改了 charger['queue'] 列表，所以不需要 charger['queue'] = queue 这行了。
@@ -0,0 +1,202 @@
+# ev_charging_project/simulation/entity_query.py
+# 用户/充电桩的查询索引: 每个仿真步从状态中的实体列表建立一次列式索引 (状态、区域、坐标、排序字段的
+# NumPy 数组和 id -> 下标字典), 之后的查询 (按状态/区域/矩形范围/id 过滤、字段投影、按 SOC/队列/收入排序、
+# 游标分页) 都在数组上完成, 只为当前页的实体构造响应字典。
+#
+# 每种 (排序字段, 方向) 的排列在索引上只计算一次。游标为 (排序字段, 方向, 上一页最后一条的排序值, 其 id)
+# 的 base64 编码, 在排列中二分定位下一页, 因此步与步之间实体属性变化时不会像偏移量分页那样重复或跳过整段实体。
+
+import base64
+import json
+
+import numpy as np
+
+from .utils import entity_coords
+
+DEFAULT_PAGE_SIZE = 100
+MAX_PAGE_SIZE = 1000
+
+# 每类实体的 id 字段、位置字段、是否有 region 字段和可排序字段 (排序字段 -> 取值函数)
+ENTITY_KINDS = {
+    "users": {
+        "id": "user_id",
+        "position": "current_position",
+        "region": False,
+        "sort_fields": {"soc": lambda e: e.get("soc")},
+    },
+    "chargers": {
+        "id": "charger_id",
+        "position": "position",
+        "region": True,
+        "sort_fields": {
+            "queue": lambda e: len(e.get("queue") or []),
+            "revenue": lambda e: e.get("daily_revenue"),
+        },
+    },
+}
+
+
+def _numeric(value):
+    return float(value) if isinstance(value, (int, float)) and not isinstance(value, bool) else np.nan
+
+
+def encode_cursor(sort, order, key, entity_id):
+    payload = json.dumps([sort, order, key, entity_id]).encode("utf-8")
+    return base64.urlsafe_b64encode(payload).decode("ascii")
+
+
+def decode_cursor(cursor):
+    try:
+        sort, order, key, entity_id = json.loads(base64.urlsafe_b64decode(cursor.encode("ascii")))
+        return sort, order, float(key), str(entity_id)
+    except (ValueError, TypeError):
+        raise ValueError("Invalid cursor.")
+
+
+def _split(value):
+    return [v.strip() for v in value.split(",") if v.strip()] if value else []
+
+
+class EntityIndex:
+    """
+    一组实体 (state["users"] 或 state["chargers"]) 的列式查询索引。
+
+    实体字典本身不被复制; 索引只在建立时读取一次所有实体, 适合每步建立一次、被多次查询的场景。
+    """
+
+    def __init__(self, entities, kind):
+        if kind not in ENTITY_KINDS:
+            raise ValueError(f"Unknown entity kind '{kind}'. Expected one of {tuple(ENTITY_KINDS)}.")
+        spec = ENTITY_KINDS[kind]
+        self.kind = kind
+        self.id_field = spec["id"]
+        self.has_region = spec["region"]
+        self.entities = [e for e in entities if isinstance(e, dict) and e.get(spec["id"]) is not None]
+        self.ids = np.array([str(e[self.id_field]) for e in self.entities], dtype=str)
+        self.positions = {entity_id: i for i, entity_id in enumerate(self.ids.tolist())}
+        self.status = np.array([str(e.get("status")) for e in self.entities], dtype=str)
+        self.region = np.array([str(e.get("region")) for e in self.entities], dtype=str)
+        self.coords = entity_coords(self.entities, spec["position"])
+        self.sort_columns = {name: np.array([_numeric(getter(e)) for e in self.entities], dtype=np.float64)
+                             for name, getter in spec["sort_fields"].items()}
+        self._orders = {} # (sort, order) -> (排列, 排列后的排序键, 排列后的 id)
+
+    def __len__(self):
+        return len(self.entities)
+
+    def _sorted(self, sort, order):
+        """
+        按 (排序键, id) 排好的排列。排序键降序时取负值; 缺失值 (NaN) 置为 +inf, 总排在最后。
+        按 id 排序时排序键全为 0, 降序时整个排列反转 (id 降序)。
+        注意: id 排序时顺序为字符串顺序 (user_10 在 user_2 之前)。
+        """
+        cached = self._orders.get((sort, order))
+        if cached is None:
+            if sort == "id":
+                key = np.zeros(len(self.entities))
+                perm = np.argsort(self.ids, kind="stable")
+                if order == "desc":
+                    perm = perm[::-1]
+                cached = self._orders[(sort, order)] = (perm, key, self.ids[perm])
+                return cached
+            elif sort in self.sort_columns:
+                key = self.sort_columns[sort] if order == "asc" else -self.sort_columns[sort]
+                key = np.where(np.isnan(key), np.inf, key)
+            else:
+                raise ValueError(f"Cannot sort {self.kind} by '{sort}'. Expected one of {('id',) + tuple(self.sort_columns)}.")
+            perm = np.lexsort((self.ids, key))
+            cached = self._orders[(sort, order)] = (perm, key[perm], self.ids[perm])
+        return cached
+
+    def query(self, status=None, region=None, bbox=None, ids=None, fields=None, sort="id", order="asc",
+              limit=DEFAULT_PAGE_SIZE, cursor=None):
+        """
+        过滤、排序并返回一页实体。
+
+        Args:
+            status (list): 允许的状态, 为空表示不过滤
+            region (list): 允许的区域 (充电桩的 region 字段; 用户没有区域, 指定时抛出 ValueError)
+            bbox (tuple): (lat_min, lng_min, lat_max, lng_max) 矩形范围
+            ids (list): 只返回这些 id 的实体 (通过 id 索引直接定位)
+            fields (list): 返回的字段, 为空表示完整实体; id 字段总是返回
+            sort (str): "id" 或 ENTITY_KINDS 中的排序字段; 排序值相同时按 id 升序 (sort 为 "id" 时按 order)
+            order (str): "asc" 或 "desc"
+            limit (int): 每页数量 (1 ~ MAX_PAGE_SIZE)
+            cursor (str): 上一页返回的 next_cursor
+
+        Returns:
+            dict: {"items": [...], "total": 过滤后的总数, "next_cursor": 下一页游标或 None}
+        """
+        if order not in ("asc", "desc"):
+            raise ValueError("order must be 'asc' or 'desc'.")
+        if not 1 <= limit <= MAX_PAGE_SIZE:
+            raise ValueError(f"limit must be between 1 and {MAX_PAGE_SIZE}.")
+        if region and not self.has_region:
+            raise ValueError(f"{self.kind} cannot be filtered by region.")
+        perm, sorted_key, sorted_ids = self._sorted(sort, order)
+
+        if ids:
+            mask = np.zeros(len(self.entities), dtype=bool)
+            mask[[self.positions[i] for i in ids if i in self.positions]] = True
+        else:
+            mask = np.ones(len(self.entities), dtype=bool)
+        if status:
+            mask &= np.isin(self.status, status)
+        if region:
+            mask &= np.isin(self.region, region)
+        if bbox:
+            lat_min, lng_min, lat_max, lng_max = bbox
+            lat, lng = self.coords[:, 0], self.coords[:, 1]
+            mask &= (lat >= lat_min) & (lat <= lat_max) & (lng >= lng_min) & (lng <= lng_max)
+        sorted_mask = mask[perm]
+        total = int(sorted_mask.sum())
+
+        start = 0
+        if cursor:
+            cursor_sort, cursor_order, last_key, last_id = decode_cursor(cursor)
+            if (cursor_sort, cursor_order) != (sort, order):
+                raise ValueError("Cursor does not match the requested sort order.")
+            if sort == "id" and order == "desc":
+                # id 降序: 下一页从第一个 id 小于游标 id 的位置开始
+                start = len(sorted_ids) - int(np.searchsorted(sorted_ids[::-1], last_id, "left"))
+            else:
+                # 排序值相同的实体在排列中连续且按 id 升序, 二分找到游标之后的第一个位置
+                lo, hi = np.searchsorted(sorted_key, last_key, "left"), np.searchsorted(sorted_key, last_key, "right")
+                start = lo + int(np.searchsorted(sorted_ids[lo:hi], last_id, "right"))
+
+        matches = start + np.flatnonzero(sorted_mask[start:])
+        page = perm[matches[:limit]]
+        next_cursor = None
+        if len(matches) > limit:
+            last = matches[limit - 1]
+            next_cursor = encode_cursor(sort, order, float(sorted_key[last]), str(sorted_ids[last]))
+
+        if fields:
+            fields = [self.id_field] + [f for f in fields if f != self.id_field]
+            items = [{f: self.entities[i].get(f) for f in fields} for i in page]
+        else:
+            items = [self.entities[i] for i in page]
+        return {"items": items, "total": total, "next_cursor": next_cursor}
+
+    def query_args(self, args):
+        """
+        用 HTTP 查询参数执行 query (args 为支持 .get 的映射, 如 Flask 的 request.args)。
+        参数: status, region, ids, fields (逗号分隔), bbox=lat_min,lng_min,lat_max,lng_max,
+        sort, order, limit, cursor。参数格式错误时抛出 ValueError。
+        """
+        bbox = _split(args.get("bbox"))
+        if bbox:
+            try:
+                bbox = tuple(float(v) for v in bbox)
+            except ValueError:
+                raise ValueError("bbox must be four numbers: lat_min,lng_min,lat_max,lng_max.")
+            if len(bbox) != 4:
+                raise ValueError("bbox must be four numbers: lat_min,lng_min,lat_max,lng_max.")
+        try:
+            limit = int(args.get("limit", DEFAULT_PAGE_SIZE))
+        except ValueError:
+            raise ValueError("limit must be an integer.")
+        return self.query(status=_split(args.get("status")), region=_split(args.get("region")), bbox=bbox or None,
+                          ids=_split(args.get("ids")), fields=_split(args.get("fields")),
+                          sort=args.get("sort", "id"), order=args.get("order", "asc"),
+                          limit=limit, cursor=args.get("cursor"))
@@ -5,6 +5,12 @@ from datetime import datetime, timedelta
 import random
 import math
 import time  # <--- 确认导入 time 模块
+import json
+import hashlib
+import pickle
+import itertools
+from collections import OrderedDict
+from contextlib import contextmanager
 
 # 使用相对导入，确保这些文件在同一目录下或正确配置了PYTHONPATH
 try:
@@ -13,20 +19,43 @@ try:
     from .charger_model import simulate_step as simulate_chargers_step
     from .metrics import calculate_rewards
     from .utils import get_random_location, calculate_distance
+    from .hot_logging import get_hot_log, configure_hot_logging, flush_hot_logs
 except ImportError as e:
     logging.error(f"Error importing simulation submodules in environment.py: {e}", exc_info=True)
     # 在启动时如果无法导入核心模块，抛出错误可能更好
     raise ImportError(f"Could not import required simulation submodules: {e}")
 
 logger = logging.getLogger(__name__)
+hot_log = get_hot_log(logger)
+
+# 状态版本号: 所有环境共用一个计数器, 用户/充电桩/电网/时间每次变化 (step、reset、恢复快照) 都取一个新值,
+# 写入 get_current_state 的 "state_version", 供按状态缓存的计算 (如 MARL 的智能体状态编码) 判断状态是否变化。
+# 同一版本下 get_current_state 返回同一组用户/充电桩列表, 调用方不应原地修改它们 (派生状态需去掉 state_version)
+_STATE_VERSIONS = itertools.count(1)
+
+# 初始种群缓存: (环境配置哈希, 随机种子) -> pickle 后的 (users, chargers, 初始化后的随机数状态)
+# 只在配置了 random_seed 时使用，此时相同的键必然生成相同的种群
+POPULATION_CACHE_SIZE = 8
+_population_cache = OrderedDict()
+
+def _population_cache_key(env_config, seed):
+    """由影响种群初始化的环境配置和随机种子生成缓存键"""
+    config_blob = json.dumps(env_config, sort_keys=True, default=str).encode("utf-8")
+    return (hashlib.sha1(config_blob).hexdigest(), seed)
+
+def clear_population_cache():
+    """清空初始种群缓存"""
+    _population_cache.clear()
 
 class ChargingEnvironment:
-    def __init__(self, config):
+    def __init__(self, config, snapshot=None, isolated_random=False):
         """
         初始化充电环境。
 
         Args:
             config (dict): 包含所有配置项的字典。
+            snapshot (dict): 可选, get_snapshot() 的结果; 提供时从该状态开始而不是 reset() 生成新种群
+            isolated_random (bool): 使用快照中的随机数状态作为本环境私有的随机数流 (见 fork())
         """
         self.config = config
         # 分别获取环境和电网的配置部分，提供默认空字典防止 KeyErrors
@@ -34,6 +63,7 @@ class ChargingEnvironment:
         self.grid_config = config.get('grid', {}) # GridModel 会用到
 
         logger.info("Initializing ChargingEnvironment...")
+        configure_hot_logging(config)
 
         # 基本参数 - 从 env_config 获取，带默认值
         self.station_count = self.env_config.get("station_count", 20)
@@ -51,6 +81,12 @@ class ChargingEnvironment:
         self.map_bounds.setdefault("lng_max", 114.5)
         self.region_count = self.env_config.get("region_count", 5)
         self.enable_uncoordinated_baseline = self.env_config.get("enable_uncoordinated_baseline", True)
+        # 无序基准的计算方式: "estimate" 按公式估算; "shadow" 在后台进程中运行真实的无序仿真
+        self.baseline_mode = self.env_config.get("uncoordinated_baseline_mode", "estimate")
+        self._shadow = None
+        self._own_random_state = None # 私有随机数流 (分叉出的子环境使用), None 表示使用全局 random
+        self._own_random_active = False
+        self._shared_state = None # 共享内存列式状态的发布者 (enable_shared_state() 后启用)
 
 
         # 状态变量
@@ -60,12 +96,17 @@ class ChargingEnvironment:
         self.chargers = {}
         self.history = []
         self.completed_charging_sessions = [] # 存储完成的充电会话日志
+        self._state_version = next(_STATE_VERSIONS)
+        self._state_lists = None # (版本, 用户列表, 充电桩列表), 见 get_current_state
 
         # 初始化子模型 - GridModel 需要完整的 config
         self.grid_simulator = GridModel(config)
 
         logger.info(f"Config loaded: Users={self.user_count}, Stations={self.station_count}, Chargers/Station={self.chargers_per_station}")
-        self.reset() # 调用 reset 来完成初始化
+        if snapshot is None:
+            self.reset() # 调用 reset 来完成初始化
+        else:
+            self.restore_snapshot(snapshot, isolated_random=isolated_random)
 
     def reset(self):
         """重置环境到初始状态"""
@@ -82,15 +123,49 @@ class ChargingEnvironment:
         self.current_time = base_start_time
         self.start_time = base_start_time # <--- 记录仿真的实际开始时间
 
-        self.users = self._initialize_users()
-        self.chargers = self._initialize_chargers()
+        # 旧的影子仿真基于旧种群，需要在下一步时重新启动
+        self.close_shadow()
+        self._own_random_state = None # 重置后回到全局随机数流
+
+        # 配置了 random_seed 时固定随机种子，保证种群和后续仿真可复现 (影子仿真也使用同一种子)
+        seed = self.env_config.get("random_seed")
+        if seed is not None:
+            random.seed(seed)
+
+        if seed is not None and self.env_config.get("population_cache", True):
+            self._initialize_population_cached(seed)
+        else:
+            self.users = self._initialize_users()
+            self.chargers = self._initialize_chargers()
+        # 初始化完成后的随机数状态，影子仿真从这里继续，使其与直接运行无序调度的结果一致
+        self._reset_random_state = random.getstate()
+        self.mark_state_changed()
         self.grid_simulator.reset() # 重置电网状态
         self.history = []
         self.completed_charging_sessions = []
+        self.publish_shared_state()
         logger.info(f"Environment reset complete. Simulation starts at: {self.start_time}")
         # 返回初始状态
         return self.get_current_state()
 
+    def _initialize_population_cached(self, seed):
+        """从缓存恢复初始种群；未命中时正常初始化并写入缓存。恢复后随机数状态与直接初始化完全一致。"""
+        key = _population_cache_key(self.env_config, seed)
+        blob = _population_cache.get(key)
+        if blob is not None:
+            _population_cache.move_to_end(key)
+            self.users, self.chargers, random_state = pickle.loads(blob)
+            random.setstate(random_state)
+            self.charger_count = len(self.chargers)
+            logger.info(f"Restored {len(self.users)} users and {len(self.chargers)} chargers from population cache.")
+            return
+
+        self.users = self._initialize_users()
+        self.chargers = self._initialize_chargers()
+        _population_cache[key] = pickle.dumps((self.users, self.chargers, random.getstate()), protocol=pickle.HIGHEST_PROTOCOL)
+        while len(_population_cache) > POPULATION_CACHE_SIZE:
+            _population_cache.popitem(last=False)
+
     def _initialize_users(self):
         """初始化模拟用户 (使用完整的详细逻辑)"""
         users = {}
@@ -281,13 +356,83 @@ class ChargingEnvironment:
 
     def step(self, decisions):
         """执行一个仿真时间步"""
+        with self.own_random():
+            return self._step(decisions)
+
+    @contextmanager
+    def own_random(self):
+        """
+        在 with 块内让全局 random 使用本环境的私有随机数流, 退出时恢复调用方的随机数状态。
+
+        分叉出的子环境每一步都经过这里, 因此与父环境及其他分支交替推进也互不干扰;
+        调度算法中的随机性 (如无序调度打乱顺序) 也可放进同一个 with 块。未分叉的环境直接使用全局 random。
+        """
+        if self._own_random_state is None or self._own_random_active:
+            yield
+            return
+        outer_random_state = random.getstate()
+        random.setstate(self._own_random_state)
+        self._own_random_active = True
+        try:
+            yield
+        finally:
+            self._own_random_active = False
+            self._own_random_state = random.getstate()
+            random.setstate(outer_random_state)
+
+    def _step(self, decisions):
         if self.start_time is None:
              logger.error("Simulation start time not set! Resetting environment.")
              self.reset()
 
-        logger.debug(f"--- Step Start: {self.current_time} ---")
+        logger.debug("--- Step Start: %s ---", self.current_time)
         step_start_time = time.time() # 使用导入的 time 模块
 
+        # 0. 影子无序仿真与本步并行推进
+        shadow_requested = self._request_shadow_step()
+
+        # 1-3. 应用决策、模拟用户和充电桩
+        total_ev_load, completed_sessions_this_step = self.advance_entities(decisions)
+        self.completed_charging_sessions.extend(completed_sessions_this_step) # 添加到总列表
+
+        # 4. 更新电网状态 (调用 grid_model)
+        self.grid_simulator.update_step(self.current_time, total_ev_load)
+        logger.debug("Grid simulation step completed.")
+
+        # 5. 前进模拟时间
+        self.current_time += timedelta(minutes=self.time_step_minutes)
+        self.mark_state_changed() # 电网状态和时间也参与状态编码
+
+        # 6. 计算奖励 (调用 metrics 模块)
+        current_state = self.get_current_state() # 获取更新后的状态
+        baseline_rewards = self._collect_shadow_step() if shadow_requested else None
+        rewards = calculate_rewards(current_state, self.config, baseline_rewards=baseline_rewards)
+        logger.debug("Rewards calculated: %s", rewards)
+
+        # 7. 保存历史状态
+        self._save_current_state(rewards)
+        self.publish_shared_state()
+
+        # 8. 检查结束条件 (使用正确的开始时间)
+        done = self._is_done()
+
+        # 逐实体事件 (本步的用户/充电桩/调度事件) 每步汇总为每个模块一行
+        flush_hot_logs(f"Step {self.current_time:%Y-%m-%d %H:%M} events")
+
+        step_duration = time.time() - step_start_time
+        logger.debug("--- Step End: %s (Duration: %.3fs) ---", self.current_time, step_duration)
+
+        return rewards, current_state, done
+
+    def advance_entities(self, decisions):
+        """
+        应用调度决策并模拟一个时间步内的用户和充电桩 (不更新电网、不前进时间)。
+
+        分片仿真 (simulation/sharding.py) 的各分片只调用这一部分, 电网和奖励由协调进程统一计算。
+
+        Returns:
+            tuple: (total_ev_load, completed_sessions_this_step)
+        """
         # 1. 应用决策: 设置用户目标充电桩并规划初始路线
         users_routed = 0
         for user_id, charger_id in decisions.items():
@@ -307,13 +452,13 @@ class ChargingEnvironment:
                             user['status'] = 'traveling' # 设置为旅行状态
                             users_routed += 1
                         else:
-                             logger.warning(f"Failed to plan route for user {user_id} to charger {charger_id}")
+                             hot_log.event("route_failed", logging.WARNING, "Failed to plan route for user %s to charger %s", user_id, charger_id)
                              user['target_charger'] = None # 规划失败，清除目标
                     else:
-                         logger.warning(f"Charger {charger_id} has no position data.")
+                         hot_log.event("charger_without_position", logging.WARNING, "Charger %s has no position data.", charger_id)
             # else: logger.warning(f"Invalid decision: User {user_id} or Charger {charger_id} not found.")
 
-        logger.debug(f"Processed {len(decisions)} decisions, routed {users_routed} users.")
+        logger.debug("Processed %d decisions, routed %d users.", len(decisions), users_routed)
 
         # 2. 模拟用户行为 (调用 user_model)
         simulate_users_step(self.users, self.chargers, self.current_time, self.time_step_minutes, self.config)
@@ -336,11 +481,11 @@ class ChargingEnvironment:
                         if current_queue_len < queue_capacity:
                              charger['queue'].append(user_id)
                              users_added_to_queue += 1
-                             logger.info(f"User {user_id} arrived and added to queue for charger {target_charger_id}. Queue size: {len(charger['queue'])}")
+                             hot_log.event("queued", logging.INFO, "User %s arrived and added to queue for charger %s. Queue size: %d", user_id, target_charger_id, len(charger['queue']))
                              # 清除 target_charger，表示已到达并入队，防止重复添加
                              # user["target_charger"] = None # <--- 考虑是否需要清除，可能影响重试逻辑
                         else:
-                             logger.warning(f"User {user_id} arrived at charger {target_charger_id}, but queue is full ({current_queue_len}/{queue_capacity}). User remains WAITING.")
+                             hot_log.event("queue_full", logging.WARNING, "User %s arrived at charger %s, but queue is full (%d/%d). User remains WAITING.", user_id, target_charger_id, current_queue_len, queue_capacity)
                              # 用户仍然是 waiting 状态，但未入队，下一轮调度可能会重新分配或用户放弃？
                              # 或者让用户状态变回 idle?
                              # user['status'] = 'idle' # 方案1：让用户变回空闲
@@ -350,31 +495,18 @@ class ChargingEnvironment:
                 # else: # 用户状态是 waiting 但没有有效的 target_charger，这不应该发生
                     # logger.warning(f"User {user_id} is WAITING but has no valid target_charger ID ({target_charger_id}).")
         if users_added_to_queue > 0:
-            logger.debug(f"{users_added_to_queue} users added to charger queues this step.")
+            logger.debug("%d users added to charger queues this step.", users_added_to_queue)
         # 3. 模拟充电过程 (调用 charger_model)
         current_grid_status = self.grid_simulator.get_status()
         total_ev_load, completed_sessions_this_step = simulate_chargers_step(
             self.chargers, self.users, self.current_time, self.time_step_minutes, current_grid_status
         )
-        self.completed_charging_sessions.extend(completed_sessions_this_step) # 添加到总列表
-        logger.debug(f"Charger simulation step completed. EV Load: {total_ev_load:.2f} kW. Sessions completed: {len(completed_sessions_this_step)}")
+        logger.debug("Charger simulation step completed. EV Load: %.2f kW. Sessions completed: %d", total_ev_load, len(completed_sessions_this_step))
+        self.mark_state_changed()
+        return total_ev_load, completed_sessions_this_step
 
-        # 4. 更新电网状态 (调用 grid_model)
-        self.grid_simulator.update_step(self.current_time, total_ev_load)
-        logger.debug("Grid simulation step completed.")
-
-        # 5. 前进模拟时间
-        self.current_time += timedelta(minutes=self.time_step_minutes)
-
-        # 6. 计算奖励 (调用 metrics 模块)
-        current_state = self.get_current_state() # 获取更新后的状态
-        rewards = calculate_rewards(current_state, self.config)
-        logger.debug(f"Rewards calculated: {rewards}")
-
-        # 7. 保存历史状态
-        self._save_current_state(rewards)
-
-        # 8. 检查结束条件 (使用正确的开始时间)
+    def _is_done(self):
+        """仿真时间是否已达到 simulation_days"""
         # ===> 修正 done 计算 <===
         if self.start_time:
              # 确保比较时去除时区信息（如果存在）以避免错误
@@ -386,31 +518,194 @@ class ChargingEnvironment:
              total_simulation_minutes = self.simulation_days * 24 * 60
              # 判断是否完成（留一点点余量防止浮点数问题）
              done = total_minutes_elapsed >= (total_simulation_minutes - self.time_step_minutes / 2)
-             logger.debug(f"Checking completion: Elapsed Min={total_minutes_elapsed:.1f}, Target Min={total_simulation_minutes}, Done={done}")
+             logger.debug("Checking completion: Elapsed Min=%.1f, Target Min=%s, Done=%s", total_minutes_elapsed, total_simulation_minutes, done)
         else:
              logger.error("Simulation start time is missing! Cannot determine completion.")
              done = True # 无法判断，强制结束
+        return done
 
-        step_duration = time.time() - step_start_time
-        logger.debug(f"--- Step End: {self.current_time} (Duration: {step_duration:.3f}s) ---")
-
-        return rewards, current_state, done
+    def mark_state_changed(self):
+        """用户/充电桩/电网状态或时间被修改后调用: 取新的状态版本, get_current_state 随之重建列表"""
+        self._state_version = next(_STATE_VERSIONS)
 
     def get_current_state(self):
-        """获取当前环境状态"""
-        users_list = list(self.users.values()) if self.users else []
-        chargers_list = list(self.chargers.values()) if self.chargers else []
+        """获取当前环境状态 (状态版本未变时复用同一组用户/充电桩列表, 下一步的决策状态因此与上一步 step 返回的状态共享缓存)"""
+        if self._state_lists is None or self._state_lists[0] != self._state_version:
+            self._state_lists = (self._state_version,
+                                 list(self.users.values()) if self.users else [],
+                                 list(self.chargers.values()) if self.chargers else [])
+        _, users_list, chargers_list = self._state_lists
 
         state = {
             "timestamp": self.current_time.isoformat(),
             "users": users_list,
             "chargers": chargers_list,
             "grid_status": self.grid_simulator.get_status(), # 从 grid_simulator 获取
+            "state_version": self._state_version,
             # 优化历史记录大小: 只包含关键信息，并且限制长度
             "history": self.history[-96:] # 最近24小时 (假设15分钟步长)
         }
         return state
 
+    def _request_shadow_step(self):
+        """按需启动影子无序仿真并通知其推进一步，成功返回 True"""
+        if self.baseline_mode != "shadow" or not self.enable_uncoordinated_baseline:
+            return False
+        try:
+            if self._shadow is None:
+                from .shadow import ShadowBaseline
+                # 以当前 (尚未应用决策的) 状态作为影子仿真的起点
+                self._shadow = ShadowBaseline(self.config, self)
+            self._shadow.request_step()
+            return True
+        except Exception as e:
+            logger.error(f"Failed to run uncoordinated shadow simulation, falling back to estimated baseline: {e}", exc_info=True)
+            self.close_shadow()
+            self.baseline_mode = "estimate"
+            return False
+
+    def _collect_shadow_step(self):
+        """取回影子仿真本步的奖励，失败时退回公式估算"""
+        try:
+            return self._shadow.collect()
+        except Exception as e:
+            logger.error(f"Uncoordinated shadow simulation failed, falling back to estimated baseline: {e}")
+            self.close_shadow()
+            self.baseline_mode = "estimate"
+            return None
+
+    def close_shadow(self):
+        """结束影子无序仿真进程 (如果存在)"""
+        if self._shadow is not None:
+            self._shadow.close()
+            self._shadow = None
+
+    # --- 共享内存状态 ---
+    def enable_shared_state(self, name=None):
+        """
+        开始在每步结束时把列式状态发布到共享内存 (格式见 simulation/shared_state.py),
+        其他进程可用 SharedStateReader(name) 零拷贝读取。
+
+        Returns:
+            str: 共享内存块名
+        """
+        from .shared_state import SharedStatePublisher
+        self.close_shared_state()
+        self._shared_state = SharedStatePublisher(len(self.users), len(self.chargers), name=name)
+        self.publish_shared_state()
+        return self._shared_state.name
+
+    def publish_shared_state(self):
+        """发布当前状态 (未启用时不做任何事), 返回发布序号"""
+        if self._shared_state is None:
+            return None
+        try:
+            return self._shared_state.publish(self.users, self.chargers, self.grid_simulator.grid_status, self.current_time)
+        except ValueError as e:
+            logger.error(f"Stopped publishing shared state: {e}")
+            self.close_shared_state()
+            return None
+
+    def close_shared_state(self):
+        """停止发布并释放共享内存块"""
+        if self._shared_state is not None:
+            self._shared_state.close()
+            self._shared_state = None
+
+    # --- 快照与检查点 ---
+    def get_snapshot(self):
+        """
+        返回重建当前仿真所需的全部可变状态。
+
+        返回的字典直接引用环境内部对象 (不复制); 需要独立副本时请序列化 (如写入检查点)。
+        """
+        return {
+            "time_step_minutes": self.time_step_minutes,
+            "current_time": self.current_time,
+            "start_time": self.start_time,
+            "users": self.users,
+            "chargers": self.chargers, # 含各充电桩的排队队列
+            "grid_status": self.grid_simulator.grid_status,
+            "history": self.history,
+            "completed_charging_sessions": self.completed_charging_sessions,
+            "random_state": self._own_random_state if self._own_random_state is not None else random.getstate(),
+        }
+
+    def restore_snapshot(self, snapshot, isolated_random=False):
+        """
+        用 get_snapshot() 的结果替换当前仿真状态 (包括随机数状态)。
+
+        快照必须来自相同时间步长的环境。影子无序仿真会被关闭, 下一步时从恢复后的状态重新启动。
+        已启用共享内存状态时立即发布恢复后的状态 (容量不足时按同名重建内存块)。
+        isolated_random 为 True 时快照的随机数状态只用于本环境的私有随机数流, 不修改全局 random。
+        """
+        if snapshot.get("time_step_minutes") != self.time_step_minutes:
+            raise ValueError(f"Snapshot time step {snapshot.get('time_step_minutes')} min does not match environment time step {self.time_step_minutes} min")
+        self.close_shadow()
+        self.current_time = snapshot["current_time"]
+        self.start_time = snapshot["start_time"]
+        self.users = snapshot["users"]
+        self.chargers = snapshot["chargers"]
+        self.charger_count = len(self.chargers)
+        self.grid_simulator.grid_status = snapshot["grid_status"]
+        self.history = snapshot["history"]
+        self.completed_charging_sessions = snapshot["completed_charging_sessions"]
+        if isolated_random:
+            self._own_random_state = snapshot["random_state"]
+        else:
+            self._own_random_state = None
+            random.setstate(snapshot["random_state"])
+        self._reset_random_state = snapshot["random_state"]
+        self.mark_state_changed()
+        if self._shared_state is not None:
+            publisher = self._shared_state
+            if len(self.users) > publisher.user_capacity or len(self.chargers) > publisher.charger_capacity:
+                self.enable_shared_state(publisher.name) # 旧块被置 closed 标志, 读者按名字重新映射
+            else:
+                self.publish_shared_state()
+
+    def snapshot_bytes(self):
+        """当前状态的序列化快照 (一次序列化可供多个分叉反复还原)"""
+        return pickle.dumps(self.get_snapshot(), protocol=pickle.HIGHEST_PROTOCOL)
+
+    def fork(self, config=None):
+        """
+        从当前状态分叉出一个独立的子环境, 用于 what-if 比较 (不同调度算法/配置从同一时刻出发)。
+
+        子环境拥有状态的独立副本和私有随机数流 (起点与父环境当前的随机数状态相同,
+        因此各分支面对相同的随机扰动), 与父环境及其他分支交替推进也互不影响。
+
+        Args:
+            config (dict): 子环境使用的配置 (默认与父环境相同); 时间步长必须一致
+        """
+        return self.fork_many([config])[0]
+
+    def fork_many(self, configs):
+        """按 configs 中的每个配置各分叉一个子环境, 只序列化一次当前状态"""
+        blob = self.snapshot_bytes()
+        return [ChargingEnvironment(config if config is not None else self.config, snapshot=pickle.loads(blob), isolated_random=True)
+                for config in configs]
+
+    def save_checkpoint(self, path, extra=None, run_data=None):
+        """把当前状态写入检查点文件 (格式见 simulation/checkpoint.py), 返回头信息"""
+        from .checkpoint import save_env_checkpoint
+        return save_env_checkpoint(path, self.get_snapshot(), self.env_config, extra=extra, run_data=run_data)
+
+    def restore_checkpoint(self, path):
+        """
+        从检查点文件恢复状态。
+
+        Returns:
+            tuple: (header, run_data), header["extra"] 为保存时传入的附加信息
+        """
+        from .checkpoint import load_env_checkpoint, env_config_hash
+        snapshot, header, run_data = load_env_checkpoint(path)
+        if header.get("env_config_hash") != env_config_hash(self.env_config):
+            logger.warning(f"Checkpoint {path} was saved with a different environment configuration; continuing with the current configuration.")
+        self.restore_snapshot(snapshot)
+        logger.info(f"Restored environment from checkpoint {path}: sim time {self.current_time}, {len(self.users)} users, {len(self.chargers)} chargers.")
+        return header, run_data
+
     def _save_current_state(self, rewards):
         """保存当前的关键状态和奖励到历史记录"""
         latest_grid_status = self.grid_simulator.get_status()
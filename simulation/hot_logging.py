@@ -0,0 +1,112 @@
+# ev_charging_project/simulation/hot_logging.py
+# 热路径日志: 逐用户/逐充电桩循环中的日志不再每个实体输出一行, 而是
+#   1. 按事件类型计数 (每步结束时由 flush_hot_logs() 输出一行汇总);
+#   2. 每种事件在一个时间窗口内最多输出若干条采样明细 (限速);
+#   3. 级别未启用时只做一次计数, 不格式化任何字符串 (明细使用 %-style 延迟格式化)。
+
+import logging
+import time
+from collections import defaultdict
+
+DEFAULT_SAMPLES_PER_WINDOW = 5 # 每种事件每个窗口最多输出的明细条数
+DEFAULT_WINDOW_SECONDS = 10.0
+
+_hot_logs = {}
+_settings = {"samples_per_window": DEFAULT_SAMPLES_PER_WINDOW, "window_seconds": DEFAULT_WINDOW_SECONDS}
+
+
+class HotPathLog:
+    """
+    包装一个 logging.Logger, 用于每步调用成千上万次的日志点。
+
+    用法:
+        hot_log = get_hot_log(logger)
+        hot_log.event("queue_full", logging.WARNING, "User %s arrived at charger %s, but queue is full.", user_id, charger_id)
+    """
+
+    def __init__(self, logger, samples_per_window=None, window_seconds=None):
+        self.logger = logger
+        self.samples_per_window = _settings["samples_per_window"] if samples_per_window is None else samples_per_window
+        self.window_seconds = _settings["window_seconds"] if window_seconds is None else window_seconds
+        self.counts = defaultdict(int) # 上次 flush 以来各事件的次数
+        self.levels = {} # 事件类型 -> 最高日志级别, 用于决定汇总行的级别
+        self.sampled = 0
+        self.suppressed = 0
+        self._window_start = {}
+        self._window_emitted = defaultdict(int)
+
+    def event(self, event_type, level, msg, *args):
+        """记录一次事件; 只有级别启用且未超出本窗口的采样配额时才格式化并输出明细"""
+        self.counts[event_type] += 1
+        if self.levels.get(event_type, logging.NOTSET) < level:
+            self.levels[event_type] = level
+        if not self.logger.isEnabledFor(level):
+            return
+        emitted = self._window_emitted[event_type]
+        if emitted >= self.samples_per_window:
+            now = time.monotonic()
+            if now - self._window_start.get(event_type, 0.0) < self.window_seconds:
+                self.suppressed += 1
+                return
+            emitted = 0
+        if emitted == 0:
+            self._window_start[event_type] = time.monotonic()
+        self._window_emitted[event_type] = emitted + 1
+        self.sampled += 1
+        self.logger.log(level, msg, *args, stacklevel=2)
+
+    def flush(self, label=None):
+        """
+        输出自上次 flush 以来的事件计数汇总并清零。
+
+        汇总行的级别取本轮出现过的最高事件级别 (但不高于 INFO), 级别未启用时不输出。
+
+        Returns:
+            dict: 本轮各事件的次数
+        """
+        if not self.counts:
+            return {}
+        counts = dict(self.counts)
+        level = min(max(self.levels.values()), logging.INFO)
+        if self.logger.isEnabledFor(level):
+            summary = ", ".join(f"{event_type}={count}" for event_type, count in sorted(counts.items()))
+            self.logger.log(level, "%s: %s (%d sampled, %d suppressed)", label or "Event counts", summary,
+                            self.sampled, self.suppressed)
+        self.counts.clear()
+        self.levels.clear()
+        self.sampled = 0
+        self.suppressed = 0
+        return counts
+
+
+def get_hot_log(logger):
+    """获取 (或创建) logger 对应的 HotPathLog; 同名 logger 共用一个实例"""
+    hot_log = _hot_logs.get(logger.name)
+    if hot_log is None:
+        hot_log = HotPathLog(logger)
+        _hot_logs[logger.name] = hot_log
+    return hot_log
+
+
+def configure_hot_logging(config):
+    """
+    从全局配置的 "logging" 部分读取采样参数, 并应用到所有已创建的 HotPathLog。
+
+    config["logging"] 示例: {"hot_path_samples_per_window": 5, "hot_path_window_seconds": 10}
+    """
+    logging_config = (config or {}).get("logging", {})
+    _settings["samples_per_window"] = int(logging_config.get("hot_path_samples_per_window", DEFAULT_SAMPLES_PER_WINDOW))
+    _settings["window_seconds"] = float(logging_config.get("hot_path_window_seconds", DEFAULT_WINDOW_SECONDS))
+    for hot_log in _hot_logs.values():
+        hot_log.samples_per_window = _settings["samples_per_window"]
+        hot_log.window_seconds = _settings["window_seconds"]
+
+
+def flush_hot_logs(label=None):
+    """对所有 HotPathLog 调用 flush (每个仿真步结束时调用一次)"""
+    all_counts = {}
+    for name, hot_log in _hot_logs.items():
+        counts = hot_log.flush(label)
+        if counts:
+            all_counts[name] = counts
+    return all_counts
@@ -7,19 +7,48 @@ from datetime import datetime
 
 logger = logging.getLogger(__name__)
 
-def calculate_rewards(state, config):
+def summarize_entities(users, chargers):
+    """
+    奖励计算所需的用户/充电桩汇总量。各项均可直接相加, 分片仿真中把各分片的汇总求和即得到全局汇总。
+
+    Returns:
+        dict: user_count, soc_sum, waiting_count, charger_count, total_revenue, occupied_chargers
+    """
+    users = list(users)
+    chargers = list(chargers)
+    return {
+        "user_count": len(users),
+        "soc_sum": sum(u.get('soc', 0) for u in users if isinstance(u.get('soc'), (int, float))), # 更安全的求和
+        "waiting_count": sum(1 for u in users if u.get('status') == 'waiting'),
+        "charger_count": len(chargers),
+        "total_revenue": sum(c.get('daily_revenue', 0) for c in chargers if isinstance(c.get('daily_revenue'), (int, float))),
+        "occupied_chargers": sum(1 for c in chargers if c.get('status') == 'occupied'),
+    }
+
+def merge_summaries(summaries):
+    """把多个 summarize_entities() 的结果相加"""
+    merged = {}
+    for summary in summaries:
+        for key, value in summary.items():
+            merged[key] = merged.get(key, 0) + value
+    return merged
+
+def calculate_rewards(state, config, baseline_rewards=None, summary=None):
     """
     计算当前状态下的奖励值，并包含无序充电基准对比。
 
     Args:
         state (dict): 当前环境状态 (包含 users, chargers, grid_status)
         config (dict): 全局配置
+        baseline_rewards (dict): 可选，影子无序仿真同一步的奖励。提供时直接用作基准，
+                                 否则按公式估算无序指标。
+        summary (dict): 可选，summarize_entities() 的结果。提供时 state 中只需要 grid_status 和 timestamp
 
     Returns:
         dict: 包含各项奖励指标及对比指标的字典
     """
-    users = state.get('users', [])
-    chargers = state.get('chargers', [])
+    if summary is None:
+        summary = summarize_entities(state.get('users', []), state.get('chargers', []))
     grid_status_dict = state.get('grid_status', {})
     current_time_str = state.get('timestamp', datetime.now().isoformat())
     try:
@@ -28,23 +57,23 @@ def calculate_rewards(state, config):
         current_time = datetime.now()
     hour = current_time.hour
 
-    total_users = len(users) if users else 1
-    total_chargers = len(chargers) if chargers else 1
+    total_users = summary["user_count"] or 1
+    total_chargers = summary["charger_count"] or 1
 
     # --- 1. 用户满意度 (协调后) ---
     user_satisfaction_score = 0
     # (复制粘贴原 _calculate_rewards 中用户满意度的计算逻辑)
     # ... [原用户满意度计算逻辑，注意使用 state 中的数据] ...
     # 示例简化版：
-    soc_sum = sum(u.get('soc', 0) for u in users if isinstance(u.get('soc'), (int, float))) # 更安全的求和
+    soc_sum = summary["soc_sum"]
     avg_soc = soc_sum / total_users if total_users > 0 else 0
-    waiting_count = sum(1 for u in users if u.get('status') == 'waiting')
+    waiting_count = summary["waiting_count"]
     # 简单的满意度计算，需要替换为原详细逻辑
     user_satisfaction_raw = (avg_soc / 100.0) * (1 - 0.5 * (waiting_count / total_users))
     # 映射到 [-1, 1]
     user_satisfaction = 2 * user_satisfaction_raw - 1 # 极简示例
     user_satisfaction = max(-1.0, min(1.0, user_satisfaction))
-    logger.debug(f"Calculated User Satisfaction: {user_satisfaction:.4f}")
+    logger.debug("Calculated User Satisfaction: %.4f", user_satisfaction)
 
 
     # --- 2. 运营商利润 (协调后) ---
@@ -52,8 +81,8 @@ def calculate_rewards(state, config):
     # (复制粘贴原 _calculate_rewards 中运营商利润的计算逻辑)
     # ... [原运营商利润计算逻辑，注意使用 state 中的数据] ...
     # 示例简化版：
-    total_revenue = sum(c.get('daily_revenue', 0) for c in chargers if isinstance(c.get('daily_revenue'), (int, float)))
-    occupied_chargers = sum(1 for c in chargers if c.get('status') == 'occupied')
+    total_revenue = summary["total_revenue"]
+    occupied_chargers = summary["occupied_chargers"]
     utilization = occupied_chargers / total_chargers if total_chargers > 0 else 0
     # 简单的利润计算，需要替换为原详细逻辑
     profit_factor = (total_revenue / (total_chargers * 50 + 1e-6)) # 假设每个充电桩每天目标收入50
@@ -61,7 +90,7 @@ def calculate_rewards(state, config):
      # 映射到 [-1, 1]
     operator_profit = 2 * operator_profit_raw - 1 # 极简示例
     operator_profit = max(-1.0, min(1.0, operator_profit))
-    logger.debug(f"Calculated Operator Profit: {operator_profit:.4f}")
+    logger.debug("Calculated Operator Profit: %.4f", operator_profit)
 
 
     # --- 3. 电网友好度 (协调后) ---
@@ -101,7 +130,7 @@ def calculate_rewards(state, config):
     grid_friendliness = max(-0.9, min(1.0, grid_friendliness_raw))
     if grid_friendliness < 0: grid_friendliness *= 0.8
     else: grid_friendliness = min(1.0, grid_friendliness * 1.1)
-    logger.debug(f"Calculated Grid Friendliness: {grid_friendliness:.4f}")
+    logger.debug("Calculated Grid Friendliness: %.4f", grid_friendliness)
 
 
     # --- 4. 总奖励 (协调后) ---
@@ -111,7 +140,7 @@ def calculate_rewards(state, config):
     total_reward = (user_satisfaction * weights["user_satisfaction"] +
                     operator_profit * weights["operator_profit"] +
                     grid_friendliness * weights["grid_friendliness"])
-    logger.debug(f"Calculated Total Reward: {total_reward:.4f}")
+    logger.debug("Calculated Total Reward: %.4f", total_reward)
 
 
     # --- 5. 无序充电基准对比 (从原环境类逻辑迁移并调整) ---
@@ -124,7 +153,20 @@ def calculate_rewards(state, config):
     # 检查配置是否启用了基准对比
     enable_baseline = config.get('environment', {}).get('enable_uncoordinated_baseline', True)
 
-    if enable_baseline:
+    if enable_baseline and baseline_rewards:
+        # 使用影子无序仿真的真实指标
+        uncoordinated_user_satisfaction = baseline_rewards.get("user_satisfaction")
+        uncoordinated_operator_profit = baseline_rewards.get("operator_profit")
+        uncoordinated_grid_friendliness = baseline_rewards.get("grid_friendliness")
+        uncoordinated_total_reward = baseline_rewards.get("total_reward")
+        logger.debug("Shadow Baseline Total Reward: %s", uncoordinated_total_reward)
+
+        if uncoordinated_total_reward is not None and abs(uncoordinated_total_reward) > 1e-6:
+            improvement_percentage = ((total_reward - uncoordinated_total_reward) /
+                                      abs(uncoordinated_total_reward)) * 100
+            logger.debug("Improvement Percentage: %.2f%%", improvement_percentage)
+
+    elif enable_baseline:
         # 估算无序用户满意度 (简化)
         # 主要惩罚等待时间，SOC影响较小
         uncoordinated_wait_factor = 0.7 # 假设平均等待时间更长，满意度因子降低
@@ -133,7 +175,7 @@ def calculate_rewards(state, config):
         unc_user_satisfaction_raw = uncoordinated_soc_factor * uncoordinated_wait_factor
         uncoordinated_user_satisfaction = 2 * unc_user_satisfaction_raw - 1
         uncoordinated_user_satisfaction = max(-1.0, min(1.0, uncoordinated_user_satisfaction))
-        logger.debug(f"Baseline User Satisfaction: {uncoordinated_user_satisfaction:.4f}")
+        logger.debug("Baseline User Satisfaction: %.4f", uncoordinated_user_satisfaction)
 
         # 估算无序运营商利润 (简化)
         # 假设利用率可能接近，但收入分布不均，高峰期收入高但成本也高，可能利润率更低
@@ -141,7 +183,7 @@ def calculate_rewards(state, config):
         profit_reduction_factor = random.uniform(0.7, 0.9)
         uncoordinated_operator_profit = operator_profit * profit_reduction_factor - 0.1 # 再加一点固定惩罚
         uncoordinated_operator_profit = max(-1.0, min(1.0, uncoordinated_operator_profit))
-        logger.debug(f"Baseline Operator Profit: {uncoordinated_operator_profit:.4f}")
+        logger.debug("Baseline Operator Profit: %.4f", uncoordinated_operator_profit)
 
         # 估算无序电网友好度 (基于时间)
         # 无序充电更可能集中在高峰期
@@ -156,7 +198,7 @@ def calculate_rewards(state, config):
             uncoordinated_grid_friendliness = -0.2 - 0.1 * renewable_ratio # 比协调模式的平峰得分低
 
         uncoordinated_grid_friendliness = max(-1.0, min(1.0, uncoordinated_grid_friendliness))
-        logger.debug(f"Baseline Grid Friendliness: {uncoordinated_grid_friendliness:.4f}")
+        logger.debug("Baseline Grid Friendliness: %.4f", uncoordinated_grid_friendliness)
 
         # 计算无序总奖励
         uncoordinated_total_reward = (
@@ -164,13 +206,13 @@ def calculate_rewards(state, config):
             uncoordinated_operator_profit * weights["operator_profit"] +
             uncoordinated_grid_friendliness * weights["grid_friendliness"]
         )
-        logger.debug(f"Baseline Total Reward: {uncoordinated_total_reward:.4f}")
+        logger.debug("Baseline Total Reward: %.4f", uncoordinated_total_reward)
 
         # 计算改进百分比
         if uncoordinated_total_reward is not None and abs(uncoordinated_total_reward) > 1e-6:
             improvement_percentage = ((total_reward - uncoordinated_total_reward) /
                                       abs(uncoordinated_total_reward)) * 100
-            logger.debug(f"Improvement Percentage: {improvement_percentage:.2f}%")
+            logger.debug("Improvement Percentage: %.2f%%", improvement_percentage)
 
 
     # --- 最终返回结果 ---
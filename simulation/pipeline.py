@@ -0,0 +1,124 @@
+# ev_charging_project/simulation/pipeline.py
+# 流水线调度: 调度算法在独立进程中运行, 对第 t 步的状态作决策的同时, 主进程推进环境并完成本步的
+# 记录工作 (历史、指标、UI 状态)。决策在 decision_lag_steps 步之后才被应用, 相当于真实调度系统的下发延迟。
+#
+# 第 t 步的状态快照里还没有最近 lag 步作出、尚未应用的决策。调度进程记住这些决策, 决策前把其中的用户
+# 从候选中去掉并临时计入对应充电桩的队列 (与 anytime 分批时的处理相同), 避免同一用户被重复派发。
+
+import logging
+import multiprocessing
+from collections import deque
+
+from .anytime import state_for_batch
+
+logger = logging.getLogger(__name__)
+
+# 等待调度进程返回决策的超时时间 (秒)
+WORKER_REPLY_TIMEOUT = 300
+
+
+def _state_with_pending(state, pending_decisions):
+    """把尚未应用的决策叠加到状态上: 去掉已派发的用户, 并计入对应充电桩的队列"""
+    pending_by_charger = {}
+    for decisions in pending_decisions:
+        for user_id, charger_id in decisions.items():
+            pending_by_charger.setdefault(charger_id, []).append(user_id)
+    if not pending_by_charger:
+        return state
+    dispatched = {user_id for decisions in pending_decisions for user_id in decisions}
+    users = [u for u in state.get("users", []) if not (isinstance(u, dict) and u.get("user_id") in dispatched)]
+    charger_positions = {c.get("charger_id"): i for i, c in enumerate(state.get("chargers", [])) if isinstance(c, dict)}
+    return state_for_batch(state, users, pending_by_charger, charger_positions)
+
+
+def _scheduler_worker(conn, config, decision_lag_steps):
+    """调度进程主循环: 收到状态后作决策并返回 (decisions, stats)"""
+    try:
+        from .scheduler import ChargingScheduler
+
+        scheduler = ChargingScheduler(config)
+        scheduler.load_q_tables()
+    except Exception as e:
+        conn.send(("error", f"Scheduler worker init failed: {e}"))
+        conn.close()
+        return
+
+    pending_decisions = deque(maxlen=decision_lag_steps) # 已作出、但在下一个快照中尚未生效的决策
+    conn.send(("ready", None))
+    while True:
+        try:
+            command, state = conn.recv()
+        except EOFError:
+            break
+        if command != "decide":
+            break
+        try:
+            decisions = scheduler.make_scheduling_decision(_state_with_pending(state, pending_decisions))
+            if decision_lag_steps:
+                pending_decisions.append(decisions)
+            conn.send(("ok", (decisions, scheduler.last_decision_stats)))
+        except Exception as e:
+            conn.send(("error", str(e)))
+    scheduler.close()
+    conn.close()
+
+
+class PipelinedScheduler:
+    """
+    在后台进程中运行 ChargingScheduler, 决策滞后 decision_lag_steps 步应用。
+
+    用法 (每步一次):
+        decisions = pipeline.next_decisions(env.get_current_state())
+        env.step(decisions)
+    next_decisions 提交本步状态 (发送时即序列化, 之后环境可以继续修改) 并返回 lag 步之前状态的决策;
+    流水线填满之前返回空决策。lag 为 0 时等待本步决策, 即同步调度但在另一个进程中计算。
+    """
+
+    def __init__(self, config, decision_lag_steps=1):
+        self.decision_lag_steps = max(0, int(decision_lag_steps))
+        self.last_decision_stats = {}
+        self._in_flight = deque() # 已提交、尚未取回决策的状态时间戳
+        self._conn, child_conn = multiprocessing.Pipe()
+        self._process = multiprocessing.Process(target=_scheduler_worker, args=(child_conn, config, self.decision_lag_steps), daemon=True)
+        self._process.start()
+        child_conn.close()
+
+        status, payload = self._recv()
+        if status != "ready":
+            self.close()
+            raise RuntimeError(payload)
+        logger.info(f"Scheduler worker started (pid={self._process.pid}), decision lag {self.decision_lag_steps} step(s).")
+
+    def _recv(self):
+        if not self._conn.poll(WORKER_REPLY_TIMEOUT):
+            raise RuntimeError("Scheduler worker did not respond in time.")
+        return self._conn.recv()
+
+    def next_decisions(self, state):
+        """提交本步状态, 返回 decision_lag_steps 步之前提交的状态的决策 {user_id: charger_id}"""
+        self._conn.send(("decide", state))
+        self._in_flight.append(state.get("timestamp"))
+        if len(self._in_flight) <= self.decision_lag_steps:
+            self.last_decision_stats = {"decision_lag_steps": len(self._in_flight) - 1, "pipeline_filling": True}
+            return {}
+
+        decided_for = self._in_flight.popleft()
+        status, payload = self._recv()
+        if status != "ok":
+            logger.error(f"Scheduler worker failed for state {decided_for}: {payload}")
+            self.last_decision_stats = {"decision_lag_steps": self.decision_lag_steps, "worker_error": payload}
+            return {}
+        decisions, stats = payload
+        self.last_decision_stats = dict(stats, decision_lag_steps=self.decision_lag_steps, decided_for=decided_for)
+        return decisions
+
+    def close(self):
+        """结束调度进程 (未取回的决策被丢弃)"""
+        try:
+            self._conn.send(("close", None))
+        except (OSError, ValueError):
+            pass
+        self._conn.close()
+        self._process.join(timeout=5)
+        if self._process.is_alive():
+            self._process.terminate()
@@ -0,0 +1,163 @@
+# ev_charging_project/simulation/result_cache.py
+# 仿真结果文件的内存索引: 按 (mtime, 文件大小) 记录输出目录中的结果文件, 只有新增或改动的文件才重新解析。
+# 列表和单个结果都以序列化好的 JSON 字节缓存, 附带 ETag; 目录扫描最多每 ttl_seconds 一次,
+# 也可以由后台线程定期刷新, 使仪表盘的重复轮询直接由内存应答, 不再与仿真线程争抢 GIL 做文件解析。
+
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime
+
+logger = logging.getLogger(__name__)
+
+RESULT_CACHE_DEFAULTS = {
+    "results_cache_ttl_seconds": 5.0, # 两次目录扫描的最小间隔
+    "results_refresh_interval_seconds": 10.0, # 后台刷新线程的扫描间隔, 0 表示只在请求时按 TTL 扫描
+    "results_cache_max_mb": 64, # 缓存的结果文件内容总大小上限 (按最近使用淘汰)
+}
+
+_SUMMARY_FIELDS = ("timestamp", "progress", "metrics")
+
+
+def _summarize_result(path, filename, stat):
+    """解析结果文件, 返回列表接口中的摘要 (文件名、创建时间、仿真时间、进度和最终指标)"""
+    summary = {"filename": filename, "created": datetime.fromtimestamp(stat.st_mtime).isoformat(), "size": stat.st_size}
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            data = json.load(f)
+        summary.update({key: data.get(key) for key in _SUMMARY_FIELDS})
+    except (OSError, ValueError) as e:
+        logger.warning(f"Could not parse result file {filename}: {e}")
+        summary["error"] = str(e)
+    return summary
+
+
+class ResultIndex:
+    """
+    输出目录中结果文件 (*.json) 的内存索引。
+
+    listing() 和 result(filename) 返回 (body, etag), body 为可直接作为响应返回的 JSON 字节;
+    格式与前端约定一致: {"status": "success", "results": [...]} 和 {"status": "success", "result": {...}}。
+    """
+
+    def __init__(self, directory, ttl_seconds=5.0, max_cached_bytes=64 * 1024 * 1024):
+        self.directory = directory
+        self.ttl_seconds = ttl_seconds
+        self.max_cached_bytes = max_cached_bytes
+        self._lock = threading.Lock()
+        self._entries = {} # filename -> {"key": (mtime_ns, size), "summary": dict}
+        self._bodies = OrderedDict() # filename -> (key, body), 按最近使用排序
+        self._cached_bytes = 0
+        self._listing = (b'{"status": "success", "results": []}', "results-empty")
+        self._scanned_at = None
+        self._stop = threading.Event()
+        self._refresher = None
+
+    def refresh(self, force=False):
+        """扫描目录 (距上次扫描不足 TTL 且未强制时跳过), 只重新解析新增或改动的文件"""
+        with self._lock:
+            now = time.monotonic()
+            if not force and self._scanned_at is not None and now - self._scanned_at < self.ttl_seconds:
+                return
+            self._scanned_at = now
+            self._scan()
+
+    def _scan(self):
+        try:
+            dir_entries = [e for e in os.scandir(self.directory) if e.name.endswith(".json") and e.is_file()]
+        except OSError:
+            dir_entries = []
+        seen = set()
+        changed = False
+        for dir_entry in dir_entries:
+            try:
+                stat = dir_entry.stat()
+            except OSError:
+                continue
+            key = (stat.st_mtime_ns, stat.st_size)
+            seen.add(dir_entry.name)
+            entry = self._entries.get(dir_entry.name)
+            if entry and entry["key"] == key:
+                continue
+            self._entries[dir_entry.name] = {"key": key, "summary": _summarize_result(dir_entry.path, dir_entry.name, stat)}
+            changed = True
+        for filename in set(self._entries) - seen:
+            del self._entries[filename]
+            self._evict(filename)
+            changed = True
+        if changed:
+            ordered = sorted(self._entries.items(), key=lambda item: item[1]["key"][0], reverse=True) # 最新的在前
+            body = json.dumps({"status": "success", "results": [entry["summary"] for _, entry in ordered]}).encode("utf-8")
+            fingerprint = repr([(filename, entry["key"]) for filename, entry in ordered]).encode("utf-8")
+            self._listing = (body, "results-" + hashlib.sha1(fingerprint).hexdigest())
+
+    def _evict(self, filename):
+        cached = self._bodies.pop(filename, None)
+        if cached:
+            self._cached_bytes -= len(cached[1])
+
+    def listing(self):
+        """结果列表 (body, etag)"""
+        self.refresh()
+        with self._lock:
+            return self._listing
+
+    def result(self, filename):
+        """
+        单个结果文件的 (body, etag); 文件不在索引中 (包括不在输出目录下的路径) 时返回 None。
+        文件内容原样嵌入响应, 不重新解析。
+        """
+        self.refresh()
+        with self._lock:
+            entry = self._entries.get(filename)
+            if entry is None:
+                return None
+            key = entry["key"]
+            etag = "result-" + hashlib.sha1(repr((filename, key)).encode("utf-8")).hexdigest()
+            cached = self._bodies.get(filename)
+            if cached and cached[0] == key:
+                self._bodies.move_to_end(filename)
+                return cached[1], etag
+
+        try:
+            with open(os.path.join(self.directory, filename), "rb") as f:
+                raw = f.read()
+        except OSError as e:
+            logger.warning(f"Could not read result file {filename}: {e}")
+            return None
+        body = b'{"status": "success", "result": ' + raw + b"}"
+
+        with self._lock:
+            self._evict(filename)
+            if len(body) <= self.max_cached_bytes:
+                self._bodies[filename] = (key, body)
+                self._cached_bytes += len(body)
+                while self._cached_bytes > self.max_cached_bytes:
+                    oldest = next(iter(self._bodies))
+                    self._evict(oldest)
+        return body, etag
+
+    def start_refresher(self, interval_seconds):
+        """启动后台刷新线程, 每 interval_seconds 秒扫描一次目录"""
+        if self._refresher is not None or not interval_seconds or interval_seconds <= 0:
+            return
+        def _loop():
+            while not self._stop.wait(interval_seconds):
+                try:
+                    self.refresh(force=True)
+                except Exception as e:
+                    logger.error(f"Result index refresh failed: {e}", exc_info=True)
+        self.refresh(force=True)
+        self._refresher = threading.Thread(target=_loop, name="ResultIndexRefresher", daemon=True)
+        self._refresher.start()
+
+    def stop(self):
+        """停止后台刷新线程"""
+        self._stop.set()
+        if self._refresher is not None:
+            self._refresher.join(timeout=5)
+            self._refresher = None
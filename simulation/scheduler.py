@@ -1,19 +1,45 @@
 # ev_charging_project/simulation/scheduler.py
 
 import logging
-import random
-from collections import defaultdict
-import math
-from datetime import datetime # 需要导入 datetime 用于 MARL 辅助函数
-
-# 导入算法模块 (使用 try-except 增加健壮性)
-try:
-    from algorithms import rule_based, uncoordinated
-except ImportError as e:
-    logging.error(f"Failed to import base algorithms: {e}", exc_info=True)
-    # 定义空的 schedule 函数作为 fallback
-    rule_based = type('obj', (object,), {'schedule': lambda s, c: {}})()
-    uncoordinated = type('obj', (object,), {'schedule': lambda s: {}})()
+import importlib
+import time
+
+# 算法模块按需加载: 只导入配置中实际使用的算法 (以及回退用的 rule_based),
+# 避免 CLI 和短生命周期的工作进程为用不到的算法及其依赖付出导入时间
+ALGORITHM_MODULES = {
+    "rule_based": "algorithms.rule_based",
+    "uncoordinated": "algorithms.uncoordinated",
+    "coordinated_mas": "algorithms.coordinated_mas",
+    "marl": "algorithms.marl",
+    "rollout": "algorithms.rollout",
+}
+_loaded_algorithms = {}
+
+
+def load_algorithm(name):
+    """
+    导入并缓存算法模块。
+
+    Args:
+        name (str): ALGORITHM_MODULES 中的算法名
+
+    Returns:
+        module: 算法模块; 导入失败时 rule_based/uncoordinated 返回一个 schedule 为空操作的占位对象,
+        其余算法抛出 ImportError
+    """
+    module = _loaded_algorithms.get(name)
+    if module is not None:
+        return module
+    try:
+        module = importlib.import_module(ALGORITHM_MODULES[name])
+    except ImportError as e:
+        if name not in ("rule_based", "uncoordinated"):
+            raise
+        logging.error(f"Failed to import base algorithm '{name}': {e}", exc_info=True)
+        # 定义空的 schedule 函数作为 fallback
+        module = type('obj', (object,), {'schedule': staticmethod(lambda *args, **kwargs: {})})()
+    _loaded_algorithms[name] = module
+    return module
 
 # 导入 utils (如果需要)
 try:
@@ -23,6 +49,8 @@ except ImportError:
     logging.warning("Could not import calculate_distance from simulation.utils")
     def calculate_distance(p1, p2): return 10.0 # Fallback distance
 
+from .anytime import anytime_settings, run_anytime
+
 logger = logging.getLogger(__name__)
 
 class ChargingScheduler:
@@ -42,14 +70,22 @@ class ChargingScheduler:
         self.algorithm = scheduler_config.get("scheduling_algorithm", "rule_based")
         logger.info(f"ChargingScheduler initializing with algorithm: {self.algorithm}")
 
+        # 带延迟预算的调度: latency_budget_ms > 0 时分批处理候选用户, 未处理完的顺延到下一步
+        self.anytime = anytime_settings(config)
+        self._deferred_candidates = {} # user_id -> 已顺延步数
+        self.last_decision_stats = {}
+        if self.anytime["latency_budget_ms"] > 0:
+            logger.info(f"Anytime scheduling enabled with a {self.anytime['latency_budget_ms']} ms budget per step.")
+
         # 根据算法初始化特定系统
         self.coordinated_mas_system = None
         self.marl_system = None
+        self.rollout_scheduler = None
 
         if self.algorithm == "coordinated_mas":
             logger.info("Initializing Coordinated MAS subsystem...")
             try:
-                from algorithms.coordinated_mas import MultiAgentSystem
+                MultiAgentSystem = load_algorithm("coordinated_mas").MultiAgentSystem
                 self.coordinated_mas_system = MultiAgentSystem()
                 self.coordinated_mas_system.config = config # 将完整配置传递给MAS
                 logger.info("Coordinated MAS subsystem initialized.")
@@ -65,7 +101,7 @@ class ChargingScheduler:
         elif self.algorithm == "marl":
             logger.info("Initializing MARL subsystem...")
             try:
-                from algorithms.marl import MARLSystem
+                MARLSystem = load_algorithm("marl").MARLSystem
                 # 获取充电桩数量，处理可能的缺失
                 num_chargers = env_config.get("charger_count")
                 if num_chargers is None:
@@ -80,7 +116,11 @@ class ChargingScheduler:
                      learning_rate=marl_specific_config.get("learning_rate", 0.01),
                      discount_factor=marl_specific_config.get("discount_factor", 0.95),
                      exploration_rate=marl_specific_config.get("exploration_rate", 0.1),
-                     q_table_path=marl_specific_config.get("q_table_path", None)
+                     q_table_path=marl_specific_config.get("q_table_path", None),
+                     replay_config=marl_specific_config.get("replay"),
+                     checkpoint_every_steps=marl_specific_config.get("checkpoint_every_steps", 0),
+                     inference_mode=marl_specific_config.get("inference_mode", "learning"),
+                     q_bias=marl_specific_config.get("q_bias")
                  )
                 logger.info("MARL subsystem initialized.")
             except ImportError:
@@ -92,57 +132,91 @@ class ChargingScheduler:
                 self.algorithm = "rule_based"
                 logger.warning("Falling back to rule_based.")
 
+        elif self.algorithm == "rollout":
+            logger.info("Initializing rollout look-ahead scheduler...")
+            try:
+                self.rollout_scheduler = load_algorithm("rollout").RolloutScheduler(config)
+            except ImportError:
+                 logger.error("Could not import RolloutScheduler from algorithms.rollout. Check file and class names.")
+                 self.algorithm = "rule_based"
+                 logger.warning("Falling back to rule_based.")
+            except Exception as e:
+                logger.error(f"Failed to initialize rollout scheduler: {e}", exc_info=True)
+                self.algorithm = "rule_based"
+                logger.warning("Falling back to rule_based.")
+
     def make_scheduling_decision(self, state):
-        """根据配置的算法进行调度决策"""
-        decisions = {}
-        logger.debug(f"Making decision using algorithm: {self.algorithm}")
+        """
+        根据配置的算法进行调度决策。
 
+        配置了 scheduler.anytime.latency_budget_ms 时, 在预算内按紧迫度分批决策并返回部分结果,
+        本步的耗时、顺延和兜底数量记录在 last_decision_stats 中。
+        """
         if not state or not isinstance(state, dict):
             logger.error("Scheduler received invalid state")
-            return decisions
+            return {}
+
+        if self.anytime["latency_budget_ms"] > 0:
+            decisions, self.last_decision_stats = run_anytime(self._decide, state, self.anytime, self._deferred_candidates)
+        else:
+            started = time.perf_counter()
+            decisions = self._decide(state)
+            self.last_decision_stats = {
+                "decision_time_ms": (time.perf_counter() - started) * 1000,
+                "deferred_candidates": 0,
+                "fallback_assignments": 0,
+                "budget_exhausted": False,
+            }
+
+        logger.info("Scheduler (%s) made %d assignments in %.1f ms.", self.algorithm, len(decisions),
+                    self.last_decision_stats["decision_time_ms"])
+        return decisions
+
+    def _decide(self, state):
+        """用配置的算法对给定状态作出一次完整决策"""
+        decisions = {}
+        logger.debug("Making decision using algorithm: %s", self.algorithm)
 
         try:
             if self.algorithm == "rule_based":
-                decisions = rule_based.schedule(state, self.config)
+                decisions = load_algorithm("rule_based").schedule(state, self.config)
             elif self.algorithm == "uncoordinated":
-                decisions = uncoordinated.schedule(state)
+                decisions = load_algorithm("uncoordinated").schedule(state)
             elif self.algorithm == "coordinated_mas" and self.coordinated_mas_system:
                 # 确保 MAS 系统有最新的配置 (尤其是权重)
                 self.coordinated_mas_system.config = self.config
                 decisions = self.coordinated_mas_system.make_decisions(state)
             elif self.algorithm == "marl" and self.marl_system:
-                # 1. 为 MARL 生成动态动作映射
-                charger_action_maps = {}
-                if state.get("chargers"):
-                    for charger in state["chargers"]:
-                        charger_id = charger.get("charger_id")
-                        # 确保充电桩状态有效
-                        if charger_id and charger.get("status") != "failure":
-                            action_map, action_size = self._create_dynamic_action_map(charger_id, state)
-                            charger_action_maps[charger_id] = {"map": action_map, "size": action_size}
-                logger.debug(f"Generated {len(charger_action_maps)} action maps for MARL.")
+                # 1. 为 MARL 生成动态动作映射 (所有非故障充电桩一次批量计算)
+                charger_action_maps = load_algorithm("marl").create_dynamic_action_maps(state, self.config.get("scheduler", {}).get("marl_config", {}))
+                logger.debug("Generated %d action maps for MARL.", len(charger_action_maps))
 
                 # 2. MARL 系统选择动作 (返回 {charger_id: action_index})
-                marl_actions = self.marl_system.choose_actions(state)
-                logger.debug(f"MARL raw actions received: {marl_actions}")
+                if self.marl_system.inference_mode == "frozen":
+                    # 部署模式: 冻结的贪心策略表，一次向量化查表
+                    marl_actions = self.marl_system.choose_actions_frozen(state, charger_action_maps)
+                else:
+                    marl_actions = self.marl_system.choose_actions(state, charger_action_maps)
+                logger.debug("MARL raw actions received: %s", marl_actions)
 
                 # 3. 将 MARL 动作转换为决策 (返回 {user_id: charger_id})
                 decisions = self._convert_marl_actions_to_decisions(marl_actions, state, charger_action_maps)
-                logger.debug(f"Converted MARL decisions: {decisions}")
+                logger.debug("Converted MARL decisions: %s", decisions)
+            elif self.algorithm == "rollout" and self.rollout_scheduler:
+                decisions = self.rollout_scheduler.schedule(state)
             else:
                 logger.warning(f"Algorithm '{self.algorithm}' not recognized or system not initialized. Falling back to rule-based.")
-                decisions = rule_based.schedule(state, self.config)
+                decisions = load_algorithm("rule_based").schedule(state, self.config)
 
         except Exception as e:
             logger.error(f"Error during scheduling with {self.algorithm}: {e}", exc_info=True)
             logger.warning("Falling back to rule-based scheduling due to error.")
             try:
-                 decisions = rule_based.schedule(state, self.config)
+                 decisions = load_algorithm("rule_based").schedule(state, self.config)
             except Exception as fallback_e:
                  logger.error(f"Error during fallback rule-based scheduling: {fallback_e}", exc_info=True)
                  decisions = {} # Final fallback
 
-        logger.info(f"Scheduler ({self.algorithm}) made {len(decisions)} assignments.")
         return decisions
 
     # --- learn, load_q_tables, save_q_tables ---
@@ -172,167 +246,26 @@ class ChargingScheduler:
             logger.info("Scheduler attempting to save MARL Q-tables...")
             self.marl_system.save_q_tables()
 
+    def close(self):
+        """释放算法持有的线程池/进程池 (调度器不再使用时调用)"""
+        if self.coordinated_mas_system and hasattr(self.coordinated_mas_system, "shutdown"):
+            self.coordinated_mas_system.shutdown()
+        if self.rollout_scheduler:
+            self.rollout_scheduler.close()
+
     # --- MARL 辅助方法 ---
     def _create_dynamic_action_map(self, charger_id, state):
         """
         为 MARL 创建动态动作映射。
         Index 0 is 'idle', subsequent indices map to potential user IDs.
+        (实现位于 algorithms.marl.create_dynamic_action_maps，批量计算所有充电桩时请直接调用它)
         """
-        # 从配置中获取 MARL 参数
         marl_config = self.config.get("scheduler", {}).get("marl_config", {})
-        action_space_size = marl_config.get("action_space_size", 6) # Default to 6
-        max_potential_users = action_space_size - 1 # Number of users to map
-
-        # --- 获取可配置的候选用户选择参数 ---
-        MAX_DISTANCE_SQ = marl_config.get("marl_candidate_max_dist_sq", 0.15**2) # ~20km radius
-        W_SOC = marl_config.get("marl_priority_w_soc", 0.5)
-        W_DIST = marl_config.get("marl_priority_w_dist", 0.4)
-        W_URGENCY = marl_config.get("marl_priority_w_urgency", 0.1)
-
-        action_map = {0: 'idle'} # Action 0 is always idle
-        chargers = state.get('chargers', [])
-        users = state.get('users', [])
-        charger = next((c for c in chargers if c.get('charger_id') == charger_id), None)
-
-        if not charger or charger.get('status') == 'failure':
-            # logger.debug(f"Charger {charger_id} not found or failed, only idle action.")
-            return action_map, action_space_size # Only 'idle' is possible
-
-        potential_users = []
-        charger_pos = charger.get('position', {}) # Default to empty dict if missing
-
-        for user in users:
-            user_id = user.get('user_id')
-            soc = user.get('soc', 100)
-            status = user.get('status', 'unknown')
-            user_profile = user.get('user_profile', 'flexible')
-            needs_charge_flag = user.get('needs_charge_decision', False)
-
-            if not user_id: continue
-
-            # --- 筛选逻辑: 寻找主动寻求充电的用户 ---
-            is_actively_seeking = False
-            charge_threshold = 40 # 基础阈值，可配置
-            if user_profile == 'anxious': charge_threshold = 50
-            elif user_profile == 'economic': charge_threshold = 30
-
-            is_low_soc = soc < charge_threshold
-
-            # 满足以下条件之一视为寻求充电:
-            # 1. 用户明确标记需要决策
-            if needs_charge_flag and status not in ['charging', 'waiting']:
-                 is_actively_seeking = True
-            # 2. 用户空闲或随机旅行，且电量低于阈值
-            elif status in ['idle', 'traveling'] and user.get('target_charger') is None and is_low_soc:
-                 is_actively_seeking = True
-
-            if not is_actively_seeking:
-                continue # 跳过不寻求充电的用户
-            # --- 结束筛选 ---
-
-            user_pos = user.get('current_position',{})
-            # 检查坐标有效性
-            if isinstance(user_pos.get('lat'), (int, float)) and isinstance(user_pos.get('lng'), (int, float)) and \
-               isinstance(charger_pos.get('lat'), (int, float)) and isinstance(charger_pos.get('lng'), (int, float)):
-
-                dist_sq = (user_pos['lat'] - charger_pos['lat'])**2 + (user_pos['lng'] - charger_pos['lng'])**2
-
-                if dist_sq < MAX_DISTANCE_SQ:
-                    distance = math.sqrt(dist_sq) * 111 # Approx km
-                    # 计算紧迫度 (0 to 1, higher is more urgent)
-                    urgency = max(0, (charge_threshold - soc)) / charge_threshold if charge_threshold > 0 else 0
-
-                    # --- 计算优先级分数 ---
-                    normalized_distance = min(1.0, math.sqrt(dist_sq) / math.sqrt(MAX_DISTANCE_SQ)) if MAX_DISTANCE_SQ > 0 else 0
-                    priority_score = (
-                        W_SOC * (1.0 - soc / 100.0) +      # 低 SOC 贡献正分
-                        W_DIST * (1.0 - normalized_distance) + # 近距离贡献正分
-                        W_URGENCY * urgency                 # 紧迫度贡献正分
-                    )
-                    # --- 结束评分 ---
-
-                    potential_users.append({
-                            'id': user_id,
-                            'priority': priority_score
-                    })
-                    # logger.debug(f"User {user_id} potential for {charger_id}. Priority: {priority_score:.3f}")
-            # else: logger.warning(f"Invalid coordinates for distance calc: User {user_id} or Charger {charger_id}")
-
-        # 按优先级排序 (高优先级在前)
-        potential_users.sort(key=lambda u: -u['priority'])
-        # logger.debug(f"Found {len(potential_users)} potential users for {charger_id}.")
-
-        # 映射优先级最高的用户到动作索引
-        assigned_users_count = 0
-        for i, user_info in enumerate(potential_users):
-             if assigned_users_count < max_potential_users:
-                  action_map[i + 1] = user_info['id']
-                  assigned_users_count += 1
-             else:
-                  break # Stop once we've filled the action space slots
-
-        # logger.debug(f"Final action map for {charger_id}: {action_map}")
-        return action_map, action_space_size
-
+        return load_algorithm("marl").create_dynamic_action_map(charger_id, state, marl_config)
 
     def _convert_marl_actions_to_decisions(self, agent_actions, state, charger_action_maps):
         """
         将 MARL 智能体选择的动作 {charger_id: action_index}
         转换为充电分配决策 {user_id: charger_id}。
         """
-        decisions = {}
-        assigned_users = set() # 跟踪已分配用户，防止重复
-
-        if not isinstance(agent_actions, dict):
-             logger.error(f"_convert_marl_actions_to_decisions received invalid agent_actions type: {type(agent_actions)}")
-             return {}
-
-        logger.debug(f"Converting MARL actions: {agent_actions}")
-
-        # 遍历每个充电站智能体选择的动作
-        for charger_id, action_index in agent_actions.items():
-            # Action 0 总是表示'idle'(不分配)
-            if action_index == 0:
-                # logger.debug(f"Charger {charger_id} chose 'idle' (action 0)")
-                continue
-
-            # --- 使用预生成的动作映射 ---
-            map_data = charger_action_maps.get(charger_id)
-            if not map_data:
-                logger.warning(f"No pre-generated action map found for charger {charger_id}. Cannot convert action {action_index}. Skipping.")
-                continue
-            action_map = map_data.get("map")
-            if not action_map:
-                logger.warning(f"Invalid action map data for charger {charger_id}. Skipping.")
-                continue
-
-            # 在提供的映射中查找对应于所选 action_index 的 user_id
-            user_id_to_assign = action_map.get(action_index)
-
-            if user_id_to_assign and user_id_to_assign != 'idle':
-                # 检查这个用户是否已经被另一个充电站分配
-                if user_id_to_assign not in assigned_users:
-                    # 验证用户是否仍然存在于状态中 (可选但更健壮)
-                    user_exists = any(u.get('user_id') == user_id_to_assign for u in state.get('users', []))
-                    if user_exists:
-                        decisions[user_id_to_assign] = charger_id
-                        assigned_users.add(user_id_to_assign)
-                        logger.debug(f"MARL decision: Assign user {user_id_to_assign} to charger {charger_id} (from action index {action_index})")
-                    else:
-                         logger.warning(f"MARL action {action_index} mapped to user {user_id_to_assign} but user not found in current state. Skipping.")
-                else:
-                    # 冲突: 用户已被分配。记录日志。
-                    logger.warning(f"MARL conflict: User {user_id_to_assign} was already assigned. Charger {charger_id} also selected this user (action index {action_index}). Ignoring second assignment.")
-            else:
-                # 所选动作索引可能不对应任何用户
-                logger.debug(f"Charger {charger_id} chose action index {action_index}, but no valid user found in its action map: {action_map}")
-
-        # --- 可选的应急分配逻辑 ---
-        # (如果需要，可以从原 app.py 复制粘贴应急分配逻辑到这里)
-        # if not decisions and active_count > 20: ...
-
-        if not decisions:
-            logger.warning("MARL action conversion resulted in zero assignments.")
-        else:
-            logger.info(f"Converted MARL actions to {len(decisions)} assignments.")
-        return decisions
\ No newline at end of file
+        return load_algorithm("marl").convert_actions_to_decisions(agent_actions, state, charger_action_maps)
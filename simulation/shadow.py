@@ -0,0 +1,122 @@
+# ev_charging_project/simulation/shadow.py
+# 无序充电影子仿真: 在独立进程中用相同的初始种群和随机种子运行一份 ChargingEnvironment,
+# 每一步都用 uncoordinated.schedule 调度, 与主仿真同步推进, 提供真实的无序基准指标。
+
+import copy
+import logging
+import multiprocessing
+import random
+
+logger = logging.getLogger(__name__)
+
+# 等待影子进程返回一步结果的超时时间 (秒)
+SHADOW_STEP_TIMEOUT = 120
+
+
+def _shadow_worker(conn, config, snapshot):
+    """影子进程主循环: 收到 "step" 后执行一步无序调度并返回该步的奖励"""
+    try:
+        from .environment import ChargingEnvironment
+        from algorithms import uncoordinated
+
+        # 直接从主仿真的快照构建 (不运行 reset 生成种群), 保证两边从同一个起点出发
+        env = ChargingEnvironment(config, snapshot=snapshot)
+    except Exception as e:
+        conn.send(("error", f"Shadow environment init failed: {e}"))
+        conn.close()
+        return
+
+    conn.send(("ready", None))
+    while True:
+        try:
+            command = conn.recv()
+        except EOFError:
+            break
+        if command != "step":
+            break
+        try:
+            state = env.get_current_state()
+            decisions = uncoordinated.schedule(state)
+            rewards, _, done = env.step(decisions)
+            conn.send(("ok", rewards))
+        except Exception as e:
+            conn.send(("error", str(e)))
+    conn.close()
+
+
+class ShadowBaseline:
+    """
+    在后台进程中运行的无序充电对照仿真。
+
+    用法: 主仿真每步开始时调用 request_step(), 在计算奖励前调用 collect(),
+    两个仿真因此并行推进, 总耗时接近单次运行。
+    """
+
+    def __init__(self, config, env):
+        """
+        Args:
+            config (dict): 全局配置 (会复制一份并关闭影子环境自身的基准计算)
+            env (ChargingEnvironment): 主仿真环境, 以其当前的用户/充电桩/电网状态作为影子的起点,
+                并沿用其 reset 后的随机数状态
+        """
+        shadow_config = copy.deepcopy(config)
+        shadow_env_config = shadow_config.setdefault("environment", {})
+        shadow_env_config["enable_uncoordinated_baseline"] = False
+        shadow_env_config["uncoordinated_baseline_mode"] = "estimate"
+
+        snapshot = {
+            "time_step_minutes": env.time_step_minutes,
+            "users": copy.deepcopy(env.users),
+            "chargers": copy.deepcopy(env.chargers),
+            "current_time": env.current_time,
+            "start_time": env.start_time,
+            "grid_status": copy.deepcopy(env.grid_simulator.grid_status),
+            "history": [],
+            "completed_charging_sessions": [],
+            "random_state": getattr(env, "_reset_random_state", None) or random.getstate(),
+        }
+
+        self._conn, child_conn = multiprocessing.Pipe()
+        self._process = multiprocessing.Process(
+            target=_shadow_worker, args=(child_conn, shadow_config, snapshot), daemon=True
+        )
+        self._process.start()
+        child_conn.close()
+        self._pending = False
+
+        status, payload = self._recv()
+        if status != "ready":
+            self.close()
+            raise RuntimeError(payload)
+        logger.info(f"Uncoordinated shadow simulation started (pid={self._process.pid}).")
+
+    def _recv(self):
+        if not self._conn.poll(SHADOW_STEP_TIMEOUT):
+            raise RuntimeError("Shadow simulation did not respond in time.")
+        return self._conn.recv()
+
+    def request_step(self):
+        """通知影子进程推进一步 (不阻塞)"""
+        self._conn.send("step")
+        self._pending = True
+
+    def collect(self):
+        """等待并返回影子进程本步的奖励字典"""
+        if not self._pending:
+            return None
+        self._pending = False
+        status, payload = self._recv()
+        if status != "ok":
+            raise RuntimeError(payload)
+        return payload
+
+    def close(self):
+        """结束影子进程"""
+        try:
+            self._conn.send("close")
+        except (OSError, ValueError):
+            pass
+        self._conn.close()
+        self._process.join(timeout=5)
+        if self._process.is_alive():
+            self._process.terminate()
@@ -0,0 +1,348 @@
+# ev_charging_project/simulation/sharding.py
+# 多区域分片仿真: 按经度把地图划分为 shard_count 个区域 (按用户数均分), 每个区域的用户、充电桩和调度
+# 在独立的工作进程中推进; 协调进程只负责
+#   1. 跨区流量: 用户被调度到其他区域的充电桩时, 连同决策一起迁移到该充电桩所在的分片;
+#   2. 边界充电桩: 每个分片能看到邻近区域 shard_halo_km 内的充电桩 (只读副本, 每步同步状态), 可以跨区调度;
+#   3. 电网: 各分片的 EV 负载汇总到唯一的 GridModel, 奖励由各分片的可加汇总量统一计算。
+#
+# 每步两轮消息: decide (各分片并行调度, 返回迁出用户) -> advance (收到迁入用户后并行模拟用户和充电桩)。
+# 分片使用各自的随机数流 (由 random_seed 和分片编号派生), 因此结果与单进程仿真不逐位相同。
+# 不支持影子无序基准 (使用公式估算) 和检查点。
+#
+# 分片进程在第一次 reset() (或 step/get_current_state) 时才启动。step 默认 (shard_gather_state 为 False)
+# 只返回时间、电网状态和历史; 设为 True 时每步都通过管道把所有用户和充电桩 pickle 回协调进程,
+# 城市规模下这部分开销会抵消大部分分片收益, 只在 UI 需要逐步的完整实体列表时开启。
+
+import copy
+import logging
+import multiprocessing
+import random
+from datetime import timedelta
+
+import numpy as np
+
+from .grid_model import GridModel
+from .metrics import calculate_rewards, summarize_entities, merge_summaries
+from .utils import KM_PER_DEGREE
+
+logger = logging.getLogger(__name__)
+
+SHARD_REPLY_TIMEOUT = 300 # 等待分片进程回复的超时时间 (秒)
+CHARGER_SYNC_KEYS = ("status", "current_user", "queue") # 边界充电桩每步同步的字段
+
+
+def partition_by_longitude(users, chargers, shard_count, halo_km):
+    """
+    按用户经度分位数把地图切成 shard_count 条经度带, 同一充电站的充电桩总是分到同一分片。
+
+    Returns:
+        tuple: (user_shards, charger_shards, ghost_ids)
+               user_shards / charger_shards: id -> 分片编号
+               ghost_ids: 每个分片可见的其他分片充电桩 id 列表
+    """
+    user_ids = list(users)
+    user_lng = np.array([users[uid].get("current_position", {}).get("lng", np.nan) for uid in user_ids], dtype=np.float64)
+    valid_lng = user_lng[np.isfinite(user_lng)]
+    if valid_lng.size == 0:
+        valid_lng = np.array([0.0])
+    edges = np.quantile(valid_lng, np.linspace(0, 1, shard_count + 1)[1:-1]) # shard_count - 1 个内部边界
+
+    user_shards = dict(zip(user_ids, np.searchsorted(edges, np.nan_to_num(user_lng, nan=float(np.median(valid_lng)))).tolist()))
+
+    station_lng = {}
+    for charger in chargers.values():
+        station_lng.setdefault(charger.get("location"), charger.get("position", {}).get("lng", 0.0))
+    charger_lng = {cid: station_lng[c.get("location")] for cid, c in chargers.items()}
+    charger_shards = {cid: int(np.searchsorted(edges, lng)) for cid, lng in charger_lng.items()}
+
+    halo_deg = halo_km / KM_PER_DEGREE
+    bounds = np.r_[-np.inf, edges, np.inf]
+    ghost_ids = [[] for _ in range(shard_count)]
+    for cid, lng in charger_lng.items():
+        owner = charger_shards[cid]
+        for shard in range(shard_count):
+            if shard != owner and bounds[shard] - halo_deg <= lng <= bounds[shard + 1] + halo_deg:
+                ghost_ids[shard].append(cid)
+    return user_shards, charger_shards, ghost_ids
+
+
+def _shard_worker(conn, config, shard_id, snapshot, ghosts):
+    """分片进程主循环"""
+    try:
+        from .environment import ChargingEnvironment
+        from .scheduler import ChargingScheduler
+        from .hot_logging import flush_hot_logs
+
+        env = ChargingEnvironment(config, snapshot=snapshot)
+        scheduler = ChargingScheduler(config)
+        scheduler.load_q_tables()
+    except Exception as e:
+        conn.send(("error", f"Shard {shard_id} init failed: {e}"))
+        conn.close()
+        return
+
+    conn.send(("ready", None))
+    local_decisions = {}
+    while True:
+        try:
+            command, payload = conn.recv()
+        except EOFError:
+            break
+        try:
+            if command == "decide":
+                env.grid_simulator.grid_status = payload["grid_status"]
+                for cid, fields in payload["ghost_updates"].items():
+                    ghosts[cid].update(fields)
+                env.mark_state_changed()
+                decisions = payload["decisions"]
+                if decisions is None:
+                    state = env.get_current_state()
+                    state["chargers"] = state["chargers"] + list(ghosts.values())
+                    state.pop("state_version", None) # 含边界充电桩, 不是分片环境自身的状态
+                    decisions = scheduler.make_scheduling_decision(state)
+                # 调度到边界充电桩的用户迁出到其所在分片 (与 advance_entities 应用决策的条件一致)
+                local_decisions = {}
+                outbound = []
+                for user_id, charger_id in decisions.items():
+                    user = env.users.get(user_id)
+                    if user is None:
+                        continue
+                    if charger_id in env.chargers:
+                        local_decisions[user_id] = charger_id
+                    elif charger_id in ghosts and user.get("status") not in ("charging", "waiting"):
+                        outbound.append((env.users.pop(user_id), charger_id))
+                conn.send(("ok", {"outbound": outbound, "stats": scheduler.last_decision_stats}))
+
+            elif command == "advance":
+                env.current_time = payload["current_time"]
+                for user, charger_id in payload["inbound"]:
+                    env.users[user["user_id"]] = user
+                    local_decisions[user["user_id"]] = charger_id
+                total_ev_load, completed_sessions = env.advance_entities(local_decisions)
+                local_decisions = {}
+                flush_hot_logs(f"Shard {shard_id} {env.current_time:%Y-%m-%d %H:%M} events")
+                conn.send(("ok", {
+                    "ev_load": total_ev_load,
+                    "completed_sessions": completed_sessions,
+                    "summary": summarize_entities(env.users.values(), env.chargers.values()),
+                    "charger_updates": {cid: {key: copy.copy(env.chargers[cid].get(key)) for key in CHARGER_SYNC_KEYS}
+                                        for cid in payload["exported_ids"]},
+                }))
+
+            elif command == "state":
+                conn.send(("ok", {"users": list(env.users.values()), "chargers": list(env.chargers.values())}))
+            else:
+                break
+        except Exception as e:
+            logger.error(f"Shard {shard_id} failed on '{command}': {e}", exc_info=True)
+            conn.send(("error", f"Shard {shard_id}: {e}"))
+    scheduler.close()
+    conn.close()
+
+
+def _merge_decision_stats(shard_stats):
+    """分片并行调度: 本步调度耗时取最慢分片, 各项计数求和"""
+    merged = {}
+    for stats in shard_stats:
+        for key, value in stats.items():
+            if key == "decision_time_ms":
+                merged[key] = max(merged.get(key, 0.0), value)
+            elif isinstance(value, bool):
+                merged[key] = merged.get(key, False) or value
+            else:
+                merged[key] = merged.get(key, 0) + value
+    return merged
+
+
+class ShardedEnvironment:
+    """
+    按区域分片、多进程推进的充电仿真, 接口与 ChargingEnvironment 的 reset / step / get_current_state 对应。
+
+    step(None) 时每个分片用自己的 ChargingScheduler 调度 (schedules_in_shards 为 True);
+    传入 {user_id: charger_id} 时按用户所在分片转发这些决策, 分片内不再调度。
+    """
+
+    schedules_in_shards = True
+
+    def __init__(self, config):
+        self.config = config
+        self.env_config = config.get("environment", {})
+        self.shard_count = max(1, int(self.env_config.get("shard_count", 1)))
+        self.halo_km = self.env_config.get("shard_halo_km", 3.0)
+        self.gather_state = self.env_config.get("shard_gather_state", False)
+        self.time_step_minutes = self.env_config.get("time_step_minutes", 15)
+        self.simulation_days = self.env_config.get("simulation_days", 7)
+        self.grid_simulator = GridModel(config)
+        self._shards = []
+        self.start_time = None
+        self.current_time = None
+        self.history = []
+        self.last_step_stats = {}
+        self.last_decision_stats = {} # 各分片调度统计的合并 (耗时取最大值, 计数求和)
+
+    def reset(self):
+        """生成完整种群, 按区域切分并 (重新) 启动分片进程"""
+        from .environment import ChargingEnvironment
+
+        self.close()
+        # 分片内不运行影子基准; 奖励在协调进程中使用公式估算的基准
+        shard_config = copy.deepcopy(self.config)
+        shard_config.setdefault("environment", {})["uncoordinated_baseline_mode"] = "estimate"
+        shard_config["environment"]["enable_uncoordinated_baseline"] = False
+
+        template = ChargingEnvironment(shard_config)
+        self.start_time = template.start_time
+        self.current_time = template.current_time
+        self.grid_simulator.reset()
+        self.history = []
+        self.completed_charging_sessions = []
+        users, chargers = template.users, template.chargers
+
+        self._user_shards, self._charger_shards, ghost_ids = partition_by_longitude(users, chargers, self.shard_count, self.halo_km)
+        self._ghost_ids = ghost_ids
+        # 每个分片需要导出的充电桩: 在其他任何分片中作为边界充电桩出现的本分片充电桩
+        self._exported_ids = [[] for _ in range(self.shard_count)]
+        for cid in sorted({cid for ids in ghost_ids for cid in ids}):
+            self._exported_ids[self._charger_shards[cid]].append(cid)
+        self._charger_updates = {}
+
+        seed = self.env_config.get("random_seed")
+        base_seed = seed if seed is not None else random.getrandbits(32)
+        for shard_id in range(self.shard_count):
+            snapshot = {
+                "time_step_minutes": self.time_step_minutes,
+                "current_time": self.current_time,
+                "start_time": self.start_time,
+                "users": {uid: u for uid, u in users.items() if self._user_shards[uid] == shard_id},
+                "chargers": {cid: c for cid, c in chargers.items() if self._charger_shards[cid] == shard_id},
+                "grid_status": copy.deepcopy(self.grid_simulator.grid_status),
+                "history": [],
+                "completed_charging_sessions": [],
+                "random_state": random.Random(f"{base_seed}-shard-{shard_id}").getstate(),
+            }
+            ghosts = {cid: copy.deepcopy(chargers[cid]) for cid in ghost_ids[shard_id]}
+            conn, child_conn = multiprocessing.Pipe()
+            process = multiprocessing.Process(target=_shard_worker, args=(child_conn, shard_config, shard_id, snapshot, ghosts), daemon=True)
+            process.start()
+            child_conn.close()
+            self._shards.append((conn, process))
+            logger.info(f"Shard {shard_id} started (pid={process.pid}): {len(snapshot['users'])} users, "
+                        f"{len(snapshot['chargers'])} chargers, {len(ghosts)} border chargers.")
+        for shard_id in range(self.shard_count):
+            self._recv(shard_id)
+        return self.get_current_state()
+
+    def _recv(self, shard_id):
+        conn = self._shards[shard_id][0]
+        if not conn.poll(SHARD_REPLY_TIMEOUT):
+            raise RuntimeError(f"Shard {shard_id} did not respond in time.")
+        status, payload = conn.recv()
+        if status not in ("ok", "ready"):
+            raise RuntimeError(payload)
+        return payload
+
+    def _broadcast(self, command, payloads):
+        """向每个分片发送一条命令 (先全部发送再依次接收, 各分片并行处理)"""
+        for (conn, _), payload in zip(self._shards, payloads):
+            conn.send((command, payload))
+        return [self._recv(shard_id) for shard_id in range(self.shard_count)]
+
+    def step(self, decisions=None):
+        """
+        推进一个时间步。
+
+        Args:
+            decisions (dict): None 表示各分片自行调度; 否则为集中调度的决策 {user_id: charger_id}
+
+        Returns:
+            tuple: (rewards, state, done); gather_state 为 False 时 state 不含 users/chargers
+        """
+        if not self._shards:
+            self.reset()
+        grid_status = self.grid_simulator.get_status()
+        shard_decisions = [None] * self.shard_count
+        if decisions is not None:
+            shard_decisions = [{} for _ in range(self.shard_count)]
+            for user_id, charger_id in decisions.items():
+                if user_id in self._user_shards:
+                    shard_decisions[self._user_shards[user_id]][user_id] = charger_id
+
+        # 1. 各分片并行调度, 收集跨区迁移的用户
+        replies = self._broadcast("decide", [
+            {"grid_status": grid_status, "decisions": shard_decisions[shard_id],
+             "ghost_updates": {cid: self._charger_updates[cid] for cid in self._ghost_ids[shard_id] if cid in self._charger_updates}}
+            for shard_id in range(self.shard_count)])
+        self.last_decision_stats = _merge_decision_stats(reply["stats"] for reply in replies)
+        inbound = [[] for _ in range(self.shard_count)]
+        migrated = 0
+        for reply in replies:
+            for user, charger_id in reply["outbound"]:
+                target_shard = self._charger_shards[charger_id]
+                inbound[target_shard].append((user, charger_id))
+                self._user_shards[user["user_id"]] = target_shard
+                migrated += 1
+
+        # 2. 各分片并行模拟用户和充电桩
+        replies = self._broadcast("advance", [
+            {"current_time": self.current_time, "inbound": inbound[shard_id], "exported_ids": self._exported_ids[shard_id]}
+            for shard_id in range(self.shard_count)])
+        total_ev_load = sum(reply["ev_load"] for reply in replies)
+        self._charger_updates = {}
+        for reply in replies:
+            self._charger_updates.update(reply["charger_updates"])
+            self.completed_charging_sessions.extend(reply["completed_sessions"])
+
+        # 3. 汇总负载到唯一的电网模型, 前进时间并计算全局奖励
+        self.grid_simulator.update_step(self.current_time, total_ev_load)
+        self.current_time += timedelta(minutes=self.time_step_minutes)
+        summary = merge_summaries(reply["summary"] for reply in replies)
+        grid_status = self.grid_simulator.get_status()
+        rewards = calculate_rewards({"timestamp": self.current_time.isoformat(), "grid_status": grid_status},
+                                    self.config, summary=summary)
+        self._save_history(grid_status, rewards)
+        self.last_step_stats = {"migrated_users": migrated, "ev_load": total_ev_load,
+                                "users_per_shard": [reply["summary"]["user_count"] for reply in replies]}
+
+        elapsed_minutes = (self.current_time - self.start_time).total_seconds() / 60
+        done = elapsed_minutes >= self.simulation_days * 24 * 60 - self.time_step_minutes / 2
+        state = self.get_current_state() if self.gather_state else self._light_state(grid_status)
+        return rewards, state, done
+
+    def _light_state(self, grid_status):
+        return {"timestamp": self.current_time.isoformat(), "users": [], "chargers": [], "grid_status": grid_status,
+                "history": self.history[-96:]}
+
+    def get_current_state(self):
+        """从所有分片收集完整状态 (用户和充电桩列表), 格式与 ChargingEnvironment.get_current_state 相同"""
+        if not self._shards:
+            return self.reset()
+        state = self._light_state(self.grid_simulator.get_status())
+        for reply in self._broadcast("state", [None] * self.shard_count):
+            state["users"].extend(reply["users"])
+            state["chargers"].extend(reply["chargers"])
+        return state
+
+    def _save_history(self, grid_status, rewards):
+        """与 ChargingEnvironment._save_current_state 相同的历史记录格式"""
+        self.history.append({
+            "timestamp": self.current_time.isoformat(),
+            "grid_status": {key: grid_status.get(key) for key in
+                            ("grid_load_percentage", "current_ev_load", "current_total_load", "renewable_ratio", "current_price")},
+            "rewards": rewards,
+        })
+        max_history_points = 48 * (60 // self.time_step_minutes)
+        if len(self.history) > max_history_points:
+            self.history = self.history[-max_history_points:]
+
+    def close(self):
+        """结束所有分片进程"""
+        for conn, process in self._shards:
+            try:
+                conn.send(("close", None))
+            except (OSError, ValueError):
+                pass
+            conn.close()
+            process.join(timeout=5)
+            if process.is_alive():
+                process.terminate()
+        self._shards = []
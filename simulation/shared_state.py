@@ -0,0 +1,300 @@
+# ev_charging_project/simulation/shared_state.py
+# 共享内存列式状态: 仿真进程每步把用户/充电桩的关键字段按列写入 multiprocessing.shared_memory,
+# 其他进程 (Flask UI、分析、独立的调度进程) 按名字映射同一块内存, 直接以 numpy 视图读取, 无需序列化。
+#
+# 布局: 头部 + 两个数据槽 (双缓冲)。发布者总是写入非活动槽, 写完后切换活动槽:
+#   槽序号 (seq) 是顺序锁: 写入前置为奇数, 写完置为偶数 (单调递增);
+#   读者取活动槽并记下 seq, 读完后 valid() 检查 seq 未变, 否则重试。
+# 读者拿到的视图在发布者再写入同一个槽之前 (即下一次发布完成之前) 保持一致; 需要长期持有时用 read_copy()。
+# 发布者关闭时在头部置 closed 标志: 同名的新内存块是另一块内存, 仍映射旧块的读者据此得知该块已停止更新,
+# read() 抛出 RuntimeError, 需要按名字重新创建 SharedStateReader。
+# 只支持一个发布者进程; 读写顺序依赖 x86/ARM 上 Python 对共享内存的逐次写入, 不做额外的内存屏障。
+
+import logging
+import struct
+import weakref
+from datetime import datetime
+from multiprocessing import shared_memory
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+SHARED_STATE_MAGIC = b"EVSHMST1"
+SHARED_STATE_VERSION = 2
+ID_WIDTH = 24 # user_id / charger_id 的最大字节数
+
+USER_STATUSES = ("idle", "traveling", "waiting", "charging", "post_charge")
+CHARGER_STATUSES = ("available", "occupied", "failure")
+CHARGER_TYPES = ("normal", "fast", "superfast")
+GRID_FIELDS = ("grid_load_percentage", "current_ev_load", "current_total_load", "current_base_load",
+               "renewable_ratio", "current_price")
+
+# 列定义: (列名, dtype); 状态/类型为编码 (未知为 -1), 引用为对方数组中的下标 (无为 -1)
+USER_COLUMNS = (
+    ("user_id", f"S{ID_WIDTH}"),
+    ("soc", np.float64),
+    ("lat", np.float64),
+    ("lng", np.float64),
+    ("battery_capacity", np.float32),
+    ("max_charging_power", np.float32),
+    ("travel_speed", np.float32),
+    ("status", np.int8),
+    ("needs_charge_decision", np.bool_),
+    ("target_charger", np.int32),
+)
+CHARGER_COLUMNS = (
+    ("charger_id", f"S{ID_WIDTH}"),
+    ("lat", np.float64),
+    ("lng", np.float64),
+    ("max_power", np.float32),
+    ("price_multiplier", np.float32),
+    ("daily_revenue", np.float64),
+    ("daily_energy", np.float64),
+    ("status", np.int8),
+    ("type", np.int8),
+    ("current_user", np.int32),
+    ("queue_length", np.int16),
+)
+
+# 头部: 魔数, 格式版本, 用户容量, 充电桩容量, closed 标志, 活动槽
+_HEADER = struct.Struct("<8sIIIII")
+_CLOSED_OFFSET = _HEADER.size - 8
+_ACTIVE_OFFSET = _HEADER.size - 4
+# 每个槽的元数据: seq, 用户数, 充电桩数, 仿真时间 (POSIX 时间戳), 电网字段
+_SLOT_META = struct.Struct(f"<QIId{len(GRID_FIELDS)}d")
+_ALIGN = 64
+
+
+def _align(offset):
+    return (offset + _ALIGN - 1) // _ALIGN * _ALIGN
+
+
+def _layout(user_capacity, charger_capacity):
+    """计算两个槽的元数据偏移和每列的 (偏移, dtype), 返回 (slots, total_size)"""
+    offset = _align(_HEADER.size)
+    slots = []
+    for _ in range(2):
+        slot = {"meta": offset, "users": {}, "chargers": {}}
+        offset = _align(offset + _SLOT_META.size)
+        for group, columns, capacity in (("users", USER_COLUMNS, user_capacity), ("chargers", CHARGER_COLUMNS, charger_capacity)):
+            for column, dtype in columns:
+                dtype = np.dtype(dtype)
+                slot[group][column] = (offset, dtype)
+                offset = _align(offset + dtype.itemsize * max(1, capacity))
+        slots.append(slot)
+    return slots, offset
+
+
+def _column_views(buf, slot, group, capacity):
+    # frombuffer 持有 buf 的导出引用: 视图存活时 shm.close() 抛出 BufferError, 而不是解除映射后留下悬空视图
+    return {column: np.frombuffer(buf, dtype=dtype, count=capacity, offset=offset)
+            for column, (offset, dtype) in slot[group].items()}
+
+
+def _codes(values, vocabulary):
+    lookup = {value: code for code, value in enumerate(vocabulary)}
+    return np.fromiter((lookup.get(v, -1) for v in values), dtype=np.int8, count=len(values))
+
+
+class SharedStatePublisher:
+    """在仿真进程中创建共享内存块并每步发布一次列式状态"""
+
+    def __init__(self, user_capacity, charger_capacity, name=None):
+        self.user_capacity = int(user_capacity)
+        self.charger_capacity = int(charger_capacity)
+        self._slots, size = _layout(self.user_capacity, self.charger_capacity)
+        self.shm = shared_memory.SharedMemory(name=name, create=True, size=size)
+        self.name = self.shm.name
+        _HEADER.pack_into(self.shm.buf, 0, SHARED_STATE_MAGIC, SHARED_STATE_VERSION, self.user_capacity, self.charger_capacity, 0, 0)
+        for slot in self._slots:
+            _SLOT_META.pack_into(self.shm.buf, slot["meta"], 0, 0, 0, 0.0, *([0.0] * len(GRID_FIELDS)))
+        self._views = [(_column_views(self.shm.buf, slot, "users", self.user_capacity),
+                        _column_views(self.shm.buf, slot, "chargers", self.charger_capacity)) for slot in self._slots]
+        self._seq = 0
+        self._active = 0
+        logger.info(f"Shared state block '{self.name}' created ({size / 1e6:.2f} MB, {self.user_capacity} users, {self.charger_capacity} chargers).")
+
+    def publish(self, users, chargers, grid_status, current_time):
+        """
+        把 users / chargers (id -> 字典) 和电网状态写入非活动槽并切换为活动槽。
+
+        Returns:
+            int: 本次发布的序号 (偶数, 单调递增)
+        """
+        n_users, n_chargers = len(users), len(chargers)
+        if n_users > self.user_capacity or n_chargers > self.charger_capacity:
+            raise ValueError(f"Shared state capacity exceeded: {n_users}/{self.user_capacity} users, {n_chargers}/{self.charger_capacity} chargers")
+        slot_index = 1 - self._active
+        slot = self._slots[slot_index]
+        user_cols, charger_cols = self._views[slot_index]
+        user_index = {uid: i for i, uid in enumerate(users)}
+        charger_index = {cid: i for i, cid in enumerate(chargers)}
+        user_list = list(users.values())
+        charger_list = list(chargers.values())
+
+        self._seq += 1 # 奇数: 写入中
+        struct.pack_into("<Q", self.shm.buf, slot["meta"], self._seq)
+
+        user_cols["user_id"][:n_users] = [str(uid).encode("utf-8")[:ID_WIDTH] for uid in users]
+        user_cols["soc"][:n_users] = [u.get("soc", 0) for u in user_list]
+        user_cols["lat"][:n_users] = [u.get("current_position", {}).get("lat", np.nan) for u in user_list]
+        user_cols["lng"][:n_users] = [u.get("current_position", {}).get("lng", np.nan) for u in user_list]
+        user_cols["battery_capacity"][:n_users] = [u.get("battery_capacity", 60) for u in user_list]
+        user_cols["max_charging_power"][:n_users] = [u.get("max_charging_power", 60) for u in user_list]
+        user_cols["travel_speed"][:n_users] = [u.get("travel_speed", 45) for u in user_list]
+        user_cols["status"][:n_users] = _codes([u.get("status") for u in user_list], USER_STATUSES)
+        user_cols["needs_charge_decision"][:n_users] = [bool(u.get("needs_charge_decision")) for u in user_list]
+        user_cols["target_charger"][:n_users] = [charger_index.get(u.get("target_charger"), -1) for u in user_list]
+
+        charger_cols["charger_id"][:n_chargers] = [str(cid).encode("utf-8")[:ID_WIDTH] for cid in chargers]
+        charger_cols["lat"][:n_chargers] = [c.get("position", {}).get("lat", np.nan) for c in charger_list]
+        charger_cols["lng"][:n_chargers] = [c.get("position", {}).get("lng", np.nan) for c in charger_list]
+        charger_cols["max_power"][:n_chargers] = [c.get("max_power", 0) for c in charger_list]
+        charger_cols["price_multiplier"][:n_chargers] = [c.get("price_multiplier", 1.0) for c in charger_list]
+        charger_cols["daily_revenue"][:n_chargers] = [c.get("daily_revenue", 0.0) for c in charger_list]
+        charger_cols["daily_energy"][:n_chargers] = [c.get("daily_energy", 0.0) for c in charger_list]
+        charger_cols["status"][:n_chargers] = _codes([c.get("status") for c in charger_list], CHARGER_STATUSES)
+        charger_cols["type"][:n_chargers] = _codes([c.get("type") for c in charger_list], CHARGER_TYPES)
+        charger_cols["current_user"][:n_chargers] = [user_index.get(c.get("current_user"), -1) for c in charger_list]
+        charger_cols["queue_length"][:n_chargers] = [len(c.get("queue") or []) for c in charger_list]
+
+        _SLOT_META.pack_into(self.shm.buf, slot["meta"], self._seq, n_users, n_chargers, current_time.timestamp(),
+                             *(float(grid_status.get(field) or 0.0) for field in GRID_FIELDS))
+        self._seq += 1 # 偶数: 写入完成 (最后写 seq, 读者据此确认元数据和列都已写完)
+        struct.pack_into("<Q", self.shm.buf, slot["meta"], self._seq)
+        self._active = slot_index
+        struct.pack_into("<I", self.shm.buf, _ACTIVE_OFFSET, slot_index)
+        return self._seq
+
+    @property
+    def version(self):
+        """最近一次发布的序号"""
+        return self._seq
+
+    def close(self, unlink=True):
+        """置 closed 标志 (通知仍映射该块的读者) 并释放共享内存 (发布者负责 unlink)"""
+        self._views = []
+        struct.pack_into("<I", self.shm.buf, _CLOSED_OFFSET, 1)
+        self.shm.close()
+        if unlink:
+            try:
+                self.shm.unlink()
+            except FileNotFoundError:
+                pass
+
+
+class SharedStateSnapshot:
+    """一次读取得到的一致快照: 各列为共享内存上的 numpy 视图 (只读)"""
+
+    def __init__(self, reader, slot_index, seq, n_users, n_chargers, timestamp, grid):
+        self._reader = reader
+        self._slot_index = slot_index
+        self.version = seq
+        self.timestamp = datetime.fromtimestamp(timestamp)
+        self.grid = grid
+        user_views, charger_views = reader._views[slot_index]
+        self.users = {column: view[:n_users] for column, view in user_views.items()}
+        self.chargers = {column: view[:n_chargers] for column, view in charger_views.items()}
+
+    def valid(self):
+        """读完后调用: 数据在读取期间未被覆盖时返回 True (读者或内存块已关闭时无法确认, 返回 False)"""
+        return self._reader._slot_seq(self._slot_index) == self.version
+
+    def copy(self):
+        """复制为进程私有数组 (复制后仍需 valid() 确认)"""
+        self.users = {column: view.copy() for column, view in self.users.items()}
+        self.chargers = {column: view.copy() for column, view in self.chargers.items()}
+        return self
+
+
+class SharedStateReader:
+    """
+    在其他进程中按名字映射共享状态块 (不复制数据)。
+
+    close() 时仍存活的快照被转为私有副本, 以释放它们对共享内存的引用; 调用方自己保存的列视图
+    (如 snapshot.users["soc"]) 仍会阻止解除映射, 此时只记录警告并保留映射, 不会留下悬空视图。
+    """
+
+    def __init__(self, name):
+        try:
+            self.shm = shared_memory.SharedMemory(name=name, track=False)
+        except TypeError: # Python < 3.13: 映射时不向 resource_tracker 登记, 否则读者进程退出时会删除发布者的内存块
+            from multiprocessing import resource_tracker
+            register = resource_tracker.register
+            resource_tracker.register = lambda name, rtype: None
+            try:
+                self.shm = shared_memory.SharedMemory(name=name)
+            finally:
+                resource_tracker.register = register
+        magic, version, user_capacity, charger_capacity, _, _ = _HEADER.unpack_from(self.shm.buf, 0)
+        if magic != SHARED_STATE_MAGIC:
+            raise ValueError(f"Shared memory block '{name}' is not an environment state block")
+        if version != SHARED_STATE_VERSION:
+            raise ValueError(f"Shared state version {version} is not supported (expected {SHARED_STATE_VERSION})")
+        self.name = name
+        self._snapshots = weakref.WeakSet() # 尚存活的零拷贝快照, close() 时转为副本
+        self._slots, _ = _layout(user_capacity, charger_capacity)
+        self._views = [(_column_views(self.shm.buf, slot, "users", user_capacity),
+                        _column_views(self.shm.buf, slot, "chargers", charger_capacity)) for slot in self._slots]
+        for user_views, charger_views in self._views:
+            for view in list(user_views.values()) + list(charger_views.values()):
+                view.flags.writeable = False
+
+    @property
+    def closed(self):
+        """读者已关闭, 或发布者已关闭该内存块 (之后不会再有新的发布)"""
+        return self.shm.buf is None or struct.unpack_from("<I", self.shm.buf, _CLOSED_OFFSET)[0] != 0
+
+    def _slot_seq(self, slot_index):
+        if self.closed:
+            return None
+        return struct.unpack_from("<Q", self.shm.buf, self._slots[slot_index]["meta"])[0]
+
+    def read(self, max_retries=100):
+        """
+        返回最新发布的快照 (零拷贝视图)。尚未发布过时返回 None。
+
+        读取方处理完数据后应调用 snapshot.valid(); 返回 False 表示期间被覆盖, 需要重新 read()。
+        内存块已被发布者关闭 (环境重建或仿真结束) 时抛出 RuntimeError。
+        """
+        for _ in range(max_retries):
+            if self.closed:
+                raise RuntimeError(f"Shared state block '{self.name}' has been closed; reconnect by name for a new block")
+            slot_index = struct.unpack_from("<I", self.shm.buf, _ACTIVE_OFFSET)[0]
+            seq = self._slot_seq(slot_index)
+            if seq == 0:
+                return None
+            if seq % 2 == 1:
+                continue
+            _, n_users, n_chargers, timestamp, *grid_values = _SLOT_META.unpack_from(self.shm.buf, self._slots[slot_index]["meta"])
+            snapshot = SharedStateSnapshot(self, slot_index, seq, n_users, n_chargers, timestamp, dict(zip(GRID_FIELDS, grid_values)))
+            if snapshot.valid():
+                self._snapshots.add(snapshot)
+                return snapshot
+        raise RuntimeError(f"Could not read a consistent snapshot from '{self.name}' after {max_retries} attempts")
+
+    def read_copy(self, max_retries=100):
+        """返回最新快照的私有副本, 保证复制结果一致"""
+        for _ in range(max_retries):
+            snapshot = self.read(max_retries)
+            if snapshot is None:
+                return None
+            snapshot.copy()
+            if snapshot.valid():
+                return snapshot
+        raise RuntimeError(f"Could not copy a consistent snapshot from '{self.name}' after {max_retries} attempts")
+
+    def close(self):
+        """释放映射: 先把存活的快照转为私有副本并丢弃自身的视图, 再关闭共享内存"""
+        if self.shm.buf is None:
+            return
+        for snapshot in list(self._snapshots):
+            snapshot.copy()
+        self._snapshots = weakref.WeakSet()
+        self._views = []
+        try:
+            self.shm.close()
+        except BufferError:
+            logger.warning(f"Shared state block '{self.name}' is still referenced by column views held outside "
+                           f"of a snapshot; keeping it mapped.")
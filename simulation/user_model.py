@@ -4,8 +4,10 @@ import math
 from datetime import datetime, timedelta
 import logging
 from .utils import calculate_distance, get_random_location # 使用相对导入
+from .hot_logging import get_hot_log
 
 logger = logging.getLogger(__name__)
+hot_log = get_hot_log(logger) # 逐用户事件: 计数 + 限速采样
 
 def simulate_step(users, chargers, current_time, time_step_minutes, config):
     """
@@ -30,7 +32,7 @@ def simulate_step(users, chargers, current_time, time_step_minutes, config):
 
     for user_id, user in list(users.items()): # 使用 list(users.items()) 允许在循环中删除用户（如果需要）
         if not isinstance(user, dict):
-            logger.warning(f"Invalid user data found for ID {user_id}. Skipping.")
+            hot_log.event("invalid_user", logging.WARNING, "Invalid user data found for ID %s. Skipping.", user_id)
             continue
 
         current_soc = user.get("soc", 0)
@@ -45,7 +47,7 @@ def simulate_step(users, chargers, current_time, time_step_minutes, config):
             if user["post_charge_timer"] > 0:
                 user["post_charge_timer"] -= 1
             else:
-                logger.debug(f"User {user_id} post-charge timer expired. Assigning new random destination.")
+                hot_log.event("post_charge_expired", logging.DEBUG, "User %s post-charge timer expired. Assigning new random destination.", user_id)
                 new_destination = get_random_location(map_bounds)
                 while calculate_distance(user.get("current_position", {}), new_destination) < 0.1:
                      new_destination = get_random_location(map_bounds)
@@ -56,9 +58,9 @@ def simulate_step(users, chargers, current_time, time_step_minutes, config):
                 user["needs_charge_decision"] = False
                 user["last_destination_type"] = "random"
                 if plan_route_to_destination(user, new_destination, map_bounds):
-                    logger.debug(f"User {user_id} planned route to new random destination after charging.")
+                    hot_log.event("post_charge_route", logging.DEBUG, "User %s planned route to new random destination after charging.", user_id)
                 else:
-                    logger.warning(f"User {user_id} failed to plan route to new random destination. Setting idle.")
+                    hot_log.event("post_charge_route_failed", logging.WARNING, "User %s failed to plan route to new random destination. Setting idle.", user_id)
                     user["status"] = "idle"
                     user["destination"] = None
 
@@ -115,7 +117,7 @@ def simulate_step(users, chargers, current_time, time_step_minutes, config):
             # 强制充电检查
             elif current_soc <= config.get('environment',{}).get('force_charge_soc_threshold', 20.0):
                 user["needs_charge_decision"] = True
-                logger.debug(f"User {user_id} SOC critical ({current_soc:.1f}%), forcing charge need.")
+                hot_log.event("soc_critical", logging.DEBUG, "User %s SOC critical (%.1f%%), forcing charge need.", user_id, current_soc)
             else:
                 # 计算概率
                 charging_prob = calculate_charging_probability(user, current_time.hour, config)
@@ -147,13 +149,13 @@ def simulate_step(users, chargers, current_time, time_step_minutes, config):
         # 如果要模拟完全无序的行为，可以在 uncoordinated.py 中实现类似逻辑。
         # 这里我们只设置标志，让调度器决定。
         if user["needs_charge_decision"] and user_status in ["idle", "traveling"] and (user.get("last_destination_type") == "random" or user_status == "idle"):
-             logger.info(f"User {user_id} (SOC: {current_soc:.1f}%) flagged as needing charging decision.")
+             hot_log.event("needs_charge", logging.INFO, "User %s (SOC: %.1f%%) flagged as needing charging decision.", user_id, current_soc)
              # 停止当前随机行程 (如果适用)
              if user_status == "traveling":
                   user["status"] = "idle" # 停止旅行，等待调度
                   user["destination"] = None
                   user["route"] = None
-                  logger.debug(f"User {user_id} stopped random travel to wait for charge decision.")
+                  hot_log.event("travel_stopped", logging.DEBUG, "User %s stopped random travel to wait for charge decision.", user_id)
 
 
         # --- 移动模拟 ---
@@ -199,7 +201,7 @@ def simulate_step(users, chargers, current_time, time_step_minutes, config):
 
             # 检查是否到达
             if has_reached_destination(user):
-                 logger.debug(f"User {user_id} arrived at destination {user['destination']}.")
+                 hot_log.event("arrived", logging.DEBUG, "User %s arrived at destination %s.", user_id, user['destination'])
                  user["current_position"] = user["destination"].copy()
                  user["time_to_destination"] = 0
                  user["route"] = None
@@ -208,19 +210,19 @@ def simulate_step(users, chargers, current_time, time_step_minutes, config):
                  last_dest_type = user.get("last_destination_type")
 
                  if target_charger_id:
-                      logger.info(f"User {user_id} arrived at target charger {target_charger_id}. Setting status to WAITING.")
+                      hot_log.event("arrived_at_charger", logging.INFO, "User %s arrived at target charger %s. Setting status to WAITING.", user_id, target_charger_id)
                       user["status"] = "waiting"
                       user["destination"] = None
                       user["arrival_time_at_charger"] = current_time # 记录到达时间
                       # 注意：加入队列的逻辑由 charger_model 或 environment 处理
                  # (处理其他到达情况 - Fallback 和随机目的地)
                  elif last_dest_type == "charger":
-                     logger.warning(f"User {user_id} arrived at target charger destination, but target_charger ID is None. Setting WAITING.")
+                     hot_log.event("arrived_without_target", logging.WARNING, "User %s arrived at target charger destination, but target_charger ID is None. Setting WAITING.", user_id)
                      user["status"] = "waiting"
                      user["destination"] = None
                      user["arrival_time_at_charger"] = current_time
                  else: # Arrived at random destination
-                     logger.info(f"User {user_id} reached random destination. Setting IDLE.")
+                     hot_log.event("reached_random_destination", logging.INFO, "User %s reached random destination. Setting IDLE.", user_id)
                      user["status"] = "idle"
                      user["destination"] = None
                      user["target_charger"] = None
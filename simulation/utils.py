@@ -2,6 +2,8 @@ import math
 import random
 import logging
 
+import numpy as np
+
 logger = logging.getLogger(__name__)
 
 def calculate_distance(pos1, pos2):
@@ -41,4 +43,138 @@ def get_random_location(map_bounds):
         return {"lat": lat, "lng": lng}
     except Exception as e:
         logger.error(f"Error generating random location: {e}. Using default fallback.", exc_info=True)
-        return {"lat": 30.75, "lng": 114.25}
\ No newline at end of file
+        return {"lat": 30.75, "lng": 114.25}
+
+# --- 批量距离计算 (NumPy) ---
+# 坐标数组约定: 形状为 (N, 2) 的浮点数组, 列顺序为 (lat, lng)。
+# 无效坐标用 NaN 表示, 对应的距离结果为 inf, 与 calculate_distance 的约定一致。
+
+EARTH_RADIUS_KM = 6371.0088
+KM_PER_DEGREE = 111  # 与 calculate_distance 使用的粗略换算保持一致
+EQUIRECT_MAX_SPAN_DEG = 1.0  # 地图跨度小于该值 (度) 时, auto 模式使用等距矩形近似
+DEFAULT_DISTANCE_CHUNK = 4096  # 分块模式下每块的行数
+
+DISTANCE_METHODS = ("planar", "equirectangular", "haversine", "auto")
+
+
+def positions_to_array(positions):
+    """
+    将位置字典列表转换为 (N, 2) 的 [lat, lng] 数组。
+
+    缺失或非数值的坐标会被置为 NaN, 在距离函数中得到 inf。
+    """
+    coords = np.full((len(positions), 2), np.nan, dtype=np.float64)
+    for i, pos in enumerate(positions):
+        if not isinstance(pos, dict):
+            continue
+        lat = pos.get('lat')
+        lng = pos.get('lng')
+        if isinstance(lat, (int, float)) and isinstance(lng, (int, float)):
+            coords[i, 0] = lat
+            coords[i, 1] = lng
+    return coords
+
+
+def entity_coords(entities, position_key):
+    """从实体字典列表 (users/chargers) 中提取坐标数组, 例如 entity_coords(chargers, "position")"""
+    return positions_to_array([e.get(position_key) if isinstance(e, dict) else None for e in entities])
+
+
+def resolve_distance_method(method, map_bounds=None):
+    """
+    解析距离计算方法。
+
+    'auto' 在地图跨度较小时 (如 0.05° 的仿真区域) 选择等距矩形近似,
+    否则使用 haversine。未提供 map_bounds 时 'auto' 退化为 haversine。
+    """
+    if method not in DISTANCE_METHODS:
+        raise ValueError(f"Unknown distance method '{method}'. Expected one of {DISTANCE_METHODS}.")
+    if method != "auto":
+        return method
+    if map_bounds and all(k in map_bounds for k in ['lat_min', 'lat_max', 'lng_min', 'lng_max']):
+        span = max(map_bounds['lat_max'] - map_bounds['lat_min'], map_bounds['lng_max'] - map_bounds['lng_min'])
+        if span <= EQUIRECT_MAX_SPAN_DEG:
+            return "equirectangular"
+    return "haversine"
+
+
+def _pairwise_block(a, b, method):
+    """计算 a (N, 2) 与 b (M, 2) 之间的 (N, M) 距离块 (km)"""
+    dlat = a[:, 0:1] - b[:, 0][np.newaxis, :]
+    dlng = a[:, 1:2] - b[:, 1][np.newaxis, :]
+    if method == "planar":
+        # 与 calculate_distance 完全一致: 欧几里得度数距离 * 111
+        dist = np.sqrt(dlat * dlat + dlng * dlng) * KM_PER_DEGREE
+    elif method == "equirectangular":
+        mean_lat = np.radians((a[:, 0:1] + b[:, 0][np.newaxis, :]) * 0.5)
+        x = np.radians(dlng) * np.cos(mean_lat)
+        y = np.radians(dlat)
+        dist = np.sqrt(x * x + y * y) * EARTH_RADIUS_KM
+    else:  # haversine
+        lat1 = np.radians(a[:, 0:1])
+        lat2 = np.radians(b[:, 0])[np.newaxis, :]
+        h = np.sin(np.radians(dlat) * 0.5) ** 2 + np.cos(lat1) * np.cos(lat2) * np.sin(np.radians(dlng) * 0.5) ** 2
+        dist = 2 * EARTH_RADIUS_KM * np.arcsin(np.sqrt(np.clip(h, 0.0, 1.0)))
+    # NaN 坐标 -> inf, 与 calculate_distance 对无效位置的处理一致
+    return np.where(np.isnan(dist), np.inf, dist)
+
+
+def distance_matrix(coords_a, coords_b, method="haversine", map_bounds=None, chunk_size=None, out=None):
+    """
+    计算两组坐标之间的成对距离矩阵 (km)。
+
+    Args:
+        coords_a (array-like): (N, 2) 的 [lat, lng] 数组
+        coords_b (array-like): (M, 2) 的 [lat, lng] 数组
+        method (str): 'haversine' | 'equirectangular' | 'planar' | 'auto'。
+                      'planar' 与 calculate_distance 的结果一致, 调度器需要保持原有语义时使用。
+        map_bounds (dict): method='auto' 时用于判断区域大小
+        chunk_size (int): 每次计算的行数。为 None 时一次性计算;
+                          对于非常大的 用户 x 充电桩 乘积, 设置该值以限制临时内存。
+        out (np.ndarray): 可选的 (N, M) 输出数组 (例如 np.memmap)
+
+    Returns:
+        np.ndarray: (N, M) 距离矩阵, 无效坐标对应 inf
+    """
+    a = np.asarray(coords_a, dtype=np.float64).reshape(-1, 2)
+    b = np.asarray(coords_b, dtype=np.float64).reshape(-1, 2)
+    method = resolve_distance_method(method, map_bounds)
+
+    if chunk_size is None and out is None:
+        return _pairwise_block(a, b, method)
+
+    if out is None:
+        out = np.empty((a.shape[0], b.shape[0]), dtype=np.float64)
+    step = chunk_size if chunk_size and chunk_size > 0 else DEFAULT_DISTANCE_CHUNK
+    for start in range(0, a.shape[0], step):
+        out[start:start + step] = _pairwise_block(a[start:start + step], b, method)
+    return out
+
+
+def iter_distance_chunks(coords_a, coords_b, method="haversine", map_bounds=None, chunk_size=DEFAULT_DISTANCE_CHUNK):
+    """
+    按行分块生成距离矩阵, 每次产出 (start_row, block)。
+
+    适用于不需要保存完整矩阵的场景 (例如每个用户只取最近的 k 个充电桩),
+    峰值内存为 chunk_size x M。
+    """
+    a = np.asarray(coords_a, dtype=np.float64).reshape(-1, 2)
+    b = np.asarray(coords_b, dtype=np.float64).reshape(-1, 2)
+    method = resolve_distance_method(method, map_bounds)
+    step = chunk_size if chunk_size and chunk_size > 0 else DEFAULT_DISTANCE_CHUNK
+    for start in range(0, a.shape[0], step):
+        yield start, _pairwise_block(a[start:start + step], b, method)
+
+
+def distances_one_to_many(point, coords, method="haversine", map_bounds=None):
+    """计算单个位置 (dict 或 [lat, lng]) 到一组坐标的距离, 返回 (M,) 数组"""
+    if isinstance(point, dict):
+        point = positions_to_array([point])
+    return distance_matrix(point, coords, method=method, map_bounds=map_bounds)[0]
+
+
+def distances_many_to_one(coords, point, method="haversine", map_bounds=None):
+    """计算一组坐标到单个位置 (dict 或 [lat, lng]) 的距离, 返回 (N,) 数组"""
+    if isinstance(point, dict):
+        point = positions_to_array([point])
+    return distance_matrix(coords, point, method=method, map_bounds=map_bounds)[:, 0]